@@ -1,23 +1,767 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, g, stream_with_context
 from flask_cors import CORS
+from werkzeug.exceptions import HTTPException
 import sqlite3
 import json
-from datetime import datetime
+import operator
+from datetime import datetime, date, timedelta
+import click
+import functools
 import os
+import pathlib
+import queue
+import bisect
+import hashlib
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict, defaultdict
 
-app = Flask(__name__)
-CORS(app)
+import numpy
+
+# Routes, hooks and CLI commands live on this blueprint; create_app builds the app
+api = Blueprint('api', __name__, cli_group=None)
+
+# Defaults for create_app; each section below adds its own settings
+DEFAULT_CONFIG = {}
 
 # Database configuration
-DATABASE = 'fitness_tracker.db'
+DEFAULT_CONFIG.update(
+    DATABASE=os.environ.get('DATABASE_PATH', 'fitness_tracker.db'),
+    DB_POOL_SIZE=int(os.environ.get('DB_POOL_SIZE', 8)),
+    DB_POOL_TIMEOUT=float(os.environ.get('DB_POOL_TIMEOUT', 5)),
+    DB_POOL_IDLE_TIMEOUT=float(os.environ.get('DB_POOL_IDLE_TIMEOUT', 300)),
+    DB_PRAGMAS={
+        'journal_mode': os.environ.get('DB_JOURNAL_MODE', 'WAL'),
+        'synchronous': os.environ.get('DB_SYNCHRONOUS', 'NORMAL'),
+        # Negative cache_size is in KiB
+        'cache_size': int(os.environ.get('DB_CACHE_SIZE', -20000)),
+        'mmap_size': int(os.environ.get('DB_MMAP_SIZE', 256 * 1024 * 1024)),
+        'busy_timeout': int(os.environ.get('DB_BUSY_TIMEOUT', 5000)),
+        'foreign_keys': 'ON'
+    }
+)
 
-def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
+class PooledConnection:
+    """A sqlite3 connection on loan from the pool; close() hands it back."""
+    
+    def __init__(self, pool, conn, statements=None):
+        self._pool = pool
+        self._conn = conn
+        # When set, every statement and its execution time is appended here
+        self._statements = statements
+    
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+    
+    def execute(self, sql, parameters=()):
+        if self._statements is None:
+            return self._conn.execute(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return self._conn.execute(sql, parameters)
+        finally:
+            self._statements.append((sql, time.perf_counter() - started))
+    
+    def executemany(self, sql, seq_of_parameters):
+        if self._statements is None:
+            return self._conn.executemany(sql, seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            return self._conn.executemany(sql, seq_of_parameters)
+        finally:
+            self._statements.append((sql, time.perf_counter() - started))
+    
+    def close(self):
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+class ConnectionPool:
+    """Bounded pool of long-lived SQLite connections with idle eviction."""
+    
+    def __init__(self, database, size, timeout, idle_timeout, pragmas, common=None):
+        self.database = database
+        # For an extra shard, the main database to attach read-only
+        self.common = common
+        self.size = size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.pragmas = pragmas
+        # When set, every new connection passes each statement it runs to it
+        self.trace = None
+        self._idle = []
+        self._open = 0
+        self._lock = threading.Condition()
+        self._stats = {'hits': 0, 'misses': 0, 'waits': 0, 'wait_time': 0.0,
+                       'timeouts': 0, 'evictions': 0}
+    
+    def _connect(self):
+        if self.common is None:
+            conn = sqlite3.connect(self.database, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.database, check_same_thread=False, uri=True, factory=ShardConnection)
+        conn.row_factory = sqlite3.Row
+        if self.trace is not None:
+            conn.set_trace_callback(self.trace)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        if self.common is not None:
+            attach_common(conn, self.common)
+        return conn
+    
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        while self._idle and self._idle[0][1] < cutoff:
+            conn, _ = self._idle.pop(0)
+            conn.close()
+            self._open -= 1
+            self._stats['evictions'] += 1
+    
+    def acquire(self):
+        with self._lock:
+            self._evict_idle()
+            if not self._idle and self._open >= self.size:
+                self._stats['waits'] += 1
+                started = time.monotonic()
+                self._lock.wait_for(lambda: self._idle or self._open < self.size, self.timeout)
+                self._stats['wait_time'] += time.monotonic() - started
+                if not self._idle and self._open >= self.size:
+                    self._stats['timeouts'] += 1
+                    raise sqlite3.OperationalError('Timed out waiting for a database connection')
+            if self._idle:
+                # Most recently used first, so the page cache stays warm
+                conn, _ = self._idle.pop()
+                self._stats['hits'] += 1
+                return conn
+            self._open += 1
+            self._stats['misses'] += 1
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._open -= 1
+                self._lock.notify()
+            raise
+    
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self._idle.append((conn, time.monotonic()))
+            self._lock.notify()
+    
+    def close_all(self):
+        with self._lock:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                conn.close()
+                self._open -= 1
+    
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size=self.size, open=self._open, idle=len(self._idle))
+
+def get_db_connection(shard=0):
+    pool = current_app.extensions['shards']['pools'][shard]
+    conn = PooledConnection(pool, pool.acquire(), g.get('sql_statements'))
+    # Remember the loan so it is returned even if the handler raises
+    g.setdefault('db_connections', []).append(conn)
     return conn
 
-def init_db():
-    conn = get_db_connection()
+def release_db_connections(exception):
+    for conn in g.pop('db_connections', []):
+        conn.close()
+
+# Write queue
+# Mutations run as functions on a single writer thread per process. Jobs that
+# arrive within a short window share one transaction and one commit; each job
+# runs inside its own savepoint, so one caller's IntegrityError is rolled back
+# and raised to that caller alone while the rest of the batch still commits.
+DEFAULT_CONFIG.update(
+    WRITE_QUEUE_ENABLED=os.environ.get('WRITE_QUEUE_ENABLED', '1') != '0',
+    WRITE_BATCH_WINDOW_MS=float(os.environ.get('WRITE_BATCH_WINDOW_MS', 0)),
+    WRITE_BATCH_MAX=int(os.environ.get('WRITE_BATCH_MAX', 64)),
+    WRITE_TIMEOUT_MS=float(os.environ.get('WRITE_TIMEOUT_MS', 30000))
+)
+
+class WriteJob:
+    def __init__(self, write, statements):
+        self.write = write
+        self.statements = statements
+        self.done = threading.Event()
+        self.abandoned = False
+        self.result = None
+        self.error = None
+
+class WriteQueue:
+    """Funnels writes through one thread and group-commits them."""
+    
+    def __init__(self, pool, window, max_batch, timeout):
+        self.pool = pool
+        self.window = window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._jobs = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats = {'jobs': 0, 'batches': 0, 'failed_batches': 0}
+    
+    def _ensure_started(self):
+        # Started lazily so forked workers each get their own writer
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+                self._thread.start()
+    
+    def submit(self, write, statements=None):
+        self._ensure_started()
+        job = WriteJob(write, statements)
+        self._jobs.put(job)
+        if not job.done.wait(self.timeout):
+            # Skipped if the writer has not reached it yet; one already running
+            # still commits
+            job.abandoned = True
+            raise sqlite3.OperationalError('Timed out waiting for the database writer')
+        if job.error is not None:
+            raise job.error
+        return job.result
+    
+    def _collect(self):
+        batch = [self._jobs.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self._jobs.get(timeout=timeout) if timeout > 0 else self._jobs.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+    
+    def _run(self):
+        # Every job's done event is set whatever happens to its batch, and the
+        # loop outlives any failure, so submit() never waits on a dead thread
+        conn = None
+        while True:
+            batch = self._collect()
+            try:
+                if conn is None:
+                    conn = self.pool._connect()
+                    conn.isolation_level = None
+                self._commit(conn, batch)
+            except BaseException as e:
+                # The batch as a whole failed (e.g. the database stayed locked)
+                for job in batch:
+                    job.result, job.error = None, e
+                self._stats['failed_batches'] += 1
+                conn = self._rollback(conn)
+            finally:
+                self._stats['jobs'] += len(batch)
+                self._stats['batches'] += 1
+                for job in batch:
+                    job.done.set()
+    
+    def _commit(self, conn, batch):
+        conn.execute('BEGIN IMMEDIATE')
+        for job in batch:
+            if job.abandoned:
+                continue
+            conn.execute('SAVEPOINT job')
+            try:
+                job.result = job.write(PooledConnection(None, conn, job.statements))
+                conn.execute('RELEASE job')
+            except Exception as e:
+                conn.execute('ROLLBACK TO job')
+                conn.execute('RELEASE job')
+                job.error = e
+        conn.execute('COMMIT')
+    
+    def _rollback(self, conn):
+        # Returns the connection to reuse, or None if it could not be rolled
+        # back and the next batch should open a fresh one
+        try:
+            if conn is not None and conn.in_transaction:
+                conn.execute('ROLLBACK')
+            return conn
+        except BaseException:
+            try:
+                conn.close()
+            except BaseException:
+                pass
+            return None
+    
+    def stats(self):
+        return dict(self._stats)
+
+def run_write(write, shard=0):
+    # Run write(conn) in a transaction and return its result. The function must
+    # not commit; errors it raises are rolled back and re-raised here.
+    statements = g.get('sql_statements')
+    if current_app.config['WRITE_QUEUE_ENABLED']:
+        return current_app.extensions['shards']['queues'][shard].submit(write, statements)
+    conn = get_db_connection(shard)
+    try:
+        result = write(conn)
+        conn.commit()
+        return result
+    finally:
+        conn.close()
+
+# A client error raised from inside a write; the write is rolled back and the
+# error returned as JSON
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+@api.app_errorhandler(ApiError)
+def handle_api_error(error):
+    return jsonify({'error': error.message}), error.status
+
+def perform_write(operation, data, **args):
+    # Run a write operation for a single-resource endpoint, on the shard it touches
+    shard = write_shard(request.endpoint, args, data) or 0
+    body, status = run_write(lambda conn: operation(conn, data, **args), shard)
+    return jsonify(body), status
+
+# Sharding
+# Optional: with SHARD_DATABASES set, each user's workout history (workouts,
+# templates, rollups, records, imports) lives in one of several SQLite files,
+# each with its own pool and writer thread, so writes for users on different
+# shards commit in parallel. Shard 0 is the main database, which also holds the
+# users and the exercise catalog; the extra shards attach it read-only and see
+# those two tables through temporary views. SQLite cannot enforce a foreign key
+# across files, so the extra shards run without foreign keys and the write
+# operations check those references themselves (check_references).
+# user_shards records the shard of every user, picked when the user is created
+# as the user id modulo the shard count; move-user and rebalance-shards move
+# users between shards while the API is stopped.
+DEFAULT_CONFIG.update(
+    SHARD_DATABASES=[path for path in os.environ.get('SHARD_DATABASES', '').split(',') if path],
+    SHARD_CACHE_SIZE=int(os.environ.get('SHARD_CACHE_SIZE', 100000))
+)
+
+# Shard k allocates ids from k << SHARD_ID_BITS, so a row id names its shard
+SHARD_ID_BITS = 40
+# Tables the extra shards read from the main database
+COMMON_TABLES = ('users', 'exercises')
+
+class ShardConnection(sqlite3.Connection):
+    """A connection to one of the extra shards (see attach_common)."""
+
+def on_shard(conn):
+    return isinstance(getattr(conn, '_conn', conn), ShardConnection)
+
+def attach_common(conn, database):
+    uri = pathlib.Path(database).resolve().as_uri() + '?mode=ro'
+    conn.execute('ATTACH DATABASE ? AS common', (uri,))
+    for table in COMMON_TABLES:
+        # Temporary objects resolve before the shard's own, always empty, tables
+        conn.execute(f'CREATE TEMP VIEW {table} AS SELECT * FROM common.{table}')
+
+def reserve_shard_ids(conn, shard):
+    base = shard << SHARD_ID_BITS
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE '%AUTOINCREMENT%'"
+    ).fetchall()]
+    for table in tables:
+        conn.execute('''
+            INSERT INTO sqlite_sequence (name, seq)
+            SELECT ?, 0 WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)
+        ''', (table, table))
+        conn.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ? AND seq < ?', (base, table, base))
+    conn.commit()
+
+def shard_databases(config):
+    return [config['DATABASE']] + list(config['SHARD_DATABASES'])
+
+def sharded():
+    return len(current_app.extensions['shards']['pools']) > 1
+
+def user_shard(user_id):
+    # Users without a placement (or that do not exist) resolve to the main database
+    shards = current_app.extensions['shards']
+    if len(shards['pools']) == 1:
+        return 0
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return 0
+    # Placements only change while the API is stopped, so they are cached for good
+    shard = shards['placements'].get(user_id, 0)
+    if shard is None:
+        conn = get_db_connection()
+        row = conn.execute('SELECT shard FROM user_shards WHERE user_id = ?', (user_id,)).fetchone()
+        conn.close()
+        if row is None:
+            return 0
+        shard = row['shard']
+        shards['placements'].put(user_id, 0, shard)
+    return shard
+
+def row_shard(row_id):
+    try:
+        shard = int(row_id) >> SHARD_ID_BITS
+    except (TypeError, ValueError):
+        return 0
+    return shard if 0 <= shard < len(current_app.extensions['shards']['pools']) else 0
+
+# The shard of each user-scoped write: the first of these path or body values
+# present, naming a user or a row. Writes not listed run on the main database.
+WRITE_SHARD_KEYS = {
+    'api.create_workout': [('user_id', 'user')],
+    'api.update_workout': [('workout_id', 'row')],
+    'api.delete_workout': [('workout_id', 'row')],
+    'api.clone_workout': [('workout_id', 'row')],
+    'api.create_workout_template': [('workout_id', 'row'), ('user_id', 'user')],
+    'api.update_workout_template': [('template_id', 'row')],
+    'api.delete_workout_template': [('template_id', 'row')],
+    'api.start_workout_template': [('template_id', 'row')],
+    'api.create_workout_exercise': [('workout_id', 'row')],
+    'api.update_workout_exercise': [('exercise_id', 'row')],
+    'api.delete_workout_exercise': [('exercise_id', 'row')],
+}
+
+def write_shard(endpoint, args, body):
+    # None when the shard depends on an id a batch has not created yet
+    if not sharded():
+        return 0
+    values = dict(body if isinstance(body, dict) else {}, **args)
+    for key, kind in WRITE_SHARD_KEYS.get(endpoint, ()):
+        value = values.get(key)
+        if value is None:
+            continue
+        if isinstance(value, str) and value.startswith('$'):
+            return None
+        return user_shard(value) if kind == 'user' else row_shard(value)
+    return 0
+
+def check_references(conn, users=(), exercises=(), workouts=()):
+    # What the foreign keys check on the main database, for the extra shards
+    if not on_shard(conn):
+        return
+    for table, ids in (('users', users), ('exercises', exercises), ('workouts', workouts)):
+        ids = list(dict.fromkeys(ids))
+        if ids and conn.execute(
+            f'SELECT COUNT(*) FROM {table} WHERE id IN (SELECT value FROM json_each(?))', (json.dumps(ids),)
+        ).fetchone()[0] < len(ids):
+            raise sqlite3.IntegrityError('FOREIGN KEY constraint failed')
+
+# The tables holding a user's data on their shard, parents first: how to find
+# the user's rows in schema {db}, and which columns hold ids of other moved rows
+USER_SHARD_TABLES = [
+    ('workouts', 'user_id = :user_id', {}),
+    ('workout_exercises', 'workout_id IN (SELECT id FROM {db}.workouts WHERE user_id = :user_id)',
+     {'workout_id': 'workouts'}),
+    ('workout_templates', 'user_id = :user_id', {}),
+    ('workout_template_exercises', 'template_id IN (SELECT id FROM {db}.workout_templates WHERE user_id = :user_id)',
+     {'template_id': 'workout_templates'}),
+    ('import_jobs', 'user_id = :user_id', {}),
+    ('import_workout_map', 'job_id IN (SELECT id FROM {db}.import_jobs WHERE user_id = :user_id)',
+     {'job_id': 'import_jobs', 'workout_id': 'workouts'}),
+    ('user_daily_stats', 'user_id = :user_id', {}),
+    ('user_weekly_stats', 'user_id = :user_id', {}),
+    ('personal_records', 'user_id = :user_id', {}),
+    ('user_activity', 'user_id = :user_id', {}),
+]
+
+def delete_user_rows(conn, db, user_id):
+    for table, condition, _ in reversed(USER_SHARD_TABLES):
+        conn.execute(f'DELETE FROM {db}.{table} WHERE {condition.format(db=db)}', {'user_id': user_id})
+    # Including the tombstones the deletes just wrote: clients resync after a move
+    conn.execute(f'DELETE FROM {db}.tombstones WHERE user_id = :user_id', {'user_id': user_id})
+    conn.execute(f'DELETE FROM {db}.user_writes WHERE user_id = :user_id', {'user_id': user_id})
+    for table in ARCHIVE_TABLES:
+        conn.execute(f'DELETE FROM {db}.{table} WHERE user_id = :user_id', {'user_id': user_id})
+
+def move_user(databases, user_id, target):
+    # Copies the user's rows to the target shard, renumbered into its id range,
+    # points user_shards there and deletes the rows from the old shard. Each
+    # step commits on its own; if the copy is interrupted, running the move
+    # again starts it over. Returns the number of rows moved.
+    common = sqlite3.connect(databases[0])
+    row = common.execute('''
+        SELECT COALESCE((SELECT shard FROM user_shards WHERE user_id = users.id), 0) FROM users WHERE id = ?
+    ''', (user_id,)).fetchone()
+    if row is None:
+        common.close()
+        raise click.ClickException(f'User {user_id} not found')
+    source = row[0]
+    if source == target:
+        common.close()
+        return 0
+    
+    # Ids inside the archive rows cannot be renumbered, so archived workouts
+    # move as hot rows and the next archive-workouts run archives them again
+    conn = sqlite3.connect(databases[source])
+    restore_archive(conn, user_id)
+    conn.commit()
+    conn.close()
+    
+    conn = sqlite3.connect(databases[target])
+    conn.execute('ATTACH DATABASE ? AS source', (databases[source],))
+    conn.execute('BEGIN IMMEDIATE')
+    delete_user_rows(conn, 'main', user_id)
+    offsets = {}
+    moved = 0
+    for table, condition, references in USER_SHARD_TABLES:
+        condition = condition.format(db='source')
+        columns = [column[1] for column in conn.execute(f'PRAGMA main.table_info({table})').fetchall()]
+        if 'id' in columns:
+            low, high = conn.execute(f'SELECT MIN(id), MAX(id) FROM source.{table} WHERE {condition}',
+                                     {'user_id': user_id}).fetchone()
+            seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM main.sqlite_sequence WHERE name = ?',
+                               (table,)).fetchone()[0]
+            offsets[table] = 0 if low is None else seq + 1 - low
+            if high is not None and high + offsets[table] >= (target + 1) << SHARD_ID_BITS:
+                conn.rollback()
+                raise click.ClickException(f'Shard {target} has no ids left for {table}')
+            references = dict(references, id=table)
+        expressions = [f'{column} + {offsets[references[column]]}' if column in references else column
+                       for column in columns]
+        cursor = conn.execute(f'''
+            INSERT INTO main.{table} ({', '.join(columns)})
+            SELECT {', '.join(expressions)} FROM source.{table} WHERE {condition}
+        ''', {'user_id': user_id})
+        moved += cursor.rowcount
+    conn.commit()
+    
+    common.execute('''
+        INSERT INTO user_shards (user_id, shard, moves) VALUES (?, ?, 1)
+        ON CONFLICT (user_id) DO UPDATE SET shard = excluded.shard, moves = moves + 1
+    ''', (user_id, target))
+    common.commit()
+    common.close()
+    
+    conn.execute('BEGIN IMMEDIATE')
+    delete_user_rows(conn, 'source', user_id)
+    conn.commit()
+    conn.close()
+    return moved
+
+def refresh_max_shard(conn):
+    # Scans user_shards; for the offline commands and for startup when the
+    # stored value would refuse the configured databases
+    conn.execute('UPDATE shard_settings SET max_shard = (SELECT COALESCE(MAX(shard), 0) FROM user_shards)')
+    return conn.execute('SELECT max_shard FROM shard_settings').fetchone()[0]
+
+def refresh_placements(databases):
+    conn = sqlite3.connect(databases[0])
+    refresh_max_shard(conn)
+    conn.commit()
+    conn.close()
+
+@api.cli.command('move-user')
+@click.argument('user_id', type=int)
+@click.argument('shard', type=int)
+def move_user_command(user_id, shard):
+    """Move a user's data to another shard. Run it while the API is stopped."""
+    databases = shard_databases(current_app.config)
+    if not 0 <= shard < len(databases):
+        raise click.BadParameter(f'there are {len(databases)} shards', param_hint='SHARD')
+    moved = move_user(databases, user_id, shard)
+    refresh_placements(databases)
+    click.echo(f'Moved {moved} rows')
+
+@api.cli.command('rebalance-shards')
+def rebalance_shards_command():
+    """Move every user to the shard their id maps to now. Run it while the API is stopped."""
+    databases = shard_databases(current_app.config)
+    conn = sqlite3.connect(databases[0])
+    users = conn.execute('''
+        SELECT u.id, COALESCE(s.shard, 0) FROM users u LEFT JOIN user_shards s ON s.user_id = u.id
+    ''').fetchall()
+    conn.close()
+    moved = 0
+    for user_id, shard in users:
+        if shard != user_id % len(databases):
+            move_user(databases, user_id, user_id % len(databases))
+            moved += 1
+    refresh_placements(databases)
+    click.echo(f'Moved {moved} of {len(users)} users')
+
+# Request metrics
+DEFAULT_CONFIG.update(
+    METRICS_ENABLED=os.environ.get('METRICS_ENABLED', '1') != '0',
+    SLOW_REQUEST_MS=float(os.environ.get('SLOW_REQUEST_MS', 500))
+)
+
+# Upper bounds in seconds, Prometheus style
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class Metrics:
+    """In-process counters and latency histograms, rendered in Prometheus text format."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = defaultdict(int)
+        # Per route: non-cumulative bucket counts (last slot is +Inf), count, sum
+        self.latency = defaultdict(lambda: [[0] * (len(LATENCY_BUCKETS) + 1), 0, 0.0])
+        self.response_bytes = defaultdict(int)
+        self.statements = defaultdict(lambda: [0, 0.0])
+    
+    def observe(self, method, endpoint, status, seconds, size, statements):
+        # Keep this cheap: it runs on every request
+        key = (method, endpoint)
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        sql_seconds = 0.0
+        for _, elapsed in statements:
+            sql_seconds += elapsed
+        with self._lock:
+            self.requests[(method, endpoint, status)] += 1
+            histogram = self.latency[key]
+            histogram[0][bucket] += 1
+            histogram[1] += 1
+            histogram[2] += seconds
+            self.response_bytes[key] += size
+            counts = self.statements[key]
+            counts[0] += len(statements)
+            counts[1] += sql_seconds
+    
+    def render(self, pool_stats):
+        lines = []
+        
+        def header(name, kind, text):
+            lines.append(f'# HELP {name} {text}')
+            lines.append(f'# TYPE {name} {kind}')
+        
+        def labels(method, endpoint, **extra):
+            pairs = [('method', method), ('endpoint', endpoint)] + list(extra.items())
+            return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+        
+        with self._lock:
+            header('http_requests_total', 'counter', 'Requests handled, by route and status.')
+            for (method, endpoint, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{labels(method, endpoint, status=status)} {count}')
+            
+            header('http_request_duration_seconds', 'histogram', 'Time spent in the request handler.')
+            for (method, endpoint), (buckets, count, total) in sorted(self.latency.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(LATENCY_BUCKETS, buckets):
+                    cumulative += bucket_count
+                    lines.append(f'http_request_duration_seconds_bucket{labels(method, endpoint, le=bound)} {cumulative}')
+                lines.append(f'http_request_duration_seconds_bucket{labels(method, endpoint, le="+Inf")} {count}')
+                lines.append(f'http_request_duration_seconds_sum{labels(method, endpoint)} {total:.6f}')
+                lines.append(f'http_request_duration_seconds_count{labels(method, endpoint)} {count}')
+            
+            header('http_response_bytes_total', 'counter', 'Response body bytes sent (streamed bodies excluded).')
+            for (method, endpoint), size in sorted(self.response_bytes.items()):
+                lines.append(f'http_response_bytes_total{labels(method, endpoint)} {size}')
+            
+            header('db_statements_total', 'counter', 'SQL statements executed while handling requests.')
+            for (method, endpoint), (count, _) in sorted(self.statements.items()):
+                lines.append(f'db_statements_total{labels(method, endpoint)} {count}')
+            
+            header('db_statement_duration_seconds_total', 'counter', 'Time spent executing SQL statements.')
+            for (method, endpoint), (_, seconds) in sorted(self.statements.items()):
+                lines.append(f'db_statement_duration_seconds_total{labels(method, endpoint)} {seconds:.6f}')
+        
+        # One series per shard's pool, labelled by shard number
+        for name in sorted(pool_stats[0]):
+            header(f'db_pool_{name}', 'gauge', f'Connection pool {name.replace("_", " ")}.')
+            for shard, stats in enumerate(pool_stats):
+                lines.append(f'db_pool_{name}{{shard="{shard}"}} {stats[name]}')
+        return '\n'.join(lines) + '\n'
+
+@api.before_app_request
+def start_request_timer():
+    if current_app.config['METRICS_ENABLED']:
+        g.request_started = time.perf_counter()
+        g.sql_statements = []
+
+@api.after_app_request
+def record_request_metrics(response):
+    started = getattr(g, 'request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    statements = g.sql_statements
+    rule = request.url_rule
+    endpoint = rule.rule if rule is not None else 'unmatched'
+    size = 0 if response.is_streamed else (response.content_length or 0)
+    current_app.extensions['metrics'].observe(request.method, endpoint, response.status_code, elapsed, size, statements)
+    
+    if elapsed * 1000 >= current_app.config['SLOW_REQUEST_MS']:
+        current_app.logger.warning(
+            'Slow request %s %s: %.1f ms, %d statements\n%s',
+            request.method, request.full_path.rstrip('?'), elapsed * 1000, len(statements),
+            '\n'.join(f'  {seconds * 1000:8.2f} ms  {" ".join(sql.split())}' for sql, seconds in statements)
+        )
+    return response
+
+# Response compression
+DEFAULT_CONFIG.update(
+    COMPRESS_ENABLED=os.environ.get('COMPRESS_ENABLED', '1') != '0',
+    COMPRESS_MIN_BYTES=int(os.environ.get('COMPRESS_MIN_BYTES', 1024)),
+    COMPRESS_LEVEL=int(os.environ.get('COMPRESS_LEVEL', 6))
+)
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/plain')
+
+def compressor(encoding, level):
+    # gzip and deflate are the same stream with different framing
+    return zlib.compressobj(level, zlib.DEFLATED, 31 if encoding == 'gzip' else 15)
+
+def compress_chunks(chunks, encoding, level):
+    # Runs after the request context is gone, so the level is passed in
+    stream = compressor(encoding, level)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            # Flush per chunk (a batch of rows) so streamed lists keep arriving
+            # while they are encoded
+            data = stream.compress(chunk) + stream.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield stream.flush()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+# Registered after the metrics hook so it runs first and the metrics see the
+# compressed size
+@api.after_app_request
+def compress_response(response):
+    config = current_app.config
+    if (not config['COMPRESS_ENABLED'] or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or response.direct_passthrough):
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+    encoding = request.accept_encodings.best_match(('gzip', 'deflate'))
+    if encoding is None:
+        return response
+    
+    if response.is_streamed:
+        # Streamed lists are large by design, so they skip the size threshold
+        response.response = compress_chunks(response.response, encoding, config['COMPRESS_LEVEL'])
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < config['COMPRESS_MIN_BYTES']:
+            return response
+        stream = compressor(encoding, config['COMPRESS_LEVEL'])
+        response.set_data(stream.compress(data) + stream.flush())
+    response.headers['Content-Encoding'] = encoding
+    # The compressed body is a different representation of the same resource
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+# Schema migrations
+# PRAGMA user_version holds the number of migrations applied, so startup is a
+# single pragma read when the schema is current. Append new migrations to
+# MIGRATIONS; never edit or reorder the ones already released.
+def create_base_schema(conn):
+    # Everything up to the first versioned release. Databases created before
+    # versioning start at 0 and run this too, so it must stay idempotent.
     
     # Create users table
     conn.execute('''
@@ -79,51 +823,1319 @@ def init_db():
         )
     ''')
     
+    # Per-user progress rollups, maintained by the workout write handlers
+    rollups_exist = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'user_daily_stats'"
+    ).fetchone() is not None
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_daily_stats (
+            user_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            workouts INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            duration INTEGER NOT NULL DEFAULT 0,
+            exercises INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        )
+    ''')
+    
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_weekly_stats (
+            user_id INTEGER NOT NULL,
+            week_start DATE NOT NULL,
+            workouts INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            duration INTEGER NOT NULL DEFAULT 0,
+            exercises INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, week_start)
+        )
+    ''')
+    
+    # Bookkeeping for resumable history imports
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            committed_lines INTEGER NOT NULL DEFAULT 0,
+            workouts INTEGER NOT NULL DEFAULT 0,
+            workout_exercises INTEGER NOT NULL DEFAULT 0,
+            finished_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS import_workout_map (
+            job_id INTEGER NOT NULL,
+            source_id INTEGER NOT NULL,
+            workout_id INTEGER NOT NULL,
+            PRIMARY KEY (job_id, source_id),
+            FOREIGN KEY (job_id) REFERENCES import_jobs (id) ON DELETE CASCADE
+        )
+    ''')
+    
+    # Version counters for in-process caches, shared by every worker
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO catalog_versions (name, version) VALUES ('exercises', 0)")
+    
+    # Per-user bests for every exercise, maintained by the workout exercise writes
+    records_exist = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'personal_records'"
+    ).fetchone() is not None
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS personal_records (
+            user_id INTEGER NOT NULL,
+            exercise_id INTEGER NOT NULL,
+            max_weight REAL NOT NULL DEFAULT 0,
+            best_1rm REAL NOT NULL DEFAULT 0,
+            best_volume REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, exercise_id)
+        )
+    ''')
+    
+    # Exercise search: an FTS5 index over name and instructions, and the muscle
+    # groups JSON normalized into one row per muscle. Triggers keep both in sync.
+    search_exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'exercises_fts'"
+    ).fetchone() is not None
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS exercises_fts USING fts5(
+            name, instructions, content='exercises', content_rowid='id'
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS exercise_muscles (
+            muscle TEXT NOT NULL COLLATE NOCASE,
+            exercise_id INTEGER NOT NULL,
+            PRIMARY KEY (muscle, exercise_id),
+            FOREIGN KEY (exercise_id) REFERENCES exercises (id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_exercise_muscles_exercise ON exercise_muscles (exercise_id)')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS exercises_search_insert AFTER INSERT ON exercises BEGIN
+            INSERT INTO exercises_fts (rowid, name, instructions) VALUES (new.id, new.name, new.instructions);
+            INSERT OR IGNORE INTO exercise_muscles (muscle, exercise_id)
+                SELECT trim(value), new.id FROM json_each(
+                    CASE WHEN json_valid(new.muscle_groups) THEN new.muscle_groups ELSE '[]' END
+                ) WHERE trim(value) != '';
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS exercises_search_delete AFTER DELETE ON exercises BEGIN
+            INSERT INTO exercises_fts (exercises_fts, rowid, name, instructions)
+                VALUES ('delete', old.id, old.name, old.instructions);
+            DELETE FROM exercise_muscles WHERE exercise_id = old.id;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS exercises_search_update AFTER UPDATE ON exercises BEGIN
+            INSERT INTO exercises_fts (exercises_fts, rowid, name, instructions)
+                VALUES ('delete', old.id, old.name, old.instructions);
+            INSERT INTO exercises_fts (rowid, name, instructions) VALUES (new.id, new.name, new.instructions);
+            DELETE FROM exercise_muscles WHERE exercise_id = old.id;
+            INSERT OR IGNORE INTO exercise_muscles (muscle, exercise_id)
+                SELECT trim(value), new.id FROM json_each(
+                    CASE WHEN json_valid(new.muscle_groups) THEN new.muscle_groups ELSE '[]' END
+                ) WHERE trim(value) != '';
+        END
+    ''')
+    if not search_exists:
+        # Index exercises that predate the search tables
+        conn.execute("INSERT INTO exercises_fts (exercises_fts) VALUES ('rebuild')")
+        conn.execute('''
+            INSERT OR IGNORE INTO exercise_muscles (muscle, exercise_id)
+            SELECT trim(j.value), e.id
+            FROM exercises e, json_each(
+                CASE WHEN json_valid(e.muscle_groups) THEN e.muscle_groups ELSE '[]' END
+            ) j
+            WHERE trim(j.value) != ''
+        ''')
+    
+    # Nothing is archived yet; the archive tables come in a later migration
+    if not rollups_exist:
+        fill_rollups(conn, archived=False)
+    if not records_exist:
+        rebuild_personal_records(conn, archived=False)
+    
+    # Secondary indexes, one per hot query (see check-query-plans)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_workouts_user_date ON workouts (user_id, date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_workouts_date ON workouts (date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_workout_exercises_workout ON workout_exercises (workout_id)')
+    conn.execute('DROP INDEX IF EXISTS idx_workout_exercises_exercise')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_workout_exercises_exercise_workout ON workout_exercises (exercise_id, workout_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_exercises_name ON exercises (name)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_exercises_category ON exercises (category)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_exercises_equipment ON exercises (equipment)')
+
+# Tables the sync API serves, with how a tombstone finds the owning user
+SYNC_TABLES = {
+    'users': 'old.id',
+    'exercises': 'NULL',
+    'workouts': 'old.user_id',
+    'workout_exercises': '(SELECT user_id FROM workouts WHERE id = old.workout_id)',
+}
+
+def add_change_tracking(conn):
+    # One global counter orders every change. Triggers stamp inserted and
+    # updated rows with the next value and record deletes as tombstones, so
+    # every write path (handlers, batch, import, cascades) is covered.
+    conn.execute('''
+        CREATE TABLE sync_sequence (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            seq INTEGER NOT NULL,
+            pruned_seq INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    # Existing rows all count as the first change
+    conn.execute('INSERT INTO sync_sequence (id, seq) VALUES (1, 1)')
+    conn.execute('''
+        CREATE TABLE tombstones (
+            seq INTEGER NOT NULL,
+            entity TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            user_id INTEGER,
+            deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_tombstones_seq ON tombstones (seq)')
+    conn.execute('CREATE INDEX idx_tombstones_user_seq ON tombstones (user_id, seq)')
+    
+    for table, owner in SYNC_TABLES.items():
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0')
+        conn.execute(f'UPDATE {table} SET change_seq = 1')
+        conn.execute(f'CREATE INDEX idx_{table}_change_seq ON {table} (change_seq)')
+        stamp = f'''
+            UPDATE sync_sequence SET seq = seq + 1;
+            UPDATE {table} SET change_seq = (SELECT seq FROM sync_sequence) WHERE id = new.id;
+        '''
+        conn.execute(f'CREATE TRIGGER {table}_sync_insert AFTER INSERT ON {table} BEGIN {stamp} END')
+        # Skip the update the triggers make themselves
+        conn.execute(f'''
+            CREATE TRIGGER {table}_sync_update AFTER UPDATE ON {table}
+            WHEN new.change_seq IS old.change_seq BEGIN {stamp} END
+        ''')
+        # Exercises removed by a workout's cascade need no tombstones of their
+        # own: clients drop them with the workout
+        condition = ('WHEN EXISTS (SELECT 1 FROM workouts WHERE id = old.workout_id)'
+                     if table == 'workout_exercises' else '')
+        conn.execute(f'''
+            CREATE TRIGGER {table}_sync_delete AFTER DELETE ON {table} {condition} BEGIN
+                UPDATE sync_sequence SET seq = seq + 1;
+                INSERT INTO tombstones (seq, entity, row_id, user_id)
+                    SELECT seq, '{table}', old.id, {owner} FROM sync_sequence;
+            END
+        ''')
+    conn.execute('CREATE INDEX idx_workouts_user_change_seq ON workouts (user_id, change_seq)')
+    
+    # Stamping an exercise is an UPDATE, so the search index trigger must only
+    # react to the columns it indexes; a newly inserted row is not in it yet
+    conn.execute('DROP TRIGGER exercises_search_update')
+    conn.execute('''
+        CREATE TRIGGER exercises_search_update AFTER UPDATE OF name, instructions, muscle_groups ON exercises BEGIN
+            INSERT INTO exercises_fts (exercises_fts, rowid, name, instructions)
+                VALUES ('delete', old.id, old.name, old.instructions);
+            INSERT INTO exercises_fts (rowid, name, instructions) VALUES (new.id, new.name, new.instructions);
+            DELETE FROM exercise_muscles WHERE exercise_id = old.id;
+            INSERT OR IGNORE INTO exercise_muscles (muscle, exercise_id)
+                SELECT trim(value), new.id FROM json_each(
+                    CASE WHEN json_valid(new.muscle_groups) THEN new.muscle_groups ELSE '[]' END
+                ) WHERE trim(value) != '';
+        END
+    ''')
+
+def add_activity_calendar(conn):
+    # Per-user activity bitmap and streaks, maintained with the rollups
+    conn.execute('''
+        CREATE TABLE user_activity (
+            user_id INTEGER PRIMARY KEY,
+            start_day INTEGER NOT NULL,
+            bits BLOB NOT NULL,
+            longest_streak INTEGER NOT NULL DEFAULT 0,
+            last_day INTEGER,
+            last_streak INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+    rebuild_activity(conn)
+
+# Owner of a new workout or workout exercise row, for user_writes
+NEW_ROW_OWNERS = {
+    'workouts': 'new.user_id',
+    'workout_exercises': '(SELECT user_id FROM workouts WHERE id = new.workout_id)',
+}
+
+def add_user_write_tracking(conn):
+    # The change sequence value of each user's last workout history write, so
+    # per-user caches can tell when they are stale with one primary key read
+    conn.execute('''
+        CREATE TABLE user_writes (
+            user_id INTEGER PRIMARY KEY,
+            seq INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('INSERT INTO user_writes (user_id, seq) SELECT id, (SELECT seq FROM sync_sequence) FROM users')
+    for table, new_owner in NEW_ROW_OWNERS.items():
+        for event, owner, condition in (
+            ('insert', new_owner, ''),
+            ('update', new_owner, 'WHEN new.change_seq IS old.change_seq'),
+            ('delete', SYNC_TABLES[table], ''),
+        ):
+            # A workout exercise deleted by its workout's cascade has no owner
+            # left; the workout's own delete records the write
+            conn.execute(f'''
+                CREATE TRIGGER {table}_user_write_{event} AFTER {event.upper()} ON {table} {condition} BEGIN
+                    INSERT INTO user_writes (user_id, seq)
+                        SELECT {owner}, seq FROM sync_sequence WHERE {owner} IS NOT NULL
+                        ON CONFLICT (user_id) DO UPDATE SET seq = excluded.seq;
+                END
+            ''')
+
+def add_workout_templates(conn):
+    conn.execute('''
+        CREATE TABLE workout_templates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE workout_template_exercises (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            template_id INTEGER NOT NULL,
+            exercise_id INTEGER NOT NULL,
+            sets INTEGER NOT NULL,
+            reps INTEGER NOT NULL,
+            weight REAL DEFAULT 0,
+            rest_time INTEGER DEFAULT 60,
+            notes TEXT,
+            FOREIGN KEY (template_id) REFERENCES workout_templates (id) ON DELETE CASCADE,
+            FOREIGN KEY (exercise_id) REFERENCES exercises (id)
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_workout_templates_user ON workout_templates (user_id)')
+    conn.execute('CREATE INDEX idx_workout_template_exercises_template ON workout_template_exercises (template_id)')
+    conn.execute('CREATE INDEX idx_workout_template_exercises_exercise ON workout_template_exercises (exercise_id)')
+
+def add_shard_directory(conn):
+    # The shard count new users are placed by, and where every user lives;
+    # users that predate sharding stay on the main database
+    conn.execute('''
+        CREATE TABLE shard_settings (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            shards INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('INSERT INTO shard_settings (id, shards) VALUES (1, 1)')
+    conn.execute('''
+        CREATE TABLE user_shards (
+            user_id INTEGER PRIMARY KEY,
+            shard INTEGER NOT NULL,
+            moves INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+    conn.execute('INSERT INTO user_shards (user_id, shard) SELECT id, 0 FROM users')
+
+def add_workout_archive(conn):
+    # Completed workouts past the archive horizon, moved out of the hot tables
+    # by archive-workouts (see the Workout archive section)
+    conn.execute('''
+        CREATE TABLE workout_archive (
+            user_id INTEGER NOT NULL,
+            year TEXT NOT NULL,
+            workouts INTEGER NOT NULL,
+            exercises INTEGER NOT NULL,
+            first_date DATE NOT NULL,
+            last_date DATE NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (user_id, year),
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE archived_workouts (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            year TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE archived_records (
+            user_id INTEGER NOT NULL,
+            exercise_id INTEGER NOT NULL,
+            max_weight REAL NOT NULL,
+            best_1rm REAL NOT NULL,
+            best_volume REAL NOT NULL,
+            PRIMARY KEY (user_id, exercise_id),
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
+            FOREIGN KEY (exercise_id) REFERENCES exercises (id)
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_archived_workouts_user ON archived_workouts (user_id)')
+    conn.execute('CREATE INDEX idx_archived_records_exercise ON archived_records (exercise_id)')
+
+def add_query_plan_indexes(conn):
+    # Indexes for the plans check-query-plans found sorting or scanning once it
+    # checked the statements the handlers really run
+    conn.execute('CREATE INDEX idx_workout_exercises_workout_exercise ON workout_exercises (workout_id, exercise_id)')
+    conn.execute('CREATE INDEX idx_import_jobs_user ON import_jobs (user_id)')
+    conn.execute('DROP INDEX IF EXISTS idx_exercises_category')
+    conn.execute('DROP INDEX IF EXISTS idx_exercises_equipment')
+    conn.execute('CREATE INDEX idx_exercises_category_name ON exercises (category, name)')
+    conn.execute('CREATE INDEX idx_exercises_equipment_name ON exercises (equipment, name)')
+    conn.execute('CREATE INDEX idx_workout_archive_last_date ON workout_archive (last_date)')
+
+def add_archived_workout_exercises(conn):
+    # Which archived workout holds a workout exercise id, so a write to one can
+    # move its workout back into the hot tables (see unarchive_workout)
+    conn.execute('''
+        CREATE TABLE archived_workout_exercises (
+            id INTEGER PRIMARY KEY,
+            workout_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_archived_workout_exercises_user ON archived_workout_exercises (user_id)')
+    for row in conn.execute('SELECT user_id, data FROM workout_archive').fetchall():
+        conn.executemany('INSERT INTO archived_workout_exercises (id, workout_id, user_id) VALUES (?, ?, ?)', [
+            (exercise['id'], workout['id'], row[0])
+            for workout in decode_archive(row[1]) for exercise in workout['exercises']
+        ])
+
+def add_max_shard(conn):
+    # The highest shard any user is placed on, so startup can check it against
+    # the configured databases without reading user_shards. Placements only
+    # raise it here; move-user and rebalance-shards lower it again.
+    conn.execute('ALTER TABLE shard_settings ADD COLUMN max_shard INTEGER NOT NULL DEFAULT 0')
+    refresh_max_shard(conn)
+    for event in ('INSERT', 'UPDATE OF shard'):
+        conn.execute(f'''
+            CREATE TRIGGER user_shards_{event.split()[0].lower()}_max_shard AFTER {event} ON user_shards
+            WHEN new.shard > (SELECT max_shard FROM shard_settings) BEGIN
+                UPDATE shard_settings SET max_shard = new.shard;
+            END
+        ''')
+
+MIGRATIONS = [
+    create_base_schema,
+    add_change_tracking,
+    add_activity_calendar,
+    add_user_write_tracking,
+    add_workout_templates,
+    add_shard_directory,
+    add_workout_archive,
+    add_query_plan_indexes,
+    add_archived_workout_exercises,
+    add_max_shard,
+]
+
+def migrate(conn):
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version >= len(MIGRATIONS):
+        return 0
+    # Another worker may be migrating too; whoever gets the write lock first
+    # does the work and the rest find the schema current
+    conn.execute('BEGIN IMMEDIATE')
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number in range(version, len(MIGRATIONS)):
+        MIGRATIONS[number](conn)
+        conn.execute(f'PRAGMA user_version = {number + 1}')
+    conn.commit()
+    return len(MIGRATIONS) - version
+
+def seed_sample_data(conn):
     # Insert sample data if tables are empty
     user_count = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
-    if user_count == 0:
-        # Insert sample user
+    if user_count > 0:
+        return False
+    
+    # Insert sample user
+    conn.execute('''
+        INSERT INTO users (name, email, age, weight, height, goal)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', ('John Doe', 'john@example.com', 28, 75.5, 180, 'Build Muscle'))
+    
+    # Insert sample exercises
+    sample_exercises = [
+        ('Push-ups', 'Chest', '["Chest", "Triceps", "Shoulders"]', 'Bodyweight', 'Start in plank position, lower body to ground, push back up'),
+        ('Squats', 'Legs', '["Quadriceps", "Glutes", "Hamstrings"]', 'Bodyweight', 'Stand with feet shoulder-width apart, lower hips back and down, return to standing'),
+        ('Pull-ups', 'Back', '["Back", "Biceps"]', 'Pull-up bar', 'Hang from bar, pull body up until chin clears bar, lower with control'),
+        ('Bench Press', 'Chest', '["Chest", "Triceps", "Shoulders"]', 'Barbell', 'Lie on bench, lower bar to chest, press up to full extension'),
+        ('Deadlift', 'Back', '["Back", "Glutes", "Hamstrings"]', 'Barbell', 'Stand with bar over feet, hinge at hips, lift bar by extending hips and knees'),
+        ('Shoulder Press', 'Shoulders', '["Shoulders", "Triceps"]', 'Dumbbells', 'Press weights overhead from shoulder height, lower with control'),
+        ('Plank', 'Core', '["Abs", "Obliques"]', 'Bodyweight', 'Hold body in straight line from head to heels, engage core muscles'),
+        ('Lunges', 'Legs', '["Quadriceps", "Glutes", "Hamstrings"]', 'Bodyweight', 'Step forward into lunge position, return to standing, alternate legs')
+    ]
+    
+    for exercise in sample_exercises:
         conn.execute('''
-            INSERT INTO users (name, email, age, weight, height, goal)
+            INSERT INTO exercises (name, category, muscle_groups, equipment, instructions)
+            VALUES (?, ?, ?, ?, ?)
+        ''', exercise)
+    bump_catalog_version(conn)
+    conn.commit()
+    return True
+
+@api.cli.command('seed')
+def seed_command():
+    """Insert the sample user and exercise library into an empty database."""
+    conn = get_db_connection()
+    if seed_sample_data(conn):
+        click.echo('Inserted sample data')
+    else:
+        click.echo('Database already has users; nothing seeded')
+    conn.close()
+
+# Progress rollups
+# Weeks start on Sunday to match the buckets the frontend has always shown
+ROLLUP_TABLES = (
+    ('user_daily_stats', 'day'),
+    ('user_weekly_stats', 'week_start'),
+)
+
+# A workout date: a calendar day, optionally followed by a time
+WORKOUT_DATE = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+def week_start(day):
+    day_date = datetime.strptime(day, '%Y-%m-%d').date()
+    return (day_date - timedelta(days=(day_date.weekday() + 1) % 7)).isoformat()
+
+def workout_day(value):
+    # The calendar day of a workout date, or None if it does not start with one
+    if not isinstance(value, str) or not WORKOUT_DATE.match(value):
+        return None
+    try:
+        datetime.strptime(value[:10], '%Y-%m-%d')
+    except ValueError:
+        return None
+    return value[:10]
+
+def workout_contribution(conn, workout_id):
+    # What a single workout adds to its owner's rollups, or None if it is gone
+    row = conn.execute('''
+        SELECT w.user_id, w.date, w.completed, w.duration,
+               (SELECT COUNT(*) FROM workout_exercises we WHERE we.workout_id = w.id) as exercise_count
+        FROM workouts w
+        WHERE w.id = ?
+    ''', (workout_id,)).fetchone()
+    # Rows written before dates were checked may have none to count under
+    if row is None or workout_day(row['date']) is None:
+        return None
+    completed = 1 if row['completed'] else 0
+    return {
+        'user_id': row['user_id'],
+        'day': workout_day(row['date']),
+        'workouts': 1,
+        'completed': completed,
+        'duration': (row['duration'] or 0) if completed else 0,
+        'exercises': row['exercise_count'] if completed else 0
+    }
+
+def apply_contribution(conn, contribution, sign):
+    if contribution is None:
+        return
+    day = contribution['day']
+    for table, key in ROLLUP_TABLES:
+        bucket = day if key == 'day' else week_start(day)
+        conn.execute(f'''
+            INSERT INTO {table} (user_id, {key}, workouts, completed, duration, exercises)
             VALUES (?, ?, ?, ?, ?, ?)
-        ''', ('John Doe', 'john@example.com', 28, 75.5, 180, 'Build Muscle'))
-        
-        # Insert sample exercises
-        sample_exercises = [
-            ('Push-ups', 'Chest', '["Chest", "Triceps", "Shoulders"]', 'Bodyweight', 'Start in plank position, lower body to ground, push back up'),
-            ('Squats', 'Legs', '["Quadriceps", "Glutes", "Hamstrings"]', 'Bodyweight', 'Stand with feet shoulder-width apart, lower hips back and down, return to standing'),
-            ('Pull-ups', 'Back', '["Back", "Biceps"]', 'Pull-up bar', 'Hang from bar, pull body up until chin clears bar, lower with control'),
-            ('Bench Press', 'Chest', '["Chest", "Triceps", "Shoulders"]', 'Barbell', 'Lie on bench, lower bar to chest, press up to full extension'),
-            ('Deadlift', 'Back', '["Back", "Glutes", "Hamstrings"]', 'Barbell', 'Stand with bar over feet, hinge at hips, lift bar by extending hips and knees'),
-            ('Shoulder Press', 'Shoulders', '["Shoulders", "Triceps"]', 'Dumbbells', 'Press weights overhead from shoulder height, lower with control'),
-            ('Plank', 'Core', '["Abs", "Obliques"]', 'Bodyweight', 'Hold body in straight line from head to heels, engage core muscles'),
-            ('Lunges', 'Legs', '["Quadriceps", "Glutes", "Hamstrings"]', 'Bodyweight', 'Step forward into lunge position, return to standing, alternate legs')
+            ON CONFLICT (user_id, {key}) DO UPDATE SET
+                workouts = workouts + excluded.workouts,
+                completed = completed + excluded.completed,
+                duration = duration + excluded.duration,
+                exercises = exercises + excluded.exercises
+        ''', (
+            contribution['user_id'],
+            bucket,
+            sign * contribution['workouts'],
+            sign * contribution['completed'],
+            sign * contribution['duration'],
+            sign * contribution['exercises']
+        ))
+        conn.execute(f'DELETE FROM {table} WHERE user_id = ? AND {key} = ? AND workouts <= 0',
+                     (contribution['user_id'], bucket))
+
+def update_rollups(conn, workout_id, before):
+    # Replace a workout's previous contribution with its current one.
+    # Runs on the caller's connection so it commits with the write itself.
+    after = workout_contribution(conn, workout_id)
+    apply_contribution(conn, before, -1)
+    apply_contribution(conn, after, 1)
+    update_activity(conn, before, after)
+
+def fill_rollups(conn, archived=True):
+    for table, _ in ROLLUP_TABLES:
+        conn.execute(f'DELETE FROM {table}')
+    workout_ids = [row[0] for row in conn.execute('SELECT id FROM workouts').fetchall()]
+    for workout_id in workout_ids:
+        apply_contribution(conn, workout_contribution(conn, workout_id), 1)
+    count = len(workout_ids)
+    # Archived workouts still count towards the rollups
+    if archived:
+        for row in conn.execute('SELECT user_id, data FROM workout_archive').fetchall():
+            for workout in decode_archive(row[1]):
+                apply_contribution(conn, archived_contribution(row[0], workout), 1)
+                count += 1
+    return count
+
+def rebuild_rollups(conn):
+    count = fill_rollups(conn)
+    rebuild_activity(conn)
+    rebuild_personal_records(conn)
+    conn.commit()
+    return count
+
+@api.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Regenerate the progress rollups and personal records from the raw workout tables."""
+    count = 0
+    for shard in range(len(current_app.extensions['shards']['pools'])):
+        conn = get_db_connection(shard)
+        count += rebuild_rollups(conn)
+        conn.close()
+    click.echo(f'Rebuilt rollups from {count} workouts')
+
+# Activity calendar
+# One bit per day with a completed workout, packed little-endian into a BLOB per
+# user: bit i is day start_day + i, counting in proleptic ordinals. start_day is
+# a multiple of 8 so earlier days are prepended a whole byte at a time. The
+# longest streak and the run ending at the last active day are kept alongside
+# and adjusted from the neighbouring bits on each change.
+def day_number(day):
+    return datetime.strptime(day, '%Y-%m-%d').date().toordinal()
+
+def ones_below(bits, index):
+    # Length of the run of set bits ending just below index
+    zeros = ~bits & ((1 << index) - 1)
+    return index - zeros.bit_length()
+
+def ones_from(bits, index):
+    # Length of the run of set bits starting at index
+    shifted = bits >> index
+    return ((shifted + 1) & ~shifted).bit_length() - 1
+
+def longest_run(bits):
+    length = 0
+    while bits:
+        bits &= bits >> 1
+        length += 1
+    return length
+
+def save_activity(conn, user_id, start_day, bits, longest):
+    top = bits.bit_length() - 1
+    conn.execute('''
+        INSERT INTO user_activity (user_id, start_day, bits, longest_streak, last_day, last_streak)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            start_day = excluded.start_day,
+            bits = excluded.bits,
+            longest_streak = excluded.longest_streak,
+            last_day = excluded.last_day,
+            last_streak = excluded.last_streak
+    ''', (
+        user_id,
+        start_day,
+        bits.to_bytes((top + 8) // 8, 'little'),
+        longest,
+        start_day + top if bits else None,
+        ones_below(bits, top + 1)
+    ))
+
+def set_activity_day(conn, user_id, day, active):
+    number = day_number(day)
+    row = conn.execute(
+        'SELECT start_day, bits, longest_streak FROM user_activity WHERE user_id = ?', (user_id,)
+    ).fetchone()
+    if row is None:
+        if not active:
+            return
+        start_day, bits, longest = number // 8 * 8, 0, 0
+    else:
+        start_day, bits, longest = row['start_day'], int.from_bytes(row['bits'], 'little'), row['longest_streak']
+    if number < start_day:
+        shift = start_day - number // 8 * 8
+        bits <<= shift
+        start_day -= shift
+    
+    index = number - start_day
+    if (bits >> index & 1) == active:
+        return
+    if active:
+        bits |= 1 << index
+        longest = max(longest, ones_below(bits, index) + ones_from(bits, index))
+    else:
+        run = ones_below(bits, index) + ones_from(bits, index)
+        bits &= ~(1 << index)
+        # Only splitting a longest run can shorten the longest streak
+        if run >= longest:
+            longest = longest_run(bits)
+    save_activity(conn, user_id, start_day, bits, longest)
+
+def update_activity(conn, before, after):
+    # A day stays active while any workout on it is completed, so its bit
+    # follows the day's completed count in the rollup
+    def active_day(contribution):
+        if contribution is not None and contribution['completed']:
+            return contribution['user_id'], contribution['day']
+        return None
+    
+    days = {active_day(before), active_day(after)}
+    if len(days) == 1:
+        return
+    days.discard(None)
+    for user_id, day in days:
+        row = conn.execute('SELECT completed FROM user_daily_stats WHERE user_id = ? AND day = ?',
+                           (user_id, day)).fetchone()
+        set_activity_day(conn, user_id, day, row is not None and row['completed'] > 0)
+
+def rebuild_activity(conn):
+    conn.execute('DELETE FROM user_activity')
+    days = defaultdict(list)
+    for row in conn.execute('SELECT user_id, day FROM user_daily_stats WHERE completed > 0'):
+        days[row['user_id']].append(day_number(row['day']))
+    for user_id, numbers in days.items():
+        start_day = min(numbers) // 8 * 8
+        bits = 0
+        for number in numbers:
+            bits |= 1 << (number - start_day)
+        save_activity(conn, user_id, start_day, bits, longest_run(bits))
+
+# Personal records
+# Estimated 1RM uses the Epley formula; a single rep is the 1RM itself
+ESTIMATED_1RM_SQL = 'CASE WHEN we.reps <= 1 THEN we.weight ELSE we.weight * (1 + we.reps / 30.0) END'
+
+def session_bests(conn, user_id, exercise_id, workout_id=None):
+    # Bests across the user's sessions, or within a single workout if given
+    query = f'''
+        SELECT MAX(max_weight) as max_weight, MAX(best_1rm) as best_1rm,
+               MAX(volume) as best_volume, COUNT(*) as sessions
+        FROM (
+            SELECT MAX(we.weight) as max_weight, MAX({ESTIMATED_1RM_SQL}) as best_1rm,
+                   SUM(we.sets * we.reps * we.weight) as volume
+            FROM workouts w
+            JOIN workout_exercises we ON we.workout_id = w.id
+            WHERE w.user_id = ? AND we.exercise_id = ?{' AND w.id = ?' if workout_id else ''}
+            GROUP BY we.workout_id
+        )
+    '''
+    params = (user_id, exercise_id, workout_id) if workout_id else (user_id, exercise_id)
+    return conn.execute(query, params).fetchone()
+
+def raise_personal_records(conn, workout_id):
+    # New or grown sets can only raise a record, so merge this workout's bests in
+    rows = conn.execute('''
+        SELECT DISTINCT w.user_id, we.exercise_id
+        FROM workouts w
+        JOIN workout_exercises we ON we.workout_id = w.id
+        WHERE w.id = ?
+    ''', (workout_id,)).fetchall()
+    for row in rows:
+        bests = session_bests(conn, row['user_id'], row['exercise_id'], workout_id)
+        conn.execute('''
+            INSERT INTO personal_records (user_id, exercise_id, max_weight, best_1rm, best_volume)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, exercise_id) DO UPDATE SET
+                max_weight = MAX(max_weight, excluded.max_weight),
+                best_1rm = MAX(best_1rm, excluded.best_1rm),
+                best_volume = MAX(best_volume, excluded.best_volume)
+        ''', (row['user_id'], row['exercise_id'], bests['max_weight'] or 0,
+              bests['best_1rm'] or 0, bests['best_volume'] or 0))
+
+def recompute_personal_record(conn, user_id, exercise_id):
+    # A removed or lowered set may have been the record, so rescan this one
+    # exercise; archived sessions are summed up in archived_records
+    bests = session_bests(conn, user_id, exercise_id)
+    archived = conn.execute('SELECT * FROM archived_records WHERE user_id = ? AND exercise_id = ?',
+                            (user_id, exercise_id)).fetchone()
+    if bests['sessions'] == 0 and archived is None:
+        conn.execute('DELETE FROM personal_records WHERE user_id = ? AND exercise_id = ?',
+                     (user_id, exercise_id))
+        return
+    values = [bests['max_weight'] or 0, bests['best_1rm'] or 0, bests['best_volume'] or 0]
+    if archived is not None:
+        values = [max(value, archived[column])
+                  for value, column in zip(values, ('max_weight', 'best_1rm', 'best_volume'))]
+    conn.execute('''
+        INSERT INTO personal_records (user_id, exercise_id, max_weight, best_1rm, best_volume)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, exercise_id) DO UPDATE SET
+            max_weight = excluded.max_weight,
+            best_1rm = excluded.best_1rm,
+            best_volume = excluded.best_volume
+    ''', (user_id, exercise_id, *values))
+
+def rebuild_personal_records(conn, archived=True):
+    archived_bests = ''
+    if archived:
+        archived_bests = '''
+            UNION ALL
+            SELECT user_id, exercise_id, max_weight, best_1rm, best_volume FROM archived_records
+        '''
+    conn.execute('DELETE FROM personal_records')
+    conn.execute(f'''
+        INSERT INTO personal_records (user_id, exercise_id, max_weight, best_1rm, best_volume)
+        SELECT user_id, exercise_id, MAX(max_weight), MAX(best_1rm), MAX(volume)
+        FROM (
+            SELECT w.user_id, we.exercise_id, MAX(we.weight) as max_weight,
+                   MAX({ESTIMATED_1RM_SQL}) as best_1rm,
+                   SUM(we.sets * we.reps * we.weight) as volume
+            FROM workouts w
+            JOIN workout_exercises we ON we.workout_id = w.id
+            GROUP BY w.user_id, we.workout_id, we.exercise_id{archived_bests}
+        )
+        GROUP BY user_id, exercise_id
+    ''')
+
+# Workout archive
+# archive-workouts moves completed workouts older than ARCHIVE_AFTER_DAYS out
+# of workouts and workout_exercises, into one zlib-compressed JSON row per user
+# and year in workout_archive on the user's shard. Each archived workout keeps
+# its columns and its exercises' columns as they were. archived_workouts and
+# archived_workout_exercises find the row for a workout or workout exercise id,
+# and archived_records holds the archived sessions' bests so personal record
+# rescans still see them. The rollups, activity and records already count the
+# workouts and are left as they are.
+# Reads check the hot tables first: get_workouts only opens an archive row when
+# the requested dates reach back into it, and get_workout and
+# get_workout_exercises when the id is not hot. A write to an archived workout
+# or one of its exercises first moves the workout back into the hot tables.
+# Sync does not serve archived workouts.
+DEFAULT_CONFIG.update(
+    ARCHIVE_AFTER_DAYS=int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+)
+
+# Archive rows are written once a run and read rarely, so compress them hard
+ARCHIVE_COMPRESS_LEVEL = 9
+# Users whose first page of workouts archive-workouts times before and after
+ARCHIVE_SAMPLE_USERS = 20
+ARCHIVE_SAMPLE_RUNS = 5
+ARCHIVE_TABLES = ('workout_archive', 'archived_workouts', 'archived_workout_exercises', 'archived_records')
+
+def encode_archive(workouts):
+    return zlib.compress(json.dumps(workouts, separators=(',', ':')).encode(), ARCHIVE_COMPRESS_LEVEL)
+
+def decode_archive(data):
+    return json.loads(zlib.decompress(data))
+
+def load_archive(conn, keys):
+    # The workouts in the given (user_id, year) archive rows, oldest first
+    workouts = []
+    for user_id, year in keys:
+        row = conn.execute('SELECT data FROM workout_archive WHERE user_id = ? AND year = ?',
+                           (user_id, year)).fetchone()
+        if row is not None:
+            workouts.extend(decode_archive(row[0]))
+    return workouts
+
+def user_archive(conn, user_id):
+    return load_archive(conn, conn.execute(
+        'SELECT user_id, year FROM workout_archive WHERE user_id = ? ORDER BY year', (user_id,)
+    ).fetchall())
+
+def archived_workout(conn, workout_id):
+    row = conn.execute('SELECT user_id, year FROM archived_workouts WHERE id = ?', (workout_id,)).fetchone()
+    if row is None:
+        return None
+    return next((workout for workout in load_archive(conn, [row]) if workout['id'] == workout_id), None)
+
+def archived_bests(workouts):
+    # The archived_records rows archive_user_workouts writes for these
+    # workouts: per exercise, the best weight, estimated 1RM and session volume
+    bests = {}
+    for workout in workouts:
+        sessions = defaultdict(list)
+        for exercise in workout['exercises']:
+            if exercise['weight'] is not None:
+                sessions[exercise['exercise_id']].append(exercise)
+        for exercise_id, rows in sessions.items():
+            session = (
+                max(row['weight'] for row in rows),
+                max(row['weight'] if row['reps'] <= 1 else row['weight'] * (1 + row['reps'] / 30.0) for row in rows),
+                sum(row['sets'] * row['reps'] * row['weight'] for row in rows)
+            )
+            best = bests.get(exercise_id, (0, 0, 0))
+            bests[exercise_id] = tuple(map(max, best, session))
+    return bests
+
+def unarchive_workout(conn, workout_id):
+    # Moves an archived workout back into the hot tables with its ids, so it
+    # can be changed like any other; archive-workouts archives it again on its
+    # next run if it still qualifies. The rollups, activity and personal
+    # records count it either way. Returns False if it is not archived.
+    row = conn.execute('SELECT user_id, year FROM archived_workouts WHERE id = ?', (workout_id,)).fetchone()
+    if row is None:
+        return False
+    user_id, year = row[0], row[1]
+    workout_id = int(workout_id)
+    workouts = load_archive(conn, [row])
+    insert_archived_workouts(conn, [workout for workout in workouts if workout['id'] == workout_id])
+    rest = [workout for workout in workouts if workout['id'] != workout_id]
+    if rest:
+        conn.execute('''
+            UPDATE workout_archive SET workouts = ?, exercises = ?, first_date = ?, last_date = ?, data = ?
+            WHERE user_id = ? AND year = ?
+        ''', (
+            len(rest),
+            sum(len(workout['exercises']) for workout in rest),
+            rest[0]['date'],
+            rest[-1]['date'],
+            encode_archive(rest),
+            user_id,
+            year
+        ))
+    else:
+        conn.execute('DELETE FROM workout_archive WHERE user_id = ? AND year = ?', (user_id, year))
+    conn.execute('DELETE FROM archived_workouts WHERE id = ?', (workout_id,))
+    conn.execute('DELETE FROM archived_workout_exercises WHERE user_id = ? AND workout_id = ?', (user_id, workout_id))
+    # The hot rows carry the workout's bests now
+    conn.execute('DELETE FROM archived_records WHERE user_id = ?', (user_id,))
+    conn.executemany('''
+        INSERT INTO archived_records (user_id, exercise_id, max_weight, best_1rm, best_volume) VALUES (?, ?, ?, ?, ?)
+    ''', [(user_id, exercise_id) + best for exercise_id, best in archived_bests(user_archive(conn, user_id)).items()])
+    return True
+
+def unarchive_workout_exercise(conn, exercise_id):
+    # unarchive_workout for the workout holding an archived workout exercise
+    row = conn.execute('SELECT workout_id FROM archived_workout_exercises WHERE id = ?', (exercise_id,)).fetchone()
+    return row is not None and unarchive_workout(conn, row[0])
+
+def archived_contribution(user_id, workout):
+    # workout_contribution for an archived workout
+    if workout_day(workout['date']) is None:
+        return None
+    completed = 1 if workout['completed'] else 0
+    return {
+        'user_id': user_id,
+        'day': workout_day(workout['date']),
+        'workouts': 1,
+        'completed': completed,
+        'duration': (workout['duration'] or 0) if completed else 0,
+        'exercises': len(workout['exercises']) if completed else 0
+    }
+
+def archived_trend_rows(workouts, exercise_id):
+    # The rows TREND_SQL would read for these archived workouts
+    rows = []
+    for workout in workouts:
+        try:
+            day = day_number(str(workout['date'])[:10])
+        except ValueError:
+            day = None
+        for exercise in workout['exercises']:
+            if exercise['exercise_id'] != exercise_id:
+                continue
+            weight = exercise['weight']
+            estimated_1rm = weight
+            if weight is not None and exercise['reps'] > 1:
+                estimated_1rm = weight * (1 + exercise['reps'] / 30.0)
+            rows.append((day, workout['id'], exercise['sets'], exercise['reps'], weight or 0, estimated_1rm))
+    return rows
+
+def archive_ranges(conn, user_id, date_from, date_to, before):
+    # The archive rows that may hold workouts in a get_workouts range
+    conditions = []
+    params = []
+    if user_id:
+        conditions.append('user_id = ?')
+        params.append(user_id)
+    if date_from:
+        conditions.append('last_date >= ?')
+        params.append(date_from)
+    if date_to:
+        conditions.append('first_date <= ?')
+        params.append(date_to)
+    if before:
+        conditions.append('first_date <= ?')
+        params.append(before)
+    query = 'SELECT user_id, year, last_date FROM workout_archive'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    return conn.execute(query, params).fetchall()
+
+def archive_encoder(description, fields=None):
+    # workout_encoder for archived workouts, writing the same JSON for the
+    # columns of description; nested exercise names come from the catalog
+    include_exercises = fields is None or 'exercises' in fields
+    names = [column[0] for column in description]
+    encoder = row_encoder(description, fields and [field for field in fields if field != 'exercises'])
+    nested = row_encoder([(field,) for field in NESTED_EXERCISE_FIELDS])
+    
+    def encode_batch(conn, workouts):
+        rows = [tuple(workout.get(name) for name in names) for workout in workouts]
+        if not include_exercises:
+            return list(map(encoder, rows))
+        exercise_ids = {exercise['exercise_id'] for workout in workouts for exercise in workout['exercises']}
+        catalog = dict(conn.execute('SELECT id, name FROM exercises WHERE id IN (SELECT value FROM json_each(?))',
+                                    (json.dumps(list(exercise_ids)),)).fetchall())
+        return [
+            encoder(row)[:-1] + ',"exercises":[' + ','.join(
+                nested((exercise['id'], exercise['exercise_id'], catalog[exercise['exercise_id']], exercise['sets'],
+                        exercise['reps'], exercise['weight'], exercise['rest_time'], exercise['notes']))
+                for exercise in workout['exercises'] if exercise['exercise_id'] in catalog
+            ) + ']}'
+            for row, workout in zip(rows, workouts)
         ]
-        
-        for exercise in sample_exercises:
-            conn.execute('''
-                INSERT INTO exercises (name, category, muscle_groups, equipment, instructions)
-                VALUES (?, ?, ?, ?, ?)
-            ''', exercise)
+    return encode_batch
+
+def archive_user_workouts(conn, user_id, cutoff):
+    # Archives one user's completed workouts dated before cutoff in a single
+    # transaction, so the API can keep writing between users. Returns the
+    # number of workouts and workout exercises archived.
+    conn.execute('BEGIN IMMEDIATE')
+    workouts = [dict(row) for row in conn.execute('''
+        SELECT * FROM workouts WHERE user_id = ? AND completed AND date < ? ORDER BY date, id
+    ''', (user_id, cutoff)).fetchall()]
+    if not workouts:
+        conn.rollback()
+        return 0, 0
+    
+    workout_ids = json.dumps([workout['id'] for workout in workouts])
+    exercises = defaultdict(list)
+    for row in conn.execute('''
+        SELECT * FROM workout_exercises WHERE workout_id IN (SELECT value FROM json_each(?)) ORDER BY workout_id, id
+    ''', (workout_ids,)):
+        exercises[row['workout_id']].append(dict(row))
+    years = defaultdict(list)
+    for workout in workouts:
+        workout['exercises'] = exercises[workout['id']]
+        years[str(workout['date'])[:4]].append(workout)
     
+    for year, added in years.items():
+        year_workouts = sorted(load_archive(conn, [(user_id, year)]) + added,
+                               key=lambda workout: (workout['date'], workout['id']))
+        conn.execute('''
+            INSERT OR REPLACE INTO workout_archive (user_id, year, workouts, exercises, first_date, last_date, data)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            user_id,
+            year,
+            len(year_workouts),
+            sum(len(workout['exercises']) for workout in year_workouts),
+            year_workouts[0]['date'],
+            year_workouts[-1]['date'],
+            encode_archive(year_workouts)
+        ))
+        conn.executemany('INSERT INTO archived_workouts (id, user_id, year) VALUES (?, ?, ?)',
+                         [(workout['id'], user_id, year) for workout in added])
+        conn.executemany('INSERT INTO archived_workout_exercises (id, workout_id, user_id) VALUES (?, ?, ?)',
+                         [(exercise['id'], workout['id'], user_id) for workout in added for exercise in workout['exercises']])
+    conn.execute(f'''
+        INSERT INTO archived_records (user_id, exercise_id, max_weight, best_1rm, best_volume)
+        SELECT ?, exercise_id, COALESCE(MAX(max_weight), 0), COALESCE(MAX(best_1rm), 0), COALESCE(MAX(volume), 0)
+        FROM (
+            SELECT we.exercise_id, MAX(we.weight) as max_weight, MAX({ESTIMATED_1RM_SQL}) as best_1rm,
+                   SUM(we.sets * we.reps * we.weight) as volume
+            FROM workout_exercises we
+            WHERE we.workout_id IN (SELECT value FROM json_each(?))
+            GROUP BY we.workout_id, we.exercise_id
+        )
+        WHERE true
+        GROUP BY exercise_id
+        ON CONFLICT (user_id, exercise_id) DO UPDATE SET
+            max_weight = MAX(max_weight, excluded.max_weight),
+            best_1rm = MAX(best_1rm, excluded.best_1rm),
+            best_volume = MAX(best_volume, excluded.best_volume)
+    ''', (user_id, workout_ids))
+    
+    seq = conn.execute('SELECT seq FROM sync_sequence').fetchone()[0]
+    conn.execute('DELETE FROM workouts WHERE id IN (SELECT value FROM json_each(?))', (workout_ids,))
+    # The extra shards have no foreign keys to cascade
+    if on_shard(conn):
+        conn.execute('DELETE FROM workout_exercises WHERE workout_id IN (SELECT value FROM json_each(?))',
+                     (workout_ids,))
+    # Archiving is not a delete: clients keep the copies they have synced
+    conn.execute('DELETE FROM tombstones WHERE seq > ?', (seq,))
     conn.commit()
-    conn.close()
+    return len(workouts), sum(len(workout['exercises']) for workout in workouts)
 
-# Initialize database on startup
-init_db()
+def insert_archived_workouts(conn, workouts):
+    # Writes archived workouts and their exercises back to the hot tables as they were
+    for table, rows in (
+        ('workouts', [{key: value for key, value in workout.items() if key != 'exercises'} for workout in workouts]),
+        ('workout_exercises', [exercise for workout in workouts for exercise in workout['exercises']]),
+    ):
+        columns = {column[1] for column in conn.execute(f'PRAGMA table_info({table})').fetchall()}
+        for row in rows:
+            names = [name for name in row if name in columns]
+            conn.execute(f'INSERT INTO {table} ({", ".join(names)}) VALUES ({", ".join("?" * len(names))})',
+                         [row[name] for name in names])
+
+def restore_archive(conn, user_id):
+    # Puts a user's archived workouts back into the hot tables with their ids,
+    # for move_user; the next archive-workouts run archives them again. The
+    # caller commits.
+    workouts = user_archive(conn, user_id)
+    insert_archived_workouts(conn, workouts)
+    for table in ARCHIVE_TABLES:
+        conn.execute(f'DELETE FROM {table} WHERE user_id = ?', (user_id,))
+    return len(workouts)
+
+def hot_set_size(conn):
+    # Rows in, and bytes of pages used by, the hot workout tables and their indexes
+    rows = sum(conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+               for table in ('workouts', 'workout_exercises'))
+    try:
+        size = conn.execute('''
+            SELECT SUM(pgsize) FROM dbstat
+            WHERE name IN (SELECT name FROM sqlite_master WHERE tbl_name IN ('workouts', 'workout_exercises'))
+        ''').fetchone()[0]
+    except sqlite3.OperationalError:
+        # SQLite built without the dbstat table
+        size = None
+    return rows, size
+
+def first_page_latency(client, user_ids):
+    # Median time, in milliseconds, to fetch a user's first page of workouts
+    timings = []
+    for user_id in user_ids:
+        client.get(f'/api/workouts?user_id={user_id}&limit=20')
+        for _ in range(ARCHIVE_SAMPLE_RUNS):
+            started = time.perf_counter()
+            client.get(f'/api/workouts?user_id={user_id}&limit=20')
+            timings.append((time.perf_counter() - started) * 1000)
+    return sorted(timings)[len(timings) // 2] if timings else None
+
+@api.cli.command('archive-workouts')
+@click.option('--days', type=int, help='Archive completed workouts older than this.  [default: ARCHIVE_AFTER_DAYS]')
+@click.option('--vacuum', is_flag=True, help='VACUUM afterwards to give the freed pages back.')
+def archive_workouts_command(days, vacuum):
+    """Move old completed workouts into the yearly archive, reporting the hot set before and after."""
+    if days is None:
+        days = current_app.config['ARCHIVE_AFTER_DAYS']
+    cutoff = (date.today() - timedelta(days=days)).isoformat()
+    client = current_app.test_client()
+    for shard in range(len(current_app.extensions['shards']['pools'])):
+        conn = get_db_connection(shard)
+        user_ids = [row['user_id'] for row in conn.execute(
+            'SELECT DISTINCT user_id FROM workouts WHERE completed AND date < ?', (cutoff,)
+        ).fetchall()]
+        sample = user_ids[:ARCHIVE_SAMPLE_USERS]
+        rows_before, size_before = hot_set_size(conn)
+        latency_before = first_page_latency(client, sample)
+        
+        workouts = exercises = 0
+        for user_id in user_ids:
+            archived = archive_user_workouts(conn, user_id, cutoff)
+            workouts += archived[0]
+            exercises += archived[1]
+        if vacuum:
+            # On its own connection: the extra shards' pooled ones have views over tables of the same name
+            plain = sqlite3.connect(current_app.extensions['shards']['pools'][shard].database)
+            plain.execute('VACUUM')
+            plain.close()
+        rows_after, size_after = hot_set_size(conn)
+        latency_after = first_page_latency(client, sample)
+        conn.close()
+        
+        where = f' on shard {shard}' if sharded() else ''
+        click.echo(f'Archived {workouts} workouts and {exercises} workout exercises dated before {cutoff}{where}')
+        click.echo(f'  hot rows: {rows_before} -> {rows_after}')
+        if size_before is not None:
+            click.echo(f'  hot pages: {size_before / 1024:.0f} KiB -> {size_after / 1024:.0f} KiB')
+        if latency_before is not None:
+            click.echo(f'  first page of workouts, median of {len(sample)} users: '
+                       f'{latency_before:.2f} ms -> {latency_after:.2f} ms')
+
+# Query plan checks
+# The harness lives in benchmarks/query_plans.py, loaded only when the command runs
+@api.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Fail if any query an endpoint runs falls back to a table scan or temp B-tree sort."""
+    from benchmarks.query_plans import check_query_plans
+    checked, problems = check_query_plans()
+    for problem in problems:
+        click.echo(problem, err=True)
+    if problems:
+        raise SystemExit(1)
+    click.echo(f'{checked} statements OK')
+
+# Streaming list responses
+STREAM_BATCH = 500
+
+def stream_json_array(conn, cursor, encode_batch):
+    # Encode rows as they come off the cursor instead of buffering the whole list
+    try:
+        yield '['
+        separator = ''
+        while True:
+            rows = cursor.fetchmany(STREAM_BATCH)
+            if not rows:
+                break
+            items = encode_batch(conn, rows)
+            if items:
+                yield separator + ','.join(items)
+                separator = ','
+        yield ']'
+    finally:
+        conn.close()
+
+def list_response(conn, cursor, encode_batch=None):
+    # encode_batch(conn, rows) returns each row as JSON text; by default the
+    # rows are written as they are with an encoder for the cursor's columns
+    if encode_batch is None:
+        encoder = row_encoder(cursor.description)
+        encode_batch = lambda conn, rows: list(map(encoder, rows))
+    # ?stream=0 keeps the buffered fetchall path
+    if request.args.get('stream') == '0':
+        body = '[' + ','.join(encode_batch(conn, cursor.fetchall())) + ']'
+        conn.close()
+        return Response(body, mimetype='application/json')
+    return Response(stream_with_context(stream_json_array(conn, cursor, encode_batch)),
+                    mimetype='application/json')
+
+# Row encoders
+# SQLite only hands back these types; anything else falls back to json.dumps
+JSON_VALUE_ENCODERS = {
+    str: json.encoder.encode_basestring_ascii,
+    int: int.__repr__,
+    float: float.__repr__,
+    bool: lambda value: 'true' if value else 'false',
+    type(None): lambda value: 'null',
+}
+# Column lists come from a fixed set of queries and canonical ?fields= subsets;
+# the limit keeps the cache bounded whatever clients ask for
+ROW_ENCODER_CACHE_SIZE = 512
+
+def row_encoder(description, fields=None):
+    # Compile, once per column list, a function that writes a row tuple straight
+    # to JSON text through a %-template of its keys, with no dict in between.
+    # fields picks and orders a subset of the columns.
+    return compile_row_encoder(tuple(column[0] for column in description), tuple(fields) if fields else None)
+
+@functools.lru_cache(maxsize=ROW_ENCODER_CACHE_SIZE)
+def compile_row_encoder(names, fields):
+    wanted = list(fields) if fields else list(names)
+    template = '{' + ','.join(
+        json.encoder.encode_basestring_ascii(name).replace('%', '%%') + ':%s' for name in wanted
+    ) + '}'
+    encoders = JSON_VALUE_ENCODERS
+    fallback = json.dumps
+    if wanted == list(names):
+        def encoder(row):
+            return template % tuple([encoders.get(type(value), fallback)(value) for value in row])
+    else:
+        indexes = [names.index(name) for name in wanted]
+        pick = operator.itemgetter(*indexes) if len(indexes) > 1 else lambda row: (row[indexes[0]],)
+        
+        def encoder(row):
+            return template % tuple([encoders.get(type(value), fallback)(value) for value in pick(row)])
+    return encoder
+
+# Sparse fieldsets and partial updates
+def requested_fields(allowed):
+    # ?fields=a,b limits a response to those fields; the id is always returned.
+    # They come back in the order of allowed, whatever order the client used,
+    # so each subset makes one query text and one cached encoder.
+    value = request.args.get('fields')
+    if not value:
+        return None
+    fields = {'id'}
+    for field in value.split(','):
+        field = field.strip()
+        if not field:
+            continue
+        if field not in allowed:
+            raise ApiError(f'Unknown field: {field}')
+        fields.add(field)
+    return [field for field in allowed if field in fields]
+
+def column_list(fields, prefix=''):
+    # Field names are checked against a fixed list, so they are safe to splice in
+    return ', '.join(prefix + field for field in fields) if fields else prefix + '*'
+
+def patch_row(conn, table, columns, data, row_id, returning='id'):
+    # Write only the supplied columns in a single UPDATE. The row it returns
+    # doubles as the existence check: None means there is no such row.
+    fields = [column for column in columns if column in data]
+    if fields:
+        assignments = ', '.join(f'{column} = ?' for column in fields)
+        sql = f'UPDATE {table} SET {assignments} WHERE id = ? RETURNING {returning}'
+        params = [data[column] for column in fields] + [row_id]
+    else:
+        sql = f'SELECT {returning} FROM {table} WHERE id = ?'
+        params = [row_id]
+    rows = conn.execute(sql, params).fetchall()
+    return rows[0] if rows else None
+
+# Exercise catalog cache
+# The serialized catalog is cached per process and keyed by the version row in
+# catalog_versions, which the exercise write handlers bump in their own
+# transaction. Checking that row is a single primary key read, so every worker
+# notices another worker's write on its next request.
+catalog_lock = threading.Lock()
+
+def catalog_version(conn):
+    return conn.execute("SELECT version FROM catalog_versions WHERE name = 'exercises'").fetchone()['version']
+
+def bump_catalog_version(conn):
+    conn.execute("UPDATE catalog_versions SET version = version + 1 WHERE name = 'exercises'")
+
+def exercise_catalog(conn):
+    # Each app keeps its own cache under extensions['exercise_catalog']
+    extensions = current_app.extensions
+    version = catalog_version(conn)
+    cached = extensions['exercise_catalog']
+    if cached['version'] == version:
+        return cached
+    
+    with catalog_lock:
+        if extensions['exercise_catalog']['version'] == version:
+            return extensions['exercise_catalog']
+        # Read the version and the rows from one snapshot
+        conn.execute('BEGIN')
+        version = catalog_version(conn)
+        rows = conn.execute('SELECT * FROM exercises ORDER BY name').fetchall()
+        conn.commit()
+        
+        items = {row['id']: current_app.json.dumps(dict(row), separators=(',', ':')) for row in rows}
+        body = '[' + ','.join(items.values()) + ']'
+        extensions['exercise_catalog'] = {
+            'version': version,
+            'body': body,
+            'etag': hashlib.sha1(body.encode()).hexdigest(),
+            'items': {
+                exercise_id: (item, hashlib.sha1(item.encode()).hexdigest())
+                for exercise_id, item in items.items()
+            }
+        }
+        return extensions['exercise_catalog']
+
+def cached_json_response(body, etag):
+    # Weak comparison, since compressed responses carry a weak ETag
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response
 
 # User endpoints
-@app.route('/api/users', methods=['GET'])
+USER_FIELDS = ('id', 'name', 'email', 'age', 'weight', 'height', 'goal', 'created_at', 'change_seq')
+USER_UPDATE_FIELDS = ('name', 'email', 'age', 'weight', 'height', 'goal')
+
+@api.route('/api/users', methods=['GET'])
 def get_users():
+    fields = requested_fields(USER_FIELDS)
     conn = get_db_connection()
-    users = conn.execute('SELECT * FROM users').fetchall()
-    conn.close()
-    return jsonify([dict(user) for user in users])
+    cursor = conn.execute(f'SELECT {column_list(fields)} FROM users')
+    return list_response(conn, cursor)
 
-@app.route('/api/users/<int:user_id>', methods=['GET'])
+@api.route('/api/users/<int:user_id>', methods=['GET'])
 def get_user(user_id):
+    fields = requested_fields(USER_FIELDS)
     conn = get_db_connection()
-    user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+    user = conn.execute(f'SELECT {column_list(fields)} FROM users WHERE id = ?', (user_id,)).fetchone()
     conn.close()
     
     if user is None:
@@ -131,15 +2143,11 @@ def get_user(user_id):
     
     return jsonify(dict(user))
 
-@app.route('/api/users', methods=['POST'])
-def create_user():
-    data = request.get_json()
-    
+def create_user_op(conn, data):
     required_fields = ['name', 'email']
     if not all(field in data for field in required_fields):
-        return jsonify({'error': 'Missing required fields'}), 400
+        raise ApiError('Missing required fields')
     
-    conn = get_db_connection()
     try:
         cursor = conn.execute('''
             INSERT INTO users (name, email, age, weight, height, goal)
@@ -152,76 +2160,561 @@ def create_user():
             data.get('height'),
             data.get('goal')
         ))
-        user_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        
-        return jsonify({'id': user_id, 'message': 'User created successfully'}), 201
     except sqlite3.IntegrityError:
-        conn.close()
-        return jsonify({'error': 'Email already exists'}), 400
+        raise ApiError('Email already exists')
+    # The shard is fixed here; only move-user and rebalance-shards change it
+    conn.execute('INSERT INTO user_shards (user_id, shard) SELECT ?, ? % shards FROM shard_settings',
+                 (cursor.lastrowid, cursor.lastrowid))
+    
+    return {'id': cursor.lastrowid, 'message': 'User created successfully'}, 201
 
-@app.route('/api/users/<int:user_id>', methods=['PUT'])
+def update_user_op(conn, data, user_id):
+    try:
+        user = patch_row(conn, 'users', USER_UPDATE_FIELDS, data, user_id)
+    except sqlite3.IntegrityError:
+        raise ApiError('Email already exists')
+    if user is None:
+        raise ApiError('User not found', 404)
+    
+    return {'message': 'User updated successfully'}, 200
+
+@api.route('/api/users', methods=['POST'])
+def create_user():
+    return perform_write(create_user_op, request.get_json())
+
+@api.route('/api/users/<int:user_id>', methods=['PUT', 'PATCH'])
 def update_user(user_id):
-    data = request.get_json()
+    return perform_write(update_user_op, request.get_json(), user_id=user_id)
+
+STATS_PERIODS = {'week': 7, 'month': 30, 'year': 365}
+
+@api.route('/api/users/<int:user_id>/stats', methods=['GET'])
+def get_user_stats(user_id):
+    period = request.args.get('period', 'month')
+    bucket = request.args.get('bucket', 'week')
+    if period not in STATS_PERIODS:
+        return jsonify({'error': 'Invalid period'}), 400
+    if bucket not in ('day', 'week'):
+        return jsonify({'error': 'Invalid bucket'}), 400
+    
+    table, key = ROLLUP_TABLES[0] if bucket == 'day' else ROLLUP_TABLES[1]
+    cutoff = (date.today() - timedelta(days=STATS_PERIODS[period])).isoformat()
+    if bucket == 'week':
+        cutoff = week_start(cutoff)
+    
+    conn = get_db_connection(user_shard(user_id))
+    rows = conn.execute(f'''
+        SELECT {key} as bucket, workouts, completed, duration, exercises
+        FROM {table}
+        WHERE user_id = ? AND {key} >= ?
+        ORDER BY {key}
+    ''', (user_id, cutoff)).fetchall()
+    conn.close()
+    
+    buckets = [dict(row) for row in rows]
+    total_workouts = sum(row['workouts'] for row in buckets)
+    completed = sum(row['completed'] for row in buckets)
+    total_duration = sum(row['duration'] for row in buckets)
+    
+    return jsonify({
+        'period': period,
+        'bucket': bucket,
+        'total_workouts': total_workouts,
+        'completed_workouts': completed,
+        'completion_rate': round(completed * 100 / total_workouts) if total_workouts else 0,
+        'total_duration': total_duration,
+        'avg_duration': round(total_duration / completed) if completed else 0,
+        'total_exercises': sum(row['exercises'] for row in buckets),
+        'buckets': buckets
+    })
+
+@api.route('/api/users/<int:user_id>/records', methods=['GET'])
+def get_personal_records(user_id):
+    conn = get_db_connection(user_shard(user_id))
+    records = conn.execute('''
+        SELECT pr.exercise_id, e.name, pr.max_weight, pr.best_1rm, pr.best_volume
+        FROM personal_records pr
+        JOIN exercises e ON e.id = pr.exercise_id
+        WHERE pr.user_id = ?
+    ''', (user_id,)).fetchall()
+    conn.close()
+    
+    return jsonify([dict(record) for record in records])
+
+@api.route('/api/users/<int:user_id>/calendar', methods=['GET'])
+def get_activity_calendar(user_id):
+    try:
+        year = int(request.args.get('year', date.today().year))
+        first = date(year, 1, 1).toordinal()
+    except ValueError:
+        return jsonify({'error': 'Invalid year'}), 400
+    days_in_year = date(year, 12, 31).toordinal() - first + 1
+    
+    conn = get_db_connection(user_shard(user_id))
+    user = conn.execute('SELECT id FROM users WHERE id = ?', (user_id,)).fetchone()
+    activity = conn.execute('SELECT * FROM user_activity WHERE user_id = ?', (user_id,)).fetchone()
+    conn.close()
+    
+    if user is None:
+        return jsonify({'error': 'User not found'}), 404
+    
+    days = []
+    current_streak = longest_streak = 0
+    if activity is not None:
+        bits = int.from_bytes(activity['bits'], 'little')
+        offset = first - activity['start_day']
+        year_bits = (bits >> offset if offset >= 0 else bits << -offset) & ((1 << days_in_year) - 1)
+        while year_bits:
+            lowest = year_bits & -year_bits
+            days.append(date.fromordinal(first + lowest.bit_length() - 1).isoformat())
+            year_bits ^= lowest
+        # A streak stays current until a whole day passes without a workout
+        if activity['last_day'] is not None and activity['last_day'] >= date.today().toordinal() - 1:
+            current_streak = activity['last_streak']
+        longest_streak = activity['longest_streak']
+    
+    return jsonify({
+        'year': year,
+        'active_days': len(days),
+        'days': days,
+        'current_streak': current_streak,
+        'longest_streak': longest_streak
+    })
+
+# Exercise trends
+# Weekly volume and estimated 1RM for one user's exercise, computed over the
+# whole history as NumPy columns. Results are cached per process in a bounded
+# LRU and checked against the user's row in user_writes, so any write to their
+# workouts (from any worker) makes the next request recompute.
+DEFAULT_CONFIG.update(
+    TREND_CACHE_SIZE=int(os.environ.get('TREND_CACHE_SIZE', 1024))
+)
+
+# Weeks in the rolling means, and the trailing weeks checked for a plateau
+TREND_WINDOW = 4
+PLATEAU_WEEKS = 8
+# A plateau is less than this gain in estimated 1RM per week, relative to its mean
+PLATEAU_GAIN = 0.005
+
+# Days are proleptic ordinals (date.toordinal), so day // 7 is a week starting on Sunday
+TREND_SQL = f'''
+    SELECT CAST(julianday(substr(w.date, 1, 10)) - 1721424.5 AS INTEGER) as day,
+           we.workout_id, we.sets, we.reps, COALESCE(we.weight, 0) as weight,
+           {ESTIMATED_1RM_SQL} as estimated_1rm
+    FROM workouts w
+    JOIN workout_exercises we ON we.workout_id = w.id
+    WHERE w.user_id = ? AND we.exercise_id = ?
+'''
+
+class LRUCache:
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+    
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+    
+    def put(self, key, version, value):
+        with self.lock:
+            self.entries[key] = (version, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+def user_write_seq(conn, user_id):
+    row = conn.execute('SELECT seq FROM user_writes WHERE user_id = ?', (user_id,)).fetchone()
+    return row['seq'] if row else 0
+
+def rolling_mean(values, window):
+    sums = numpy.cumsum(values)
+    sums[window:] = sums[window:] - sums[:-window]
+    return sums / numpy.minimum(numpy.arange(1, len(values) + 1), window)
+
+def least_squares_slope(x, y):
+    if len(x) < 2:
+        return None
+    x = x - x.mean()
+    spread = numpy.dot(x, x)
+    return float(numpy.dot(x, y - y.mean()) / spread) if spread else None
+
+def exercise_trend(conn, user_id, exercise_id):
+    cursor = conn.execute(TREND_SQL, (user_id, exercise_id))
+    cursor.row_factory = None
+    rows = cursor.fetchall()
+    if conn.execute('SELECT 1 FROM archived_records WHERE user_id = ? AND exercise_id = ?',
+                    (user_id, exercise_id)).fetchone() is not None:
+        rows += archived_trend_rows(user_archive(conn, user_id), exercise_id)
+    columns = numpy.array(rows, dtype=float).reshape(-1, 6)
+    # Rows with an unparseable date have no day
+    columns = columns[~numpy.isnan(columns[:, 0])]
+    day, workout_id, sets, reps, weight, estimated_1rm = columns.T
+    
+    weeks, bucket = numpy.unique(day // 7, return_inverse=True)
+    volume = numpy.bincount(bucket, weights=sets * reps * weight, minlength=len(weeks))
+    best_1rm = numpy.zeros(len(weeks))
+    numpy.maximum.at(best_1rm, bucket, numpy.nan_to_num(estimated_1rm))
+    
+    # Plateau: estimated 1RM gaining less than PLATEAU_GAIN a week over the
+    # trailing PLATEAU_WEEKS, given at least three weeks of data in them
+    plateau = None
+    recent = weeks > (weeks[-1] if len(weeks) else 0) - PLATEAU_WEEKS
+    recent_slope = least_squares_slope(weeks[recent], best_1rm[recent]) if recent.sum() >= 3 else None
+    if recent_slope is not None and best_1rm[recent].mean() > 0:
+        plateau = bool(recent_slope < PLATEAU_GAIN * best_1rm[recent].mean())
+    
+    volume_avg = rolling_mean(volume, TREND_WINDOW)
+    best_1rm_avg = rolling_mean(best_1rm, TREND_WINDOW)
+    volume_slope = least_squares_slope(weeks, volume)
+    best_1rm_slope = least_squares_slope(weeks, best_1rm)
+    return {
+        'exercise_id': exercise_id,
+        'sessions': len(numpy.unique(workout_id)),
+        'weeks': [
+            {
+                'week_start': date.fromordinal(int(week) * 7).isoformat(),
+                'volume': round(week_volume, 1),
+                'best_1rm': round(week_1rm, 1),
+                'volume_avg': round(week_volume_avg, 1),
+                'best_1rm_avg': round(week_1rm_avg, 1)
+            }
+            for week, week_volume, week_1rm, week_volume_avg, week_1rm_avg in zip(
+                weeks.tolist(), volume.tolist(), best_1rm.tolist(), volume_avg.tolist(), best_1rm_avg.tolist()
+            )
+        ],
+        'volume_slope': None if volume_slope is None else round(volume_slope, 2),
+        'best_1rm_slope': None if best_1rm_slope is None else round(best_1rm_slope, 3),
+        'recent_1rm_slope': None if recent_slope is None else round(recent_slope, 3),
+        'plateau': plateau
+    }
+
+@api.route('/api/users/<int:user_id>/exercises/<int:exercise_id>/trend', methods=['GET'])
+def get_exercise_trend(user_id, exercise_id):
+    cache = current_app.extensions['trend_cache']
+    conn = get_db_connection(user_shard(user_id))
+    # Read the version before the rows: a write in between only makes the
+    # cached result newer than its key, and the next request recomputes
+    version = user_write_seq(conn, user_id)
+    body = cache.get((user_id, exercise_id), version)
+    if body is None:
+        trend = exercise_trend(conn, user_id, exercise_id)
+        if not trend['weeks']:
+            if conn.execute('SELECT id FROM users WHERE id = ?', (user_id,)).fetchone() is None:
+                conn.close()
+                return jsonify({'error': 'User not found'}), 404
+            if conn.execute('SELECT id FROM exercises WHERE id = ?', (exercise_id,)).fetchone() is None:
+                conn.close()
+                return jsonify({'error': 'Exercise not found'}), 404
+        body = current_app.json.dumps(trend)
+        cache.put((user_id, exercise_id), version, body)
+    conn.close()
+    
+    return Response(body, mimetype='application/json')
+
+# History export / import
+# Both directions use NDJSON: one {"type": ..., "data": {...}} object per line,
+# the user first, then its workouts, then their workout exercises.
+EXPORT_BATCH = 500
+IMPORT_CHUNK_SIZE = 1000
+WORKOUT_IMPORT_FIELDS = ('name', 'date', 'notes', 'completed', 'completed_date', 'duration')
+WORKOUT_EXERCISE_IMPORT_FIELDS = ('exercise_id', 'sets', 'reps', 'weight', 'rest_time', 'notes')
+
+def export_lines(conn, user_id):
+    try:
+        queries = [
+            ('user', 'SELECT * FROM users WHERE id = ?'),
+            ('workout', 'SELECT * FROM workouts WHERE user_id = ? ORDER BY date, id'),
+            ('workout_exercise', '''
+                SELECT we.*
+                FROM workouts w
+                JOIN workout_exercises we ON we.workout_id = w.id
+                WHERE w.user_id = ?
+            ''')
+        ]
+        archive = user_archive(conn, user_id)
+        archived = {
+            'workout': [{key: value for key, value in workout.items() if key != 'exercises'} for workout in archive],
+            'workout_exercise': [exercise for workout in archive for exercise in workout['exercises']]
+        }
+        for record_type, query in queries:
+            cursor = conn.execute(query, (user_id,))
+            encoder = row_encoder(cursor.description)
+            prefix = f'{{"type": "{record_type}", "data": '
+            while True:
+                rows = cursor.fetchmany(EXPORT_BATCH)
+                if not rows:
+                    break
+                yield ''.join(prefix + encoder(row) + '}\n' for row in rows)
+            # Archived rows follow the hot ones of their type
+            records = archived.get(record_type, [])
+            for start in range(0, len(records), EXPORT_BATCH):
+                yield ''.join(
+                    prefix + row_encoder([(key,) for key in record])(tuple(record.values())) + '}\n'
+                    for record in records[start:start + EXPORT_BATCH]
+                )
+    finally:
+        conn.close()
+
+@api.route('/api/users/<int:user_id>/export', methods=['GET'])
+def export_user(user_id):
+    conn = get_db_connection(user_shard(user_id))
+    user = conn.execute('SELECT id FROM users WHERE id = ?', (user_id,)).fetchone()
+    
+    if user is None:
+        conn.close()
+        return jsonify({'error': 'User not found'}), 404
+    
+    return Response(
+        stream_with_context(export_lines(conn, user_id)),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename=user-{user_id}.ndjson'}
+    )
+
+def next_ids(conn, table, count):
+    # Reserve a block of AUTOINCREMENT ids; the caller holds the write lock
+    row = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+    start = (row['seq'] if row else 0) + 1
+    return list(range(start, start + count))
+
+def import_chunk(conn, job_id, user_id, records):
+    workouts = [data for record_type, data in records if record_type == 'workout']
+    workout_exercises = [data for record_type, data in records if record_type == 'workout_exercise']
+    
+    conn.execute('BEGIN IMMEDIATE')
+    
+    workout_map = {}
+    if workouts:
+        new_ids = next_ids(conn, 'workouts', len(workouts))
+        conn.executemany('''
+            INSERT INTO workouts (id, user_id, name, date, notes, completed, completed_date, duration)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (new_id, user_id) + tuple(data.get(field) for field in WORKOUT_IMPORT_FIELDS)
+            for new_id, data in zip(new_ids, workouts)
+        ])
+        workout_map = {data['id']: new_id for new_id, data in zip(new_ids, workouts)}
+        conn.executemany(
+            'INSERT INTO import_workout_map (job_id, source_id, workout_id) VALUES (?, ?, ?)',
+            [(job_id, source_id, new_id) for source_id, new_id in workout_map.items()]
+        )
+    created = set(workout_map.values())
+    
+    # Exercises may belong to workouts imported by an earlier chunk
+    missing = list({data['workout_id'] for data in workout_exercises} - workout_map.keys())
+    for start in range(0, len(missing), SQL_IN_CHUNK):
+        chunk = missing[start:start + SQL_IN_CHUNK]
+        placeholders = ','.join('?' * len(chunk))
+        rows = conn.execute(f'''
+            SELECT source_id, workout_id FROM import_workout_map
+            WHERE job_id = ? AND source_id IN ({placeholders})
+        ''', [job_id] + chunk).fetchall()
+        workout_map.update({row['source_id']: row['workout_id'] for row in rows})
+    if any(data['workout_id'] not in workout_map for data in workout_exercises):
+        raise ValueError('Workout exercise references a workout that was not imported')
+    
+    # Workouts created by this chunk are not in the rollups yet
+    touched = created | {workout_map[data['workout_id']] for data in workout_exercises}
+    before = {
+        workout_id: None if workout_id in created else workout_contribution(conn, workout_id)
+        for workout_id in touched
+    }
+    
+    check_references(conn, exercises=[data.get('exercise_id') for data in workout_exercises])
+    conn.executemany('''
+        INSERT INTO workout_exercises (workout_id, exercise_id, sets, reps, weight, rest_time, notes)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        (workout_map[data['workout_id']],) + tuple(data.get(field) for field in WORKOUT_EXERCISE_IMPORT_FIELDS)
+        for data in workout_exercises
+    ])
     
-    conn = get_db_connection()
-    user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+    for workout_id in touched:
+        update_rollups(conn, workout_id, before[workout_id])
+        raise_personal_records(conn, workout_id)
+    
+    conn.execute('''
+        UPDATE import_jobs
+        SET committed_lines = committed_lines + ?, workouts = workouts + ?,
+            workout_exercises = workout_exercises + ?
+        WHERE id = ?
+    ''', (len(records), len(workouts), len(workout_exercises), job_id))
+    conn.commit()
+    return len(workouts) + len(workout_exercises)
+
+@api.route('/api/users/<int:user_id>/import', methods=['POST'])
+def import_user(user_id):
+    conn = get_db_connection(user_shard(user_id))
+    user = conn.execute('SELECT id FROM users WHERE id = ?', (user_id,)).fetchone()
     
     if user is None:
         conn.close()
         return jsonify({'error': 'User not found'}), 404
     
+    # Resuming a job skips the lines its committed chunks already covered
+    job_id = request.args.get('job', type=int)
+    if job_id is None:
+        cursor = conn.execute('INSERT INTO import_jobs (user_id) VALUES (?)', (user_id,))
+        job_id = cursor.lastrowid
+        conn.commit()
+        skip = 0
+    else:
+        job = conn.execute('SELECT * FROM import_jobs WHERE id = ? AND user_id = ?', (job_id, user_id)).fetchone()
+        if job is None:
+            conn.close()
+            return jsonify({'error': 'Import job not found'}), 404
+        skip = job['committed_lines']
+    
+    started = time.perf_counter()
+    rows = 0
+    records = []
+    line_number = 0
+    error = None
     try:
-        conn.execute('''
-            UPDATE users 
-            SET name = ?, email = ?, age = ?, weight = ?, height = ?, goal = ?
-            WHERE id = ?
-        ''', (
-            data.get('name', user['name']),
-            data.get('email', user['email']),
-            data.get('age', user['age']),
-            data.get('weight', user['weight']),
-            data.get('height', user['height']),
-            data.get('goal', user['goal']),
-            user_id
-        ))
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            line_number += 1
+            if line_number <= skip:
+                continue
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError(f'Line {line_number} is not a JSON object')
+            if record.get('type') not in ('user', 'workout', 'workout_exercise'):
+                raise ValueError(f'Unknown record type on line {line_number}')
+            if not isinstance(record.get('data'), dict):
+                raise ValueError(f'Record data on line {line_number} is not a JSON object')
+            # The target user already exists, so its exported profile is not applied
+            records.append((record['type'], record['data']))
+            if len(records) >= IMPORT_CHUNK_SIZE:
+                rows += import_chunk(conn, job_id, user_id, records)
+                records = []
+        if records:
+            rows += import_chunk(conn, job_id, user_id, records)
+        conn.execute('UPDATE import_jobs SET finished_at = CURRENT_TIMESTAMP WHERE id = ?', (job_id,))
         conn.commit()
-        conn.close()
-        
-        return jsonify({'message': 'User updated successfully'})
-    except sqlite3.IntegrityError:
-        conn.close()
-        return jsonify({'error': 'Email already exists'}), 400
+    except (ValueError, KeyError, TypeError, sqlite3.IntegrityError) as e:
+        conn.rollback()
+        error = str(e) or type(e).__name__
+    
+    job = conn.execute('SELECT * FROM import_jobs WHERE id = ?', (job_id,)).fetchone()
+    conn.close()
+    
+    elapsed = time.perf_counter() - started
+    result = {
+        'job_id': job_id,
+        'committed_lines': job['committed_lines'],
+        'workouts': job['workouts'],
+        'workout_exercises': job['workout_exercises'],
+        'rows': rows,
+        'elapsed': round(elapsed, 3),
+        'rows_per_sec': round(rows / elapsed) if elapsed > 0 else rows
+    }
+    if error:
+        result['error'] = error
+        return jsonify(result), 400
+    return jsonify(result), 201
 
 # Exercise endpoints
-@app.route('/api/exercises', methods=['GET'])
+EXERCISE_FIELDS = ('id', 'name', 'category', 'muscle_groups', 'equipment', 'instructions', 'created_at',
+                   'change_seq')
+EXERCISE_UPDATE_FIELDS = ('name', 'category', 'muscle_groups', 'equipment', 'instructions')
+
+@api.route('/api/exercises', methods=['GET'])
 def get_exercises():
+    fields = requested_fields(EXERCISE_FIELDS)
+    conn = get_db_connection()
+    if fields:
+        # Projections are rare enough to read straight from the table
+        cursor = conn.execute(f'SELECT {column_list(fields)} FROM exercises ORDER BY name')
+        return list_response(conn, cursor)
+    catalog = exercise_catalog(conn)
+    conn.close()
+    return cached_json_response(catalog['body'], catalog['etag'])
+
+SEARCH_PAGE_MAX = 100
+
+def fts_query(text):
+    # Quote every word so user input can never be parsed as FTS5 syntax, and
+    # prefix-match so results appear while the user is still typing
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', text))
+
+@api.route('/api/exercises/search', methods=['GET'])
+def search_exercises():
+    fields = requested_fields(EXERCISE_FIELDS)
+    text = fts_query(request.args.get('q', ''))
+    muscles = request.args.getlist('muscle')
+    equipment = request.args.get('equipment')
+    category = request.args.get('category')
+    page = max(1, request.args.get('page', 1, type=int))
+    limit = max(1, min(request.args.get('limit', 20, type=int), SEARCH_PAGE_MAX))
+    
+    # Every requested muscle adds a join, so results must hit all of them
+    joins = [
+        f'JOIN exercise_muscles m{index} ON m{index}.exercise_id = e.id AND m{index}.muscle = ?'
+        for index in range(len(muscles))
+    ]
+    params = list(muscles)
+    conditions = []
+    if text:
+        joins.append('JOIN exercises_fts ON exercises_fts.rowid = e.id')
+        conditions.append('exercises_fts MATCH ?')
+        params.append(text)
+    if equipment:
+        conditions.append('e.equipment = ?')
+        params.append(equipment)
+    if category:
+        conditions.append('e.category = ?')
+        params.append(category)
+    
+    query = f'SELECT {column_list(fields, "e.")} FROM exercises e ' + ' '.join(joins)
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    # Name matches weigh more than matches in the instructions
+    query += ' ORDER BY bm25(exercises_fts, 10.0, 1.0), e.name' if text else ' ORDER BY e.name'
+    query += ' LIMIT ? OFFSET ?'
+    params.extend([limit + 1, (page - 1) * limit])
+    
     conn = get_db_connection()
-    exercises = conn.execute('SELECT * FROM exercises ORDER BY name').fetchall()
+    cursor = conn.execute(query, params)
+    exercises = cursor.fetchall()
+    encoder = row_encoder(cursor.description)
     conn.close()
-    return jsonify([dict(exercise) for exercise in exercises])
+    
+    response = Response('[' + ','.join(map(encoder, exercises[:limit])) + ']', mimetype='application/json')
+    if len(exercises) > limit:
+        response.headers['X-Next-Page'] = str(page + 1)
+    return response
 
-@app.route('/api/exercises/<int:exercise_id>', methods=['GET'])
+@api.route('/api/exercises/<int:exercise_id>', methods=['GET'])
 def get_exercise(exercise_id):
+    fields = requested_fields(EXERCISE_FIELDS)
     conn = get_db_connection()
-    exercise = conn.execute('SELECT * FROM exercises WHERE id = ?', (exercise_id,)).fetchone()
+    if fields:
+        exercise = conn.execute(f'SELECT {column_list(fields)} FROM exercises WHERE id = ?',
+                                (exercise_id,)).fetchone()
+        conn.close()
+        if exercise is None:
+            return jsonify({'error': 'Exercise not found'}), 404
+        return jsonify(dict(exercise))
+    catalog = exercise_catalog(conn)
     conn.close()
     
-    if exercise is None:
+    if exercise_id not in catalog['items']:
         return jsonify({'error': 'Exercise not found'}), 404
     
-    return jsonify(dict(exercise))
+    return cached_json_response(*catalog['items'][exercise_id])
 
-@app.route('/api/exercises', methods=['POST'])
-def create_exercise():
-    data = request.get_json()
-    
+def create_exercise_op(conn, data):
     required_fields = ['name', 'category']
     if not all(field in data for field in required_fields):
-        return jsonify({'error': 'Missing required fields'}), 400
+        raise ApiError('Missing required fields')
     
-    conn = get_db_connection()
     cursor = conn.execute('''
         INSERT INTO exercises (name, category, muscle_groups, equipment, instructions)
         VALUES (?, ?, ?, ?, ?)
@@ -232,330 +2725,964 @@ def create_exercise():
         data.get('equipment', ''),
         data.get('instructions', '')
     ))
-    exercise_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    bump_catalog_version(conn)
     
-    return jsonify({'id': exercise_id, 'message': 'Exercise created successfully'}), 201
+    return {'id': cursor.lastrowid, 'message': 'Exercise created successfully'}, 201
 
-@app.route('/api/exercises/<int:exercise_id>', methods=['PUT'])
-def update_exercise(exercise_id):
-    data = request.get_json()
-    
-    conn = get_db_connection()
-    exercise = conn.execute('SELECT * FROM exercises WHERE id = ?', (exercise_id,)).fetchone()
+def update_exercise_op(conn, data, exercise_id):
+    if patch_row(conn, 'exercises', EXERCISE_UPDATE_FIELDS, data, exercise_id) is None:
+        raise ApiError('Exercise not found', 404)
+    bump_catalog_version(conn)
     
+    return {'message': 'Exercise updated successfully'}, 200
+
+def delete_exercise_op(conn, data, exercise_id):
+    exercise = conn.execute('SELECT id FROM exercises WHERE id = ?', (exercise_id,)).fetchone()
     if exercise is None:
-        conn.close()
-        return jsonify({'error': 'Exercise not found'}), 404
+        raise ApiError('Exercise not found', 404)
     
-    conn.execute('''
-        UPDATE exercises 
-        SET name = ?, category = ?, muscle_groups = ?, equipment = ?, instructions = ?
-        WHERE id = ?
-    ''', (
-        data.get('name', exercise['name']),
-        data.get('category', exercise['category']),
-        data.get('muscle_groups', exercise['muscle_groups']),
-        data.get('equipment', exercise['equipment']),
-        data.get('instructions', exercise['instructions']),
-        exercise_id
-    ))
-    conn.commit()
-    conn.close()
+    try:
+        conn.execute('DELETE FROM exercises WHERE id = ?', (exercise_id,))
+    except sqlite3.IntegrityError:
+        raise ApiError('Exercise is used in existing workouts or templates', 409)
+    bump_catalog_version(conn)
     
-    return jsonify({'message': 'Exercise updated successfully'})
+    return {'message': 'Exercise deleted successfully'}, 200
 
-@app.route('/api/exercises/<int:exercise_id>', methods=['DELETE'])
-def delete_exercise(exercise_id):
-    conn = get_db_connection()
-    exercise = conn.execute('SELECT * FROM exercises WHERE id = ?', (exercise_id,)).fetchone()
-    
-    if exercise is None:
+def exercise_used_on_shards(exercise_id):
+    for shard in range(1, len(current_app.extensions['shards']['pools'])):
+        conn = get_db_connection(shard)
+        used = conn.execute('''
+            SELECT 1 FROM workout_exercises WHERE exercise_id = ?
+            UNION ALL
+            SELECT 1 FROM workout_template_exercises WHERE exercise_id = ?
+            UNION ALL
+            SELECT 1 FROM archived_records WHERE exercise_id = ?
+            LIMIT 1
+        ''', (exercise_id, exercise_id, exercise_id)).fetchone()
         conn.close()
-        return jsonify({'error': 'Exercise not found'}), 404
-    
-    conn.execute('DELETE FROM exercises WHERE id = ?', (exercise_id,))
-    conn.commit()
-    conn.close()
-    
-    return jsonify({'message': 'Exercise deleted successfully'})
+        if used is not None:
+            return True
+    return False
+
+@api.route('/api/exercises', methods=['POST'])
+def create_exercise():
+    return perform_write(create_exercise_op, request.get_json())
+
+@api.route('/api/exercises/<int:exercise_id>', methods=['PUT', 'PATCH'])
+def update_exercise(exercise_id):
+    return perform_write(update_exercise_op, request.get_json(), exercise_id=exercise_id)
+
+@api.route('/api/exercises/<int:exercise_id>', methods=['DELETE'])
+def delete_exercise(exercise_id):
+    # The foreign key only covers workouts on the main database
+    if exercise_used_on_shards(exercise_id):
+        return jsonify({'error': 'Exercise is used in existing workouts or templates'}), 409
+    return perform_write(delete_exercise_op, None, exercise_id=exercise_id)
 
 # Workout endpoints
-@app.route('/api/workouts', methods=['GET'])
+WORKOUT_FIELDS = ('id', 'user_id', 'name', 'date', 'notes', 'completed', 'completed_date',
+                  'duration', 'created_at', 'change_seq', 'exercises')
+WORKOUT_UPDATE_FIELDS = ('name', 'date', 'notes', 'completed', 'completed_date', 'duration')
+# The workout columns the progress rollups are computed from
+WORKOUT_ROLLUP_FIELDS = ('date', 'completed', 'duration')
+WORKOUT_PAGE_MAX = 200
+# SQLite caps the number of bound parameters per statement (999 on older builds)
+SQL_IN_CHUNK = 500
+
+def encode_cursor(date, workout_id):
+    return f'{date}|{workout_id}'
+
+def decode_cursor(cursor):
+    date, _, workout_id = cursor.rpartition('|')
+    if not date or not workout_id.isdigit():
+        raise ValueError('Invalid cursor')
+    return date, int(workout_id)
+
+# Fields of a workout's nested exercises, in output order
+NESTED_EXERCISE_FIELDS = ('id', 'exercise_id', 'name', 'sets', 'reps', 'weight', 'rest_time', 'notes')
+# Tables holding nested exercises, with the column naming their parent
+WORKOUT_EXERCISES = ('workout_exercises', 'workout_id')
+TEMPLATE_EXERCISES = ('workout_template_exercises', 'template_id')
+
+def load_workout_exercises(conn, workout_ids, source=WORKOUT_EXERCISES):
+    # Fetch the exercises for many workouts with one query per chunk of ids
+    # and group them, already encoded as JSON, by workout in a single pass
+    table, parent = source
+    grouped = {workout_id: [] for workout_id in workout_ids}
+    for start in range(0, len(workout_ids), SQL_IN_CHUNK):
+        chunk = workout_ids[start:start + SQL_IN_CHUNK]
+        placeholders = ','.join('?' * len(chunk))
+        cursor = conn.execute(f'''
+            SELECT we.id, we.{parent} as parent_id, we.exercise_id, e.name,
+                   we.sets, we.reps, we.weight, we.rest_time, we.notes
+            FROM {table} we
+            JOIN exercises e ON we.exercise_id = e.id
+            WHERE we.{parent} IN ({placeholders})
+            ORDER BY we.{parent}, we.id
+        ''', chunk)
+        encoder = row_encoder(cursor.description, NESTED_EXERCISE_FIELDS)
+        for ex in cursor:
+            grouped[ex['parent_id']].append(encoder(ex))
+    return grouped
+
+def workout_columns(fields, keys=()):
+    # SQL columns for a workout projection, plus any the handler needs itself
+    if fields is None:
+        return '*'
+    columns = [field for field in fields if field != 'exercises']
+    return column_list(columns + [key for key in keys if key not in columns])
+
+def workout_encoder(description, fields=None, source=WORKOUT_EXERCISES):
+    # Returns encode_batch(conn, workouts) for list_response; templates share it
+    include_exercises = fields is None or 'exercises' in fields
+    encoder = row_encoder(description, fields and [field for field in fields if field != 'exercises'])
+    
+    def encode_batch(conn, workouts):
+        if not include_exercises:
+            return list(map(encoder, workouts))
+        exercises = load_workout_exercises(conn, [workout['id'] for workout in workouts], source)
+        return [
+            encoder(workout)[:-1] + ',"exercises":[' + ','.join(exercises[workout['id']]) + ']}'
+            for workout in workouts
+        ]
+    return encode_batch
+
+@api.route('/api/workouts', methods=['GET'])
 def get_workouts():
+    fields = requested_fields(WORKOUT_FIELDS)
     user_id = request.args.get('user_id')
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', type=int)
     
-    conn = get_db_connection()
+    if not user_id and sharded():
+        return jsonify({'error': 'user_id is required when sharding is enabled'}), 400
+    
+    conditions = []
+    params = []
     if user_id:
-        workouts = conn.execute('''
-            SELECT * FROM workouts 
-            WHERE user_id = ? 
-            ORDER BY date DESC
-        ''', (user_id,)).fetchall()
-    else:
-        workouts = conn.execute('SELECT * FROM workouts ORDER BY date DESC').fetchall()
+        conditions.append('user_id = ?')
+        params.append(user_id)
+    if date_from:
+        conditions.append('date >= ?')
+        params.append(date_from)
+    if date_to:
+        conditions.append('date <= ?')
+        params.append(date_to)
+    cursor_date = cursor_id = None
+    if cursor:
+        try:
+            cursor_date, cursor_id = decode_cursor(cursor)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        # Keyset pagination: continue strictly after the last (date, id) seen
+        conditions.append('(date < ? OR (date = ? AND id < ?))')
+        params.extend([cursor_date, cursor_date, cursor_id])
     
-    # Get exercises for each workout
-    workout_list = []
-    for workout in workouts:
-        workout_dict = dict(workout)
-        
-        # Get workout exercises
-        exercises = conn.execute('''
-            SELECT we.*, e.name as exercise_name
-            FROM workout_exercises we
-            JOIN exercises e ON we.exercise_id = e.id
-            WHERE we.workout_id = ?
-        ''', (workout['id'],)).fetchall()
-        
-        workout_dict['exercises'] = [
-            {
-                'id': ex['id'],
-                'exercise_id': ex['exercise_id'],
-                'name': ex['exercise_name'],
-                'sets': ex['sets'],
-                'reps': ex['reps'],
-                'weight': ex['weight'],
-                'rest_time': ex['rest_time'],
-                'notes': ex['notes']
-            }
-            for ex in exercises
-        ]
-        
-        workout_list.append(workout_dict)
+    # The date is read even when not requested since the next cursor needs it
+    query = f'SELECT {workout_columns(fields, ["date"])} FROM workouts'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY date DESC, id DESC'
+    if limit is not None:
+        limit = max(1, min(limit, WORKOUT_PAGE_MAX))
+        # Fetch one extra row to know whether another page exists
+        query += ' LIMIT ?'
+        params.append(limit + 1)
+    
+    conn = get_db_connection(user_shard(user_id))
+    cursor = conn.execute(query, params)
+    archive = archive_ranges(conn, user_id, date_from, date_to, cursor_date)
+    if limit is None and not archive:
+        return list_response(conn, cursor, workout_encoder(cursor.description, fields))
+    
+    workouts = [(workout['date'], workout['id'], workout) for workout in cursor.fetchall()]
+    # A full page of hot workouts newer than anything archived needs no archive
+    if archive and (limit is None or len(workouts) <= limit
+                    or workouts[limit - 1][0] <= max(row['last_date'] for row in archive)):
+        hot_ids = {workout_id for _, workout_id, _ in workouts}
+        for workout in load_archive(conn, [(row['user_id'], row['year']) for row in archive]):
+            key = (workout['date'], workout['id'])
+            if (workout['id'] in hot_ids or (date_from and key[0] < date_from) or (date_to and key[0] > date_to)
+                    or (cursor_date and key >= (cursor_date, cursor_id))):
+                continue
+            workouts.append(key + (workout,))
+        workouts.sort(key=operator.itemgetter(0, 1), reverse=True)
     
+    next_cursor = None
+    if limit is not None and len(workouts) > limit:
+        workouts = workouts[:limit]
+        next_cursor = encode_cursor(*workouts[-1][:2])
+    
+    hot = [workout for _, _, workout in workouts if not isinstance(workout, dict)]
+    cold = [workout for _, _, workout in workouts if isinstance(workout, dict)]
+    encoded = dict(zip([workout['id'] for workout in hot], workout_encoder(cursor.description, fields)(conn, hot)))
+    encoded.update(zip([workout['id'] for workout in cold], archive_encoder(cursor.description, fields)(conn, cold)))
+    workout_list = [encoded[workout_id] for _, workout_id, _ in workouts]
     conn.close()
-    return jsonify(workout_list)
+    
+    response = Response('[' + ','.join(workout_list) + ']', mimetype='application/json')
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
-@app.route('/api/workouts/<int:workout_id>', methods=['GET'])
+@api.route('/api/workouts/<int:workout_id>', methods=['GET'])
 def get_workout(workout_id):
-    conn = get_db_connection()
-    workout = conn.execute('SELECT * FROM workouts WHERE id = ?', (workout_id,)).fetchone()
+    fields = requested_fields(WORKOUT_FIELDS)
+    conn = get_db_connection(row_shard(workout_id))
+    cursor = conn.execute(f'SELECT {workout_columns(fields)} FROM workouts WHERE id = ?', (workout_id,))
+    workout = cursor.fetchone()
+    encoder = workout_encoder(cursor.description, fields)
+    if workout is None:
+        workout = archived_workout(conn, workout_id)
+        encoder = archive_encoder(cursor.description, fields)
     
     if workout is None:
         conn.close()
         return jsonify({'error': 'Workout not found'}), 404
     
-    # Get workout exercises
-    exercises = conn.execute('''
-        SELECT we.*, e.name as exercise_name
-        FROM workout_exercises we
-        JOIN exercises e ON we.exercise_id = e.id
-        WHERE we.workout_id = ?
-    ''', (workout_id,)).fetchall()
-    
-    workout_dict = dict(workout)
-    workout_dict['exercises'] = [
-        {
-            'id': ex['id'],
-            'exercise_id': ex['exercise_id'],
-            'name': ex['exercise_name'],
-            'sets': ex['sets'],
-            'reps': ex['reps'],
-            'weight': ex['weight'],
-            'rest_time': ex['rest_time'],
-            'notes': ex['notes']
-        }
-        for ex in exercises
-    ]
+    body = encoder(conn, [workout])[0]
     
     conn.close()
-    return jsonify(workout_dict)
+    return Response(body, mimetype='application/json')
 
-@app.route('/api/workouts', methods=['POST'])
-def create_workout():
-    data = request.get_json()
-    
+def create_workout_op(conn, data):
     required_fields = ['user_id', 'name', 'date']
     if not all(field in data for field in required_fields):
-        return jsonify({'error': 'Missing required fields'}), 400
+        raise ApiError('Missing required fields')
+    if workout_day(data['date']) is None:
+        raise ApiError('Invalid date')
     
-    conn = get_db_connection()
+    try:
+        check_references(conn, users=[data['user_id']])
+        # Create workout
+        cursor = conn.execute('''
+            INSERT INTO workouts (user_id, name, date, notes, completed, duration)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            data['user_id'],
+            data['name'],
+            data['date'],
+            data.get('notes', ''),
+            data.get('completed', False),
+            data.get('duration')
+        ))
+        workout_id = cursor.lastrowid
+        
+        # Add exercises to workout
+        insert_exercises(conn, WORKOUT_EXERCISES, workout_id, data.get('exercises', []))
+    except sqlite3.IntegrityError:
+        raise ApiError('Unknown user or exercise')
     
-    # Create workout
-    cursor = conn.execute('''
-        INSERT INTO workouts (user_id, name, date, notes, completed, duration)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (
-        data['user_id'],
-        data['name'],
-        data['date'],
-        data.get('notes', ''),
-        data.get('completed', False),
-        data.get('duration')
-    ))
-    workout_id = cursor.lastrowid
-    
-    # Add exercises to workout
-    if 'exercises' in data:
-        for exercise in data['exercises']:
-            conn.execute('''
-                INSERT INTO workout_exercises (workout_id, exercise_id, sets, reps, weight, rest_time, notes)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                workout_id,
-                exercise['exercise_id'],
-                exercise['sets'],
-                exercise['reps'],
-                exercise.get('weight', 0),
-                exercise.get('rest_time', 60),
-                exercise.get('notes', '')
-            ))
+    update_rollups(conn, workout_id, None)
+    raise_personal_records(conn, workout_id)
     
-    conn.commit()
-    conn.close()
+    return {'id': workout_id, 'message': 'Workout created successfully'}, 201
+
+def insert_exercises(conn, target, parent_id, exercises):
+    table, parent = target
+    if not all('exercise_id' in exercise and 'sets' in exercise and 'reps' in exercise for exercise in exercises):
+        raise ApiError('Missing required fields')
+    check_references(conn, exercises=[exercise['exercise_id'] for exercise in exercises])
+    conn.executemany(f'''
+        INSERT INTO {table} ({parent}, exercise_id, sets, reps, weight, rest_time, notes)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        (
+            parent_id,
+            exercise['exercise_id'],
+            exercise['sets'],
+            exercise['reps'],
+            exercise.get('weight', 0),
+            exercise.get('rest_time', 60),
+            exercise.get('notes', '')
+        )
+        for exercise in exercises
+    ])
+
+def copy_exercises(conn, source, source_id, target, target_id):
+    # One INSERT ... SELECT however many exercises there are
+    conn.execute(f'''
+        INSERT INTO {target[0]} ({target[1]}, exercise_id, sets, reps, weight, rest_time, notes)
+        SELECT ?, exercise_id, sets, reps, weight, rest_time, notes
+        FROM {source[0]}
+        WHERE {source[1]} = ?
+        ORDER BY id
+    ''', (target_id, source_id))
+
+def clone_workout_op(conn, data, workout_id):
+    # The copy is a planned session: not completed, with no duration yet
+    workout_date = data.get('date') or date.today().isoformat()
+    if workout_day(workout_date) is None:
+        raise ApiError('Invalid date')
+    rows = conn.execute('''
+        INSERT INTO workouts (user_id, name, date, notes)
+        SELECT user_id, COALESCE(?, name), ?, notes FROM workouts WHERE id = ?
+        RETURNING id
+    ''', (data.get('name'), workout_date, workout_id)).fetchall()
+    if rows:
+        clone_id = rows[0]['id']
+        copy_exercises(conn, WORKOUT_EXERCISES, workout_id, WORKOUT_EXERCISES, clone_id)
+    else:
+        # An archived workout can still be repeated
+        workout = archived_workout(conn, workout_id)
+        if workout is None:
+            raise ApiError('Workout not found', 404)
+        clone_id = conn.execute('INSERT INTO workouts (user_id, name, date, notes) VALUES (?, ?, ?, ?)', (
+            workout['user_id'], data.get('name') or workout['name'],
+            workout_date, workout['notes']
+        )).lastrowid
+        insert_exercises(conn, WORKOUT_EXERCISES, clone_id, workout['exercises'])
+    # Copies of the user's own sets cannot beat their personal records
+    update_rollups(conn, clone_id, None)
     
-    return jsonify({'id': workout_id, 'message': 'Workout created successfully'}), 201
+    return {'id': clone_id, 'message': 'Workout cloned successfully'}, 201
 
-@app.route('/api/workouts/<int:workout_id>', methods=['PUT'])
-def update_workout(workout_id):
-    data = request.get_json()
+def update_workout_op(conn, data, workout_id):
+    if 'date' in data and workout_day(data['date']) is None:
+        raise ApiError('Invalid date')
+    # The rollups only need the old contribution when a column they use changes;
+    # it is None for a workout without a valid date, which counts for nothing
+    rollups_change = any(field in data for field in WORKOUT_ROLLUP_FIELDS)
+    unarchive_workout(conn, workout_id)
+    before = workout_contribution(conn, workout_id) if rollups_change else None
     
-    conn = get_db_connection()
-    workout = conn.execute('SELECT * FROM workouts WHERE id = ?', (workout_id,)).fetchone()
+    if patch_row(conn, 'workouts', WORKOUT_UPDATE_FIELDS, data, workout_id) is None:
+        raise ApiError('Workout not found', 404)
+    
+    if rollups_change:
+        update_rollups(conn, workout_id, before)
     
+    return {'message': 'Workout updated successfully'}, 200
+
+def delete_workout_op(conn, data, workout_id):
+    unarchive_workout(conn, workout_id)
+    workout = conn.execute('SELECT * FROM workouts WHERE id = ?', (workout_id,)).fetchone()
     if workout is None:
-        conn.close()
-        return jsonify({'error': 'Workout not found'}), 404
+        raise ApiError('Workout not found', 404)
     
-    # Update workout
-    conn.execute('''
-        UPDATE workouts 
-        SET name = ?, date = ?, notes = ?, completed = ?, completed_date = ?, duration = ?
-        WHERE id = ?
-    ''', (
-        data.get('name', workout['name']),
-        data.get('date', workout['date']),
-        data.get('notes', workout['notes']),
-        data.get('completed', workout['completed']),
-        data.get('completed_date', workout['completed_date']),
-        data.get('duration', workout['duration']),
-        workout_id
-    ))
+    before = workout_contribution(conn, workout_id)
+    exercise_ids = [row['exercise_id'] for row in conn.execute(
+        'SELECT DISTINCT exercise_id FROM workout_exercises WHERE workout_id = ?', (workout_id,)
+    ).fetchall()]
     
-    conn.commit()
-    conn.close()
+    # Delete workout (workout_exercises will be deleted due to CASCADE)
+    conn.execute('DELETE FROM workouts WHERE id = ?', (workout_id,))
+    # The extra shards have no foreign keys to cascade
+    if on_shard(conn):
+        conn.execute('DELETE FROM workout_exercises WHERE workout_id = ?', (workout_id,))
+    update_rollups(conn, workout_id, before)
+    for exercise_id in exercise_ids:
+        recompute_personal_record(conn, workout['user_id'], exercise_id)
     
-    return jsonify({'message': 'Workout updated successfully'})
+    return {'message': 'Workout deleted successfully'}, 200
 
-@app.route('/api/workouts/<int:workout_id>', methods=['DELETE'])
+@api.route('/api/workouts', methods=['POST'])
+def create_workout():
+    return perform_write(create_workout_op, request.get_json())
+
+@api.route('/api/workouts/<int:workout_id>', methods=['PUT', 'PATCH'])
+def update_workout(workout_id):
+    return perform_write(update_workout_op, request.get_json(), workout_id=workout_id)
+
+@api.route('/api/workouts/<int:workout_id>', methods=['DELETE'])
 def delete_workout(workout_id):
-    conn = get_db_connection()
-    workout = conn.execute('SELECT * FROM workouts WHERE id = ?', (workout_id,)).fetchone()
+    return perform_write(delete_workout_op, None, workout_id=workout_id)
+
+@api.route('/api/workouts/<int:workout_id>/clone', methods=['POST'])
+def clone_workout(workout_id):
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    return perform_write(clone_workout_op, data, workout_id=workout_id)
+
+# Workout templates
+# Reusable sessions: a template holds exercises like a workout does, and both
+# saving a workout as a template and starting a workout from one copy the
+# exercises with a single INSERT ... SELECT.
+TEMPLATE_FIELDS = ('id', 'user_id', 'name', 'notes', 'created_at', 'exercises')
+TEMPLATE_UPDATE_FIELDS = ('name', 'notes')
+
+@api.route('/api/workout-templates', methods=['GET'])
+def get_workout_templates():
+    fields = requested_fields(TEMPLATE_FIELDS)
+    user_id = request.args.get('user_id')
+    if not user_id and sharded():
+        return jsonify({'error': 'user_id is required when sharding is enabled'}), 400
+    query = f'SELECT {workout_columns(fields)} FROM workout_templates'
+    params = []
+    if user_id:
+        query += ' WHERE user_id = ?'
+        params.append(user_id)
     
-    if workout is None:
+    conn = get_db_connection(user_shard(user_id))
+    cursor = conn.execute(query + ' ORDER BY id', params)
+    return list_response(conn, cursor, workout_encoder(cursor.description, fields, TEMPLATE_EXERCISES))
+
+@api.route('/api/workout-templates/<int:template_id>', methods=['GET'])
+def get_workout_template(template_id):
+    fields = requested_fields(TEMPLATE_FIELDS)
+    conn = get_db_connection(row_shard(template_id))
+    cursor = conn.execute(f'SELECT {workout_columns(fields)} FROM workout_templates WHERE id = ?', (template_id,))
+    template = cursor.fetchone()
+    
+    if template is None:
         conn.close()
-        return jsonify({'error': 'Workout not found'}), 404
+        return jsonify({'error': 'Template not found'}), 404
+    
+    body = workout_encoder(cursor.description, fields, TEMPLATE_EXERCISES)(conn, [template])[0]
     
-    # Delete workout (workout_exercises will be deleted due to CASCADE)
-    conn.execute('DELETE FROM workouts WHERE id = ?', (workout_id,))
-    conn.commit()
     conn.close()
+    return Response(body, mimetype='application/json')
+
+def create_workout_template_op(conn, data):
+    # Either save an existing workout as a template or build one from scratch
+    if 'workout_id' in data:
+        rows = conn.execute('''
+            INSERT INTO workout_templates (user_id, name, notes)
+            SELECT user_id, COALESCE(?, name), COALESCE(?, notes) FROM workouts WHERE id = ?
+            RETURNING id
+        ''', (data.get('name'), data.get('notes'), data['workout_id'])).fetchall()
+        if rows:
+            template_id = rows[0]['id']
+            copy_exercises(conn, WORKOUT_EXERCISES, data['workout_id'], TEMPLATE_EXERCISES, template_id)
+            return {'id': template_id, 'message': 'Template created successfully'}, 201
+        workout = archived_workout(conn, data['workout_id'])
+        if workout is None:
+            raise ApiError('Workout not found', 404)
+        template_id = conn.execute('INSERT INTO workout_templates (user_id, name, notes) VALUES (?, ?, ?)', (
+            workout['user_id'], data.get('name') or workout['name'], data.get('notes') or workout['notes']
+        )).lastrowid
+        insert_exercises(conn, TEMPLATE_EXERCISES, template_id, workout['exercises'])
+        return {'id': template_id, 'message': 'Template created successfully'}, 201
+    
+    if not all(field in data for field in ('user_id', 'name')):
+        raise ApiError('Missing required fields')
+    try:
+        check_references(conn, users=[data['user_id']])
+        cursor = conn.execute('INSERT INTO workout_templates (user_id, name, notes) VALUES (?, ?, ?)',
+                              (data['user_id'], data['name'], data.get('notes', '')))
+        insert_exercises(conn, TEMPLATE_EXERCISES, cursor.lastrowid, data.get('exercises', []))
+    except sqlite3.IntegrityError:
+        raise ApiError('Unknown user or exercise')
+    
+    return {'id': cursor.lastrowid, 'message': 'Template created successfully'}, 201
+
+def update_workout_template_op(conn, data, template_id):
+    if patch_row(conn, 'workout_templates', TEMPLATE_UPDATE_FIELDS, data, template_id) is None:
+        raise ApiError('Template not found', 404)
+    
+    return {'message': 'Template updated successfully'}, 200
+
+def delete_workout_template_op(conn, data, template_id):
+    # Template exercises go with it (ON DELETE CASCADE)
+    if not conn.execute('DELETE FROM workout_templates WHERE id = ? RETURNING id', (template_id,)).fetchall():
+        raise ApiError('Template not found', 404)
+    # The extra shards have no foreign keys to cascade
+    if on_shard(conn):
+        conn.execute('DELETE FROM workout_template_exercises WHERE template_id = ?', (template_id,))
+    
+    return {'message': 'Template deleted successfully'}, 200
+
+def start_workout_template_op(conn, data, template_id):
+    workout_date = data.get('date') or date.today().isoformat()
+    if workout_day(workout_date) is None:
+        raise ApiError('Invalid date')
+    rows = conn.execute('''
+        INSERT INTO workouts (user_id, name, date, notes)
+        SELECT user_id, COALESCE(?, name), ?, notes FROM workout_templates WHERE id = ?
+        RETURNING id
+    ''', (data.get('name'), workout_date, template_id)).fetchall()
+    if not rows:
+        raise ApiError('Template not found', 404)
+    
+    workout_id = rows[0]['id']
+    copy_exercises(conn, TEMPLATE_EXERCISES, template_id, WORKOUT_EXERCISES, workout_id)
+    update_rollups(conn, workout_id, None)
+    raise_personal_records(conn, workout_id)
     
-    return jsonify({'message': 'Workout deleted successfully'})
+    return {'id': workout_id, 'message': 'Workout created successfully'}, 201
+
+@api.route('/api/workout-templates', methods=['POST'])
+def create_workout_template():
+    return perform_write(create_workout_template_op, request.get_json())
+
+@api.route('/api/workout-templates/<int:template_id>', methods=['PUT', 'PATCH'])
+def update_workout_template(template_id):
+    return perform_write(update_workout_template_op, request.get_json(), template_id=template_id)
+
+@api.route('/api/workout-templates/<int:template_id>', methods=['DELETE'])
+def delete_workout_template(template_id):
+    return perform_write(delete_workout_template_op, None, template_id=template_id)
+
+@api.route('/api/workout-templates/<int:template_id>/workouts', methods=['POST'])
+def start_workout_template(template_id):
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    return perform_write(start_workout_template_op, data, template_id=template_id)
 
 # Workout Exercise endpoints
-@app.route('/api/workout-exercises/<int:workout_id>', methods=['GET'])
+# Response field -> SQL expression; the exercise name comes from the catalog
+WORKOUT_EXERCISE_FIELDS = {
+    'id': 'we.id',
+    'workout_id': 'we.workout_id',
+    'exercise_id': 'we.exercise_id',
+    'name': 'e.name',
+    'sets': 'we.sets',
+    'reps': 'we.reps',
+    'weight': 'we.weight',
+    'rest_time': 'we.rest_time',
+    'notes': 'we.notes',
+    'change_seq': 'we.change_seq'
+}
+WORKOUT_EXERCISE_UPDATE_FIELDS = ('sets', 'reps', 'weight', 'rest_time', 'notes')
+# The columns personal records are computed from
+WORKOUT_EXERCISE_RECORD_FIELDS = ('sets', 'reps', 'weight')
+
+@api.route('/api/workout-exercises/<int:workout_id>', methods=['GET'])
 def get_workout_exercises(workout_id):
-    conn = get_db_connection()
-    exercises = conn.execute('''
-        SELECT we.*, e.name as exercise_name
+    fields = requested_fields(WORKOUT_EXERCISE_FIELDS) or list(WORKOUT_EXERCISE_FIELDS)
+    columns = ', '.join(f'{WORKOUT_EXERCISE_FIELDS[field]} as {field}' for field in fields)
+    # Only join the catalog when the exercise name is wanted
+    join = 'JOIN exercises e ON we.exercise_id = e.id' if 'name' in fields else ''
+    conn = get_db_connection(row_shard(workout_id))
+    workout = archived_workout(conn, workout_id)
+    if workout is not None:
+        names = dict(conn.execute('SELECT id, name FROM exercises WHERE id IN (SELECT value FROM json_each(?))', (
+            json.dumps([exercise['exercise_id'] for exercise in workout['exercises']]),
+        )).fetchall())
+        encoder = row_encoder([(field,) for field in fields])
+        body = '[' + ','.join(
+            encoder(tuple(names.get(exercise['exercise_id']) if field == 'name' else exercise.get(field)
+                          for field in fields))
+            for exercise in workout['exercises'] if exercise['exercise_id'] in names or 'name' not in fields
+        ) + ']'
+        conn.close()
+        return Response(body, mimetype='application/json')
+    cursor = conn.execute(f'''
+        SELECT {columns}
         FROM workout_exercises we
-        JOIN exercises e ON we.exercise_id = e.id
+        {join}
         WHERE we.workout_id = ?
-    ''', (workout_id,)).fetchall()
-    conn.close()
-    
-    return jsonify([
-        {
-            'id': ex['id'],
-            'workout_id': ex['workout_id'],
-            'exercise_id': ex['exercise_id'],
-            'name': ex['exercise_name'],
-            'sets': ex['sets'],
-            'reps': ex['reps'],
-            'weight': ex['weight'],
-            'rest_time': ex['rest_time'],
-            'notes': ex['notes']
-        }
-        for ex in exercises
-    ])
+    ''', (workout_id,))
+    return list_response(conn, cursor)
 
-@app.route('/api/workout-exercises', methods=['POST'])
-def create_workout_exercise():
-    data = request.get_json()
-    
+def create_workout_exercise_op(conn, data):
     required_fields = ['workout_id', 'exercise_id', 'sets', 'reps']
     if not all(field in data for field in required_fields):
-        return jsonify({'error': 'Missing required fields'}), 400
+        raise ApiError('Missing required fields')
     
-    conn = get_db_connection()
-    cursor = conn.execute('''
-        INSERT INTO workout_exercises (workout_id, exercise_id, sets, reps, weight, rest_time, notes)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        data['workout_id'],
-        data['exercise_id'],
-        data['sets'],
-        data['reps'],
-        data.get('weight', 0),
-        data.get('rest_time', 60),
-        data.get('notes', '')
-    ))
-    exercise_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    unarchive_workout(conn, data['workout_id'])
+    before = workout_contribution(conn, data['workout_id'])
+    try:
+        check_references(conn, exercises=[data['exercise_id']], workouts=[data['workout_id']])
+        cursor = conn.execute('''
+            INSERT INTO workout_exercises (workout_id, exercise_id, sets, reps, weight, rest_time, notes)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            data['workout_id'],
+            data['exercise_id'],
+            data['sets'],
+            data['reps'],
+            data.get('weight', 0),
+            data.get('rest_time', 60),
+            data.get('notes', '')
+        ))
+    except sqlite3.IntegrityError:
+        raise ApiError('Unknown workout or exercise')
+    update_rollups(conn, data['workout_id'], before)
+    raise_personal_records(conn, data['workout_id'])
     
-    return jsonify({'id': exercise_id, 'message': 'Workout exercise created successfully'}), 201
+    return {'id': cursor.lastrowid, 'message': 'Workout exercise created successfully'}, 201
 
-@app.route('/api/workout-exercises/<int:exercise_id>', methods=['PUT'])
-def update_workout_exercise(exercise_id):
-    data = request.get_json()
+def update_workout_exercise_op(conn, data, exercise_id):
+    # The exercise count is all the rollups take from here, and it cannot change
+    unarchive_workout_exercise(conn, exercise_id)
+    exercise = patch_row(conn, 'workout_exercises', WORKOUT_EXERCISE_UPDATE_FIELDS, data, exercise_id,
+                         'exercise_id, (SELECT user_id FROM workouts WHERE id = workout_id) as user_id')
+    if exercise is None:
+        raise ApiError('Workout exercise not found', 404)
     
-    conn = get_db_connection()
-    exercise = conn.execute('SELECT * FROM workout_exercises WHERE id = ?', (exercise_id,)).fetchone()
+    if exercise['user_id'] is not None and any(field in data for field in WORKOUT_EXERCISE_RECORD_FIELDS):
+        recompute_personal_record(conn, exercise['user_id'], exercise['exercise_id'])
     
+    return {'message': 'Workout exercise updated successfully'}, 200
+
+def delete_workout_exercise_op(conn, data, exercise_id):
+    unarchive_workout_exercise(conn, exercise_id)
+    exercise = conn.execute('SELECT * FROM workout_exercises WHERE id = ?', (exercise_id,)).fetchone()
     if exercise is None:
+        raise ApiError('Workout exercise not found', 404)
+    
+    before = workout_contribution(conn, exercise['workout_id'])
+    conn.execute('DELETE FROM workout_exercises WHERE id = ?', (exercise_id,))
+    update_rollups(conn, exercise['workout_id'], before)
+    owner = conn.execute('SELECT user_id FROM workouts WHERE id = ?', (exercise['workout_id'],)).fetchone()
+    if owner is not None:
+        recompute_personal_record(conn, owner['user_id'], exercise['exercise_id'])
+    
+    return {'message': 'Workout exercise deleted successfully'}, 200
+
+@api.route('/api/workout-exercises', methods=['POST'])
+def create_workout_exercise():
+    return perform_write(create_workout_exercise_op, request.get_json())
+
+@api.route('/api/workout-exercises/<int:exercise_id>', methods=['PUT', 'PATCH'])
+def update_workout_exercise(exercise_id):
+    return perform_write(update_workout_exercise_op, request.get_json(), exercise_id=exercise_id)
+
+@api.route('/api/workout-exercises/<int:exercise_id>', methods=['DELETE'])
+def delete_workout_exercise(exercise_id):
+    return perform_write(delete_workout_exercise_op, None, exercise_id=exercise_id)
+
+# Delta sync
+# Clients keep the cursor from their last sync and get back only what changed
+# after it: the rows themselves, and the ids of deleted rows.
+def read_changes(conn, since, queries, tombstones, deleted):
+    # The current sequence and the changed rows as JSON members, read from one
+    # snapshot, or None if tombstones after since have been pruned. Deleted ids
+    # are added to deleted; the connection is closed.
+    conn.execute('BEGIN')
+    state = conn.execute('SELECT seq, pruned_seq FROM sync_sequence').fetchone()
+    if 0 < since < state['pruned_seq']:
+        conn.commit()
         conn.close()
-        return jsonify({'error': 'Workout exercise not found'}), 404
+        return None
     
-    conn.execute('''
-        UPDATE workout_exercises 
-        SET sets = ?, reps = ?, weight = ?, rest_time = ?, notes = ?
-        WHERE id = ?
-    ''', (
-        data.get('sets', exercise['sets']),
-        data.get('reps', exercise['reps']),
-        data.get('weight', exercise['weight']),
-        data.get('rest_time', exercise['rest_time']),
-        data.get('notes', exercise['notes']),
-        exercise_id
-    ))
+    parts = []
+    for name, query, params in queries:
+        cursor = conn.execute(query, params)
+        encoder = row_encoder(cursor.description)
+        parts.append(f'"{name}":[' + ','.join(map(encoder, cursor)) + ']')
+    for query, params in tombstones:
+        for row in conn.execute(query, params):
+            deleted[row['entity']].append(row['row_id'])
     conn.commit()
     conn.close()
+    return state['seq'], parts
+
+def sync_response(cursor, parts, deleted):
+    parts = [f'"cursor":"{cursor}"'] + parts + ['"deleted":' + json.dumps(deleted, separators=(',', ':'))]
+    return Response('{' + ','.join(parts) + '}', mimetype='application/json')
+
+@api.route('/api/sync', methods=['GET'])
+def sync():
+    since = request.args.get('since', '0')
+    user_id = request.args.get('user_id', type=int)
+    if sharded():
+        return sharded_sync(since, user_id)
+    if not since.isdigit():
+        return jsonify({'error': 'Invalid cursor'}), 400
+    since = int(since)
     
-    return jsonify({'message': 'Workout exercise updated successfully'})
+    if user_id is None:
+        queries = [
+            ('users', 'SELECT * FROM users WHERE change_seq > ?', (since,)),
+            ('exercises', 'SELECT * FROM exercises WHERE change_seq > ?', (since,)),
+            ('workouts', 'SELECT * FROM workouts WHERE change_seq > ?', (since,)),
+            ('workout_exercises', 'SELECT * FROM workout_exercises WHERE change_seq > ?', (since,)),
+        ]
+        tombstones = [('SELECT entity, row_id FROM tombstones WHERE seq > ? ORDER BY seq', (since,))]
+    else:
+        # One user's data plus the shared exercise catalog
+        queries = [
+            ('users', 'SELECT * FROM users WHERE id = ? AND change_seq > ?', (user_id, since)),
+            ('exercises', 'SELECT * FROM exercises WHERE change_seq > ?', (since,)),
+            ('workouts', 'SELECT * FROM workouts WHERE user_id = ? AND change_seq > ?', (user_id, since)),
+            ('workout_exercises', """
+                SELECT we.* FROM workout_exercises we
+                JOIN workouts w ON w.id = we.workout_id
+                WHERE we.change_seq > ? AND w.user_id = ?
+            """, (since, user_id)),
+        ]
+        tombstones = [
+            ('SELECT entity, row_id FROM tombstones WHERE user_id = ? AND seq > ? ORDER BY seq', (user_id, since)),
+            ('SELECT entity, row_id FROM tombstones WHERE user_id IS NULL AND seq > ? ORDER BY seq', (since,)),
+        ]
+    
+    deleted = {table: [] for table in SYNC_TABLES}
+    changes = read_changes(get_db_connection(), since, queries, tombstones, deleted)
+    if changes is None:
+        return jsonify({'error': 'Cursor expired; sync again without since'}), 410
+    seq, parts = changes
+    return sync_response(seq, parts, deleted)
 
-@app.route('/api/workout-exercises/<int:exercise_id>', methods=['DELETE'])
-def delete_workout_exercise(exercise_id):
+def sharded_sync(since, user_id):
+    # The user and the catalog come from the main database and the workouts
+    # from the user's shard, each with its own sequence, so the cursor is
+    # "main.moves.shard". Moving the user to another shard invalidates it.
+    if user_id is None:
+        return jsonify({'error': 'user_id is required when sharding is enabled'}), 400
+    seen = since.split('.')
+    if since != '0' and (len(seen) != 3 or not all(part.isdigit() for part in seen)):
+        return jsonify({'error': 'Invalid cursor'}), 400
+    main_since, seen_moves, shard_since = (0, None, 0) if since == '0' else map(int, seen)
+    
     conn = get_db_connection()
-    exercise = conn.execute('SELECT * FROM workout_exercises WHERE id = ?', (exercise_id,)).fetchone()
+    placement = conn.execute('SELECT shard, moves FROM user_shards WHERE user_id = ?', (user_id,)).fetchone()
+    shard, moves = (placement['shard'], placement['moves']) if placement else (0, 0)
+    if seen_moves is not None and seen_moves != moves:
+        conn.close()
+        return jsonify({'error': 'Cursor expired; sync again without since'}), 410
     
-    if exercise is None:
+    deleted = {table: [] for table in SYNC_TABLES}
+    main_changes = read_changes(conn, main_since, [
+        ('users', 'SELECT * FROM users WHERE id = ? AND change_seq > ?', (user_id, main_since)),
+        ('exercises', 'SELECT * FROM exercises WHERE change_seq > ?', (main_since,)),
+    ], [
+        ("SELECT entity, row_id FROM tombstones WHERE user_id = ? AND entity = 'users' AND seq > ? ORDER BY seq",
+         (user_id, main_since)),
+        ('SELECT entity, row_id FROM tombstones WHERE user_id IS NULL AND seq > ? ORDER BY seq', (main_since,)),
+    ], deleted)
+    shard_changes = main_changes and read_changes(get_db_connection(shard), shard_since, [
+        ('workouts', 'SELECT * FROM workouts WHERE user_id = ? AND change_seq > ?', (user_id, shard_since)),
+        ('workout_exercises', """
+            SELECT we.* FROM workout_exercises we
+            JOIN workouts w ON w.id = we.workout_id
+            WHERE we.change_seq > ? AND w.user_id = ?
+        """, (shard_since, user_id)),
+    ], [
+        ("SELECT entity, row_id FROM tombstones WHERE user_id = ? AND entity != 'users' AND seq > ? ORDER BY seq",
+         (user_id, shard_since)),
+    ], deleted)
+    if shard_changes is None:
+        return jsonify({'error': 'Cursor expired; sync again without since'}), 410
+    return sync_response(f'{main_changes[0]}.{moves}.{shard_changes[0]}', main_changes[1] + shard_changes[1], deleted)
+
+@api.cli.command('prune-tombstones')
+@click.option('--days', default=90, show_default=True, help='Keep tombstones this many days old.')
+def prune_tombstones_command(days):
+    """Delete old tombstones; clients with older cursors must do a full sync."""
+    cutoff = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+    for shard in range(len(current_app.extensions['shards']['pools'])):
+        conn = get_db_connection(shard)
+        pruned = conn.execute('SELECT MAX(seq) FROM tombstones WHERE deleted_at < ?', (cutoff,)).fetchone()[0]
+        if pruned is not None:
+            conn.execute('DELETE FROM tombstones WHERE seq <= ?', (pruned,))
+            conn.execute('UPDATE sync_sequence SET pruned_seq = ?', (pruned,))
+            conn.commit()
         conn.close()
-        return jsonify({'error': 'Workout exercise not found'}), 404
+        where = f' on shard {shard}' if sharded() else ''
+        click.echo(f'Pruned tombstones through sequence {pruned or 0}{where}')
+
+# Batch endpoint
+# Write operations a batch may contain, by the endpoint name of their route
+BATCH_OPERATIONS = {
+    'api.create_user': create_user_op,
+    'api.update_user': update_user_op,
+    'api.create_exercise': create_exercise_op,
+    'api.update_exercise': update_exercise_op,
+    'api.delete_exercise': delete_exercise_op,
+    'api.create_workout': create_workout_op,
+    'api.update_workout': update_workout_op,
+    'api.delete_workout': delete_workout_op,
+    'api.clone_workout': clone_workout_op,
+    'api.create_workout_template': create_workout_template_op,
+    'api.update_workout_template': update_workout_template_op,
+    'api.delete_workout_template': delete_workout_template_op,
+    'api.start_workout_template': start_workout_template_op,
+    'api.create_workout_exercise': create_workout_exercise_op,
+    'api.update_workout_exercise': update_workout_exercise_op,
+    'api.delete_workout_exercise': delete_workout_exercise_op,
+}
+BATCH_MAX_OPERATIONS = 500
+
+def resolve_refs(value, refs):
+    # "$name" (or "$0" for the first operation) stands for the id an earlier
+    # operation in the same batch created
+    if isinstance(value, str) and value.startswith('$'):
+        if value[1:] not in refs:
+            raise ApiError(f'Unknown reference {value}')
+        return refs[value[1:]]
+    if isinstance(value, dict):
+        return {key: resolve_refs(item, refs) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve_refs(item, refs) for item in value]
+    return value
+
+def batch_shard(adapter, operations):
+    # A batch is one transaction, so it must stay on one shard. Operations on
+    # ids the batch creates itself go wherever the operations creating them go.
+    shards = set()
+    common = scoped = False
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise ApiError('Each operation must be an object')
+        method = str(operation.get('method', 'POST')).upper()
+        try:
+            endpoint, args = adapter.match(str(operation.get('path', '')), method)
+        except HTTPException:
+            continue
+        if endpoint not in WRITE_SHARD_KEYS:
+            common = True
+            if endpoint == 'api.delete_exercise' and exercise_used_on_shards(args['exercise_id']):
+                raise ApiError('Exercise is used in existing workouts or templates', 409)
+            continue
+        scoped = True
+        shard = write_shard(endpoint, args, operation.get('body'))
+        if shard is not None:
+            shards.add(shard)
+    if common and scoped:
+        raise ApiError('With sharding enabled a batch cannot change users or exercises together with workouts')
+    if len(shards) > 1:
+        raise ApiError('With sharding enabled all operations in a batch must be on one shard')
+    return shards.pop() if shards else 0
+
+@api.route('/api/batch', methods=['POST'])
+def batch():
+    data = request.get_json() or {}
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'error': 'operations must be a non-empty list'}), 400
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return jsonify({'error': f'At most {BATCH_MAX_OPERATIONS} operations per batch'}), 400
+    if not all(isinstance(operation, dict) and isinstance(operation.get('body') or {}, dict)
+               for operation in operations):
+        return jsonify({'error': 'Each operation must be an object with an object body'}), 400
     
-    conn.execute('DELETE FROM workout_exercises WHERE id = ?', (exercise_id,))
-    conn.commit()
-    conn.close()
+    adapter = current_app.url_map.bind('')
+    shard = 0
+    if sharded():
+        try:
+            shard = batch_shard(adapter, operations)
+        except ApiError as e:
+            return jsonify({'error': e.message}), e.status
+    results = []
+    
+    def write(conn):
+        refs = {}
+        for index, operation in enumerate(operations):
+            method = str(operation.get('method', 'POST')).upper()
+            path = '/'.join(str(resolve_refs(part, refs)) for part in str(operation.get('path', '')).split('/'))
+            try:
+                endpoint, args = adapter.match(path, method)
+            except HTTPException:
+                raise ApiError(f'Unsupported operation {method} {path}')
+            if endpoint not in BATCH_OPERATIONS:
+                raise ApiError(f'Unsupported operation {method} {path}')
+            
+            body, status = BATCH_OPERATIONS[endpoint](conn, resolve_refs(operation.get('body') or {}, refs), **args)
+            results.append({'status': status, 'body': body})
+            if 'id' in body:
+                refs[str(index)] = body['id']
+                if operation.get('ref'):
+                    refs[str(operation['ref'])] = body['id']
+    
+    try:
+        run_write(write, shard)
+    except ApiError as e:
+        # Nothing was committed; report how far the batch got
+        results.append({'status': e.status, 'body': {'error': e.message}})
+        return jsonify({
+            'error': e.message,
+            'failed_operation': len(results) - 1,
+            'results': results
+        }), e.status
     
-    return jsonify({'message': 'Workout exercise deleted successfully'})
+    return jsonify({'results': results})
+
+@api.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    extensions = current_app.extensions
+    pool_stats = [pool.stats() for pool in extensions['shards']['pools']]
+    return Response(extensions['metrics'].render(pool_stats),
+                    mimetype='text/plain; version=0.0.4')
 
 # Health check endpoint
-@app.route('/api/health', methods=['GET'])
+@api.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy', 'message': 'Fitness Tracker API is running'})
+    shards = current_app.extensions['shards']
+    health = {
+        'status': 'healthy',
+        'message': 'Fitness Tracker API is running',
+        'pool': current_app.extensions['db_pool'].stats(),
+        'write_queue': current_app.extensions['write_queue'].stats()
+    }
+    if sharded():
+        health['shards'] = [
+            {'pool': pool.stats(), 'write_queue': write_queue.stats()}
+            for pool, write_queue in zip(shards['pools'], shards['queues'])
+        ]
+    return jsonify(health)
+
+def create_app(config=None):
+    # Partial updates rely on UPDATE ... RETURNING
+    if sqlite3.sqlite_version_info < (3, 35):
+        raise RuntimeError(f'SQLite 3.35 or newer is required, found {sqlite3.sqlite_version}')
+    app = Flask(__name__)
+    CORS(app, expose_headers=['X-Next-Cursor', 'X-Next-Page'])
+    app.config.from_mapping(DEFAULT_CONFIG)
+    if config:
+        app.config.from_mapping(config)
+    
+    # Shard 0 is the main database; unsharded, it is the only one
+    databases = shard_databases(app.config)
+    pools = []
+    write_queues = []
+    for shard, database in enumerate(databases):
+        pool = ConnectionPool(
+            database,
+            app.config['DB_POOL_SIZE'],
+            app.config['DB_POOL_TIMEOUT'],
+            app.config['DB_POOL_IDLE_TIMEOUT'],
+            app.config['DB_PRAGMAS'] if shard == 0 else dict(app.config['DB_PRAGMAS'], foreign_keys='OFF'),
+            None if shard == 0 else app.config['DATABASE']
+        )
+        pools.append(pool)
+        write_queues.append(WriteQueue(
+            pool,
+            app.config['WRITE_BATCH_WINDOW_MS'] / 1000,
+            app.config['WRITE_BATCH_MAX'],
+            app.config['WRITE_TIMEOUT_MS'] / 1000
+        ))
+    app.extensions['shards'] = {
+        'pools': pools,
+        'queues': write_queues,
+        'placements': LRUCache(app.config['SHARD_CACHE_SIZE'])
+    }
+    app.extensions['db_pool'] = pools[0]
+    app.extensions['write_queue'] = write_queues[0]
+    app.extensions['metrics'] = Metrics()
+    app.extensions['exercise_catalog'] = {'version': None}
+    app.extensions['trend_cache'] = LRUCache(app.config['TREND_CACHE_SIZE'])
+    app.register_blueprint(api)
+    app.teardown_appcontext(release_db_connections)
+    
+    # Migrations run on plain connections that are closed afterwards, so the
+    # pools hold nothing a worker forked from this process would inherit (and,
+    # on the extra shards, nothing that sees the views instead of the shard's
+    # own users and exercises tables)
+    conn = sqlite3.connect(databases[0])
+    conn.row_factory = sqlite3.Row
+    try:
+        for name, value in app.config['DB_PRAGMAS'].items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        applied = migrate(conn)
+        # Placements are only checked when the shard count changes; the stored
+        # maximum only errs high (after deletes), so recount before refusing
+        settings = conn.execute('SELECT shards, max_shard FROM shard_settings').fetchone()
+        if settings['shards'] != len(databases):
+            placed = settings['max_shard']
+            if placed >= len(databases):
+                placed = refresh_max_shard(conn)
+            if placed >= len(databases):
+                raise RuntimeError(f'Users are placed on shard {placed}, but only {len(databases)} databases are configured')
+            conn.execute('UPDATE shard_settings SET shards = ?', (len(databases),))
+            conn.commit()
+    finally:
+        conn.close()
+    for shard, database in enumerate(databases[1:], 1):
+        conn = sqlite3.connect(database)
+        conn.row_factory = sqlite3.Row
+        if migrate(conn):
+            reserve_shard_ids(conn, shard)
+        conn.close()
+    if applied:
+        app.logger.info('Applied %d schema migrations', applied)
+    return app
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    create_app().run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
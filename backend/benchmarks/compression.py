@@ -0,0 +1,92 @@
+"""Bytes on the wire and CPU per response for large workout histories.
+
+Fetches one user's full workout history (GET /api/workouts?user_id=) buffered and
+streamed, with no compression, gzip and deflate, and reports response size and
+process CPU time per request. It also times the row encoders against the
+dict + json.dumps serialization the endpoints used before.
+
+Usage: python -m benchmarks.compression [WORKOUTS]   (run from backend/, default 3000)
+"""
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.generate import generate, load_app
+
+ENCODINGS = ['identity', 'gzip', 'deflate']
+MODES = [('buffered', '0'), ('streamed', '1')]
+REPEAT = 10
+
+def cpu_ms(function, repeat=REPEAT):
+    # Best of REPEAT, in CPU time so waiting on I/O does not count
+    best = None
+    for _ in range(repeat):
+        started = time.process_time()
+        result = function()
+        elapsed = (time.process_time() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def dict_serialize(app, conn, workouts):
+    # The serialization the workout endpoints used before the row encoders
+    workout_ids = [workout['id'] for workout in workouts]
+    grouped = {workout_id: [] for workout_id in workout_ids}
+    placeholders = ','.join('?' * len(workout_ids))
+    for ex in conn.execute(f'''
+        SELECT we.id, we.workout_id, we.exercise_id, e.name as exercise_name,
+               we.sets, we.reps, we.weight, we.rest_time, we.notes
+        FROM workout_exercises we
+        JOIN exercises e ON we.exercise_id = e.id
+        WHERE we.workout_id IN ({placeholders})
+        ORDER BY we.workout_id, we.id
+    ''', workout_ids):
+        grouped[ex['workout_id']].append({
+            'id': ex['id'], 'exercise_id': ex['exercise_id'], 'name': ex['exercise_name'],
+            'sets': ex['sets'], 'reps': ex['reps'], 'weight': ex['weight'],
+            'rest_time': ex['rest_time'], 'notes': ex['notes']
+        })
+    workout_list = []
+    for workout in workouts:
+        workout_dict = dict(workout)
+        workout_dict['exercises'] = grouped[workout['id']]
+        workout_list.append(workout_dict)
+    return app.json.dumps(workout_list)
+
+def run(workouts):
+    with tempfile.TemporaryDirectory() as directory:
+        generate(directory, users=1, workouts=workouts, years=workouts // 365 + 1)
+        backend, app = load_app(directory)
+        client = app.test_client()
+        with app.app_context():
+            conn = backend.get_db_connection()
+            user_id = conn.execute('SELECT id FROM users ORDER BY id DESC').fetchone()['id']
+            conn.close()
+        
+        print(f'{"mode":>9} {"encoding":>9} {"bytes":>10} {"ratio":>6} {"cpu ms":>8}')
+        plain = None
+        for mode, stream in MODES:
+            for encoding in ENCODINGS:
+                def fetch():
+                    response = client.get(f'/api/workouts?user_id={user_id}&stream={stream}',
+                                          headers={'Accept-Encoding': encoding})
+                    return response.data
+                elapsed, body = cpu_ms(fetch)
+                if encoding == 'identity':
+                    plain = len(body)
+                print(f'{mode:>9} {encoding:>9} {len(body):>10} {plain / len(body):>6.1f} {elapsed:>8.1f}')
+        
+        with app.app_context():
+            conn = backend.get_db_connection()
+            cursor = conn.execute('SELECT * FROM workouts WHERE user_id = ?', (user_id,))
+            rows = cursor.fetchall()
+            encode_batch = backend.workout_encoder(cursor.description)
+            before, _ = cpu_ms(lambda: dict_serialize(app, conn, rows))
+            after, _ = cpu_ms(lambda: '[' + ','.join(encode_batch(conn, rows)) + ']')
+            conn.close()
+        print(f'\nserializing {len(rows)} workouts: dict + json.dumps {before:.1f} ms, '
+              f'row encoders {after:.1f} ms ({before / after:.1f}x)')
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.getcwd())
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 3000)
@@ -0,0 +1,141 @@
+"""Seeded synthetic database for benchmarks.
+
+Builds a fitness_tracker.db with the schema from migrate() and fills it with N
+users, each logging M workouts spread over K years, each workout holding a
+variable number of exercises, and keeping a couple of workout templates. The
+derived tables (rollups, personal records) are rebuilt at the end so the
+database looks like one grown through the API.
+
+Usage: python -m benchmarks.generate DIRECTORY [--users N] [--workouts M] [--years K] [--seed S]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GOALS = ['Build Muscle', 'Lose Weight', 'Improve Endurance', 'General Fitness']
+WORKOUT_NAMES = ['Push Day', 'Pull Day', 'Leg Day', 'Upper Body', 'Lower Body', 'Full Body', 'Core']
+MUSCLES = ['Chest', 'Triceps', 'Shoulders', 'Quadriceps', 'Glutes', 'Hamstrings',
+           'Back', 'Biceps', 'Abs', 'Obliques', 'Calves', 'Forearms']
+EQUIPMENT = ['Barbell', 'Dumbbells', 'Bodyweight', 'Kettlebell', 'Cable', 'Machine']
+CATEGORIES = ['Chest', 'Legs', 'Back', 'Shoulders', 'Core', 'Arms']
+TEMPLATES_PER_USER = 2
+BATCH = 10_000
+
+def load_app(directory):
+    # Returns the backend module and an app on DIRECTORY/fitness_tracker.db
+    os.makedirs(directory, exist_ok=True)
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    import app as backend
+    return backend, backend.create_app({'DATABASE': os.path.join(directory, 'fitness_tracker.db')})
+
+def generate(directory, users=100, workouts=200, years=2, exercises=50, seed=1):
+    backend, app = load_app(directory)
+    with app.app_context():
+        return fill(backend, users, workouts, years, exercises, seed)
+
+def fill(backend, users, workouts, years, exercises, seed):
+    rng = random.Random(seed)
+    conn = backend.get_db_connection()
+    started = time.perf_counter()
+    
+    conn.executemany(
+        'INSERT INTO exercises (name, category, muscle_groups, equipment, instructions) VALUES (?, ?, ?, ?, ?)',
+        [
+            (f'Exercise {i}', rng.choice(CATEGORIES), json.dumps(rng.sample(MUSCLES, rng.randint(1, 3))),
+             rng.choice(EQUIPMENT), 'Move through the full range of motion with control')
+            for i in range(exercises)
+        ]
+    )
+    exercise_ids = [row['id'] for row in conn.execute('SELECT id FROM exercises').fetchall()]
+    
+    conn.executemany(
+        'INSERT INTO users (name, email, age, weight, height, goal) VALUES (?, ?, ?, ?, ?, ?)',
+        [
+            (f'Bench User {i}', f'bench{seed}-{i}@example.com', rng.randint(18, 65),
+             round(rng.uniform(50, 110), 1), rng.randint(150, 200), rng.choice(GOALS))
+            for i in range(users)
+        ]
+    )
+    user_ids = [row['id'] for row in conn.execute('SELECT id FROM users').fetchall()]
+    
+    today = date.today()
+    span = years * 365
+    workout_rows = []
+    for user_id in user_ids:
+        for day in sorted(rng.sample(range(span), min(workouts, span))):
+            workout_date = today - timedelta(days=span - day)
+            completed = workout_date < today and rng.random() < 0.85
+            workout_rows.append((
+                user_id, rng.choice(WORKOUT_NAMES), workout_date.isoformat(), '',
+                completed, f'{workout_date.isoformat()} 18:00:00' if completed else None,
+                rng.randint(20, 90) if completed else None
+            ))
+    for start in range(0, len(workout_rows), BATCH):
+        conn.executemany(
+            'INSERT INTO workouts (user_id, name, date, notes, completed, completed_date, duration) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            workout_rows[start:start + BATCH]
+        )
+    
+    exercise_rows = []
+    for (workout_id,) in conn.execute('SELECT id FROM workouts').fetchall():
+        for exercise_id in rng.sample(exercise_ids, rng.randint(3, 8)):
+            exercise_rows.append((workout_id, exercise_id, rng.randint(2, 5), rng.randint(3, 15),
+                                  round(rng.uniform(0, 150), 1), rng.choice([60, 90, 120]), ''))
+        if len(exercise_rows) >= BATCH:
+            conn.executemany(
+                'INSERT INTO workout_exercises (workout_id, exercise_id, sets, reps, weight, rest_time, notes) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                exercise_rows
+            )
+            exercise_rows = []
+    conn.executemany(
+        'INSERT INTO workout_exercises (workout_id, exercise_id, sets, reps, weight, rest_time, notes) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        exercise_rows
+    )
+    
+    conn.executemany('INSERT INTO workout_templates (user_id, name, notes) VALUES (?, ?, ?)', [
+        (user_id, name, '') for user_id in user_ids for name in rng.sample(WORKOUT_NAMES, TEMPLATES_PER_USER)
+    ])
+    conn.executemany(
+        'INSERT INTO workout_template_exercises (template_id, exercise_id, sets, reps, weight, rest_time, notes) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        [
+            (template_id, exercise_id, rng.randint(2, 5), rng.randint(3, 15), round(rng.uniform(0, 150), 1), 90, '')
+            for (template_id,) in conn.execute('SELECT id FROM workout_templates').fetchall()
+            for exercise_id in rng.sample(exercise_ids, rng.randint(3, 6))
+        ]
+    )
+    conn.commit()
+    
+    backend.bump_catalog_version(conn)
+    backend.rebuild_rollups(conn)
+    counts = {
+        table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        for table in ('users', 'exercises', 'workouts', 'workout_exercises', 'workout_templates')
+    }
+    conn.close()
+    counts['seconds'] = round(time.perf_counter() - started, 2)
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--workouts', type=int, default=200, help='workouts per user')
+    parser.add_argument('--years', type=int, default=2)
+    parser.add_argument('--exercises', type=int, default=50, help='extra catalog exercises')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    print(json.dumps(generate(args.directory, args.users, args.workouts, args.years,
+                              args.exercises, args.seed)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,435 @@
+"""Mixed read/write load driver and latency report for every API route.
+
+Generates (or reuses) a seeded database, replays a weighted mix of requests
+against it and reports p50/p95/p99 latency, throughput and SQL statements per
+request for each endpoint. Requests go through the Flask test client by
+default, or over HTTP to a locally started server with --server.
+
+Usage:
+    python -m benchmarks.loadtest [--scenario read|mixed|write] [--requests N]
+        [--server] [--concurrency C] [--output report.json] [--baseline baseline.json]
+"""
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+from benchmarks.generate import BACKEND_DIR, generate, load_app
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# (endpoint, method, read weight, write weight); read-only mixes drop writes
+OPERATIONS = [
+    ('GET /api/users', 'GET', 1, 0),
+    ('GET /api/users/<id>', 'GET', 3, 0),
+    ('POST /api/users', 'POST', 0, 1),
+    ('PUT /api/users/<id>', 'PUT', 0, 1),
+    ('GET /api/users/<id>/stats', 'GET', 5, 0),
+    ('GET /api/users/<id>/records', 'GET', 3, 0),
+    ('GET /api/users/<id>/calendar', 'GET', 2, 0),
+    ('GET /api/users/<id>/exercises/<id>/trend', 'GET', 2, 0),
+    ('GET /api/users/<id>/export', 'GET', 1, 0),
+    ('POST /api/users/<id>/import', 'POST', 0, 0.5),
+    ('GET /api/exercises', 'GET', 8, 0),
+    ('GET /api/exercises/<id>', 'GET', 3, 0),
+    ('GET /api/exercises/search', 'GET', 3, 0),
+    ('POST /api/exercises', 'POST', 0, 0.5),
+    ('PUT /api/exercises/<id>', 'PUT', 0, 0.5),
+    ('DELETE /api/exercises/<id>', 'DELETE', 0, 0.3),
+    ('GET /api/workouts (page)', 'GET', 10, 0),
+    ('GET /api/workouts (summary page)', 'GET', 3, 0),
+    ('GET /api/workouts (date range)', 'GET', 2, 0),
+    ('GET /api/workouts (history)', 'GET', 2, 0),
+    ('GET /api/workouts (history, buffered)', 'GET', 1, 0),
+    ('GET /api/workouts/<id>', 'GET', 5, 0),
+    ('POST /api/workouts', 'POST', 0, 3),
+    ('PUT /api/workouts/<id>', 'PUT', 0, 2),
+    ('PATCH /api/workouts/<id>', 'PATCH', 0, 1),
+    ('DELETE /api/workouts/<id>', 'DELETE', 0, 1),
+    ('POST /api/workouts/<id>/clone', 'POST', 0, 1),
+    ('GET /api/workout-templates', 'GET', 2, 0),
+    ('GET /api/workout-templates/<id>', 'GET', 1, 0),
+    ('POST /api/workout-templates', 'POST', 0, 0.5),
+    ('PATCH /api/workout-templates/<id>', 'PATCH', 0, 0.5),
+    ('POST /api/workout-templates/<id>/workouts', 'POST', 0, 1),
+    ('DELETE /api/workout-templates/<id>', 'DELETE', 0, 0.3),
+    ('GET /api/workout-exercises/<workout_id>', 'GET', 3, 0),
+    ('POST /api/workout-exercises', 'POST', 0, 2),
+    ('PUT /api/workout-exercises/<id>', 'PUT', 0, 2),
+    ('DELETE /api/workout-exercises/<id>', 'DELETE', 0, 1),
+    ('POST /api/batch', 'POST', 0, 1),
+    ('GET /api/sync', 'GET', 3, 0),
+    ('GET /api/metrics', 'GET', 0.5, 0),
+    ('GET /api/health', 'GET', 1, 0),
+]
+SCENARIOS = {'read': (1, 0), 'mixed': (1, 1), 'write': (0.2, 1)}
+SEARCH_TERMS = ['press', 'squat', 'exercise 1', 'row']
+
+class Workload:
+    """Picks the next request and remembers ids created along the way."""
+    
+    def __init__(self, conn, scenario, seed):
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.users = [row['id'] for row in conn.execute('SELECT id FROM users').fetchall()]
+        self.exercises = [row['id'] for row in conn.execute('SELECT id FROM exercises').fetchall()]
+        self.workouts = [row['id'] for row in conn.execute('SELECT id FROM workouts').fetchall()]
+        self.workout_exercises = [row['id'] for row in conn.execute(
+            'SELECT id FROM workout_exercises ORDER BY id DESC LIMIT 1000').fetchall()]
+        self.templates = [row['id'] for row in conn.execute('SELECT id FROM workout_templates').fetchall()]
+        # Clients sync the changes made since the run started
+        self.sync_cursor = conn.execute('SELECT seq FROM sync_sequence').fetchone()[0]
+        # Only rows the driver created itself are deleted, so the dataset stays stable
+        self.created = {'workouts': [], 'workout_exercises': [], 'exercises': [], 'templates': []}
+        self.counter = 0
+        read, write = SCENARIOS[scenario]
+        self.operations = [op for op in OPERATIONS if op[2] * read + op[3] * write > 0]
+        self.weights = [op[2] * read + op[3] * write for op in self.operations]
+    
+    def next_request(self):
+        with self.lock:
+            endpoint, method, _, _ = self.rng.choices(self.operations, self.weights)[0]
+            return (endpoint, method) + self.build(endpoint)
+    
+    def build(self, endpoint):
+        rng = self.rng
+        user = rng.choice(self.users)
+        workout = rng.choice(self.workouts)
+        exercise = rng.choice(self.exercises)
+        template = rng.choice(self.templates) if self.templates else -1
+        self.counter += 1
+        if endpoint == 'GET /api/users':
+            return '/api/users', None, None
+        if endpoint == 'GET /api/users/<id>':
+            return f'/api/users/{user}', None, None
+        if endpoint == 'POST /api/users':
+            return '/api/users', {'name': 'Load User', 'email': f'load-{time.time_ns()}-{self.counter}@example.com'}, None
+        if endpoint == 'PUT /api/users/<id>':
+            return f'/api/users/{user}', {'weight': round(rng.uniform(50, 110), 1)}, None
+        if endpoint == 'GET /api/users/<id>/stats':
+            return f'/api/users/{user}/stats?period={rng.choice(["week", "month", "year"])}', None, None
+        if endpoint == 'GET /api/users/<id>/records':
+            return f'/api/users/{user}/records', None, None
+        if endpoint == 'GET /api/users/<id>/calendar':
+            return f'/api/users/{user}/calendar', None, None
+        if endpoint == 'GET /api/users/<id>/exercises/<id>/trend':
+            return f'/api/users/{user}/exercises/{exercise}/trend', None, None
+        if endpoint == 'GET /api/users/<id>/export':
+            return f'/api/users/{user}/export', None, None
+        if endpoint == 'POST /api/users/<id>/import':
+            lines = [
+                {'type': 'workout', 'data': {'id': 1, 'name': 'Imported', 'date': '2020-01-01', 'completed': True}},
+                {'type': 'workout_exercise', 'data': {'workout_id': 1, 'exercise_id': exercise, 'sets': 3, 'reps': 8, 'weight': 40}},
+            ]
+            return f'/api/users/{user}/import', '\n'.join(json.dumps(line) for line in lines), None
+        if endpoint == 'GET /api/exercises':
+            return '/api/exercises', None, None
+        if endpoint == 'GET /api/exercises/<id>':
+            return f'/api/exercises/{exercise}', None, None
+        if endpoint == 'GET /api/exercises/search':
+            return f'/api/exercises/search?q={rng.choice(SEARCH_TERMS).replace(" ", "+")}', None, None
+        if endpoint == 'POST /api/exercises':
+            return '/api/exercises', {'name': f'Load Exercise {self.counter}', 'category': 'Arms'}, 'exercises'
+        if endpoint == 'PUT /api/exercises/<id>':
+            return f'/api/exercises/{exercise}', {'equipment': rng.choice(['Barbell', 'Cable'])}, None
+        if endpoint == 'DELETE /api/exercises/<id>':
+            return f'/api/exercises/{self.pop_created("exercises", exercise)}', None, None
+        if endpoint == 'GET /api/workouts (page)':
+            return f'/api/workouts?user_id={user}&limit=20', None, None
+        if endpoint == 'GET /api/workouts (summary page)':
+            return f'/api/workouts?user_id={user}&limit=20&fields=name,date,completed', None, None
+        if endpoint == 'GET /api/workouts (date range)':
+            month = rng.randint(1, 12)
+            return f'/api/workouts?user_id={user}&from=2024-{month:02d}-01&to=2024-{month:02d}-28', None, None
+        if endpoint == 'GET /api/workouts (history)':
+            return f'/api/workouts?user_id={user}', None, None
+        if endpoint == 'GET /api/workouts (history, buffered)':
+            return f'/api/workouts?user_id={user}&stream=0', None, None
+        if endpoint == 'GET /api/workouts/<id>':
+            return f'/api/workouts/{workout}', None, None
+        if endpoint == 'POST /api/workouts':
+            body = {
+                'user_id': user, 'name': 'Load Workout', 'date': f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+                'exercises': [
+                    {'exercise_id': exercise_id, 'sets': 3, 'reps': rng.randint(5, 12), 'weight': rng.randint(10, 120)}
+                    for exercise_id in rng.sample(self.exercises, 4)
+                ]
+            }
+            return '/api/workouts', body, 'workouts'
+        if endpoint == 'PUT /api/workouts/<id>':
+            return f'/api/workouts/{workout}', {'completed': True, 'duration': rng.randint(20, 90)}, None
+        if endpoint == 'PATCH /api/workouts/<id>':
+            return f'/api/workouts/{workout}', {'notes': f'Load note {self.counter}'}, None
+        if endpoint == 'DELETE /api/workouts/<id>':
+            return f'/api/workouts/{self.pop_created("workouts", workout)}', None, None
+        if endpoint == 'POST /api/workouts/<id>/clone':
+            return f'/api/workouts/{workout}/clone', {'date': '2024-06-01'}, 'workouts'
+        if endpoint == 'GET /api/workout-templates':
+            return f'/api/workout-templates?user_id={user}', None, None
+        if endpoint == 'GET /api/workout-templates/<id>':
+            return f'/api/workout-templates/{template}', None, None
+        if endpoint == 'POST /api/workout-templates':
+            return '/api/workout-templates', {'workout_id': workout, 'name': 'Load Template'}, 'templates'
+        if endpoint == 'PATCH /api/workout-templates/<id>':
+            return f'/api/workout-templates/{template}', {'notes': f'Load note {self.counter}'}, None
+        if endpoint == 'DELETE /api/workout-templates/<id>':
+            return f'/api/workout-templates/{self.pop_created("templates", template)}', None, None
+        if endpoint == 'POST /api/workout-templates/<id>/workouts':
+            return f'/api/workout-templates/{template}/workouts', {'date': '2024-06-02'}, 'workouts'
+        if endpoint == 'GET /api/workout-exercises/<workout_id>':
+            return f'/api/workout-exercises/{workout}', None, None
+        if endpoint == 'POST /api/workout-exercises':
+            body = {'workout_id': workout, 'exercise_id': exercise, 'sets': 3, 'reps': 10, 'weight': rng.randint(10, 120)}
+            return '/api/workout-exercises', body, 'workout_exercises'
+        if endpoint == 'PUT /api/workout-exercises/<id>':
+            return f'/api/workout-exercises/{rng.choice(self.workout_exercises)}', {'reps': rng.randint(5, 12)}, None
+        if endpoint == 'DELETE /api/workout-exercises/<id>':
+            fallback = rng.choice(self.workout_exercises)
+            return f'/api/workout-exercises/{self.pop_created("workout_exercises", fallback)}', None, None
+        if endpoint == 'POST /api/batch':
+            # A workout logged set by set, then finished
+            operations = [{'path': '/api/workouts', 'body': {'user_id': user, 'name': 'Load Batch', 'date': '2024-06-03'}}]
+            operations += [
+                {'path': '/api/workout-exercises',
+                 'body': {'workout_id': '$0', 'exercise_id': exercise_id, 'sets': 3, 'reps': 8, 'weight': rng.randint(10, 120)}}
+                for exercise_id in rng.sample(self.exercises, 3)
+            ]
+            operations.append({'method': 'PATCH', 'path': '/api/workouts/$0', 'body': {'completed': True, 'duration': 45}})
+            return '/api/batch', {'operations': operations}, None
+        if endpoint == 'GET /api/sync':
+            return f'/api/sync?user_id={user}&since={self.sync_cursor}', None, None
+        if endpoint == 'GET /api/metrics':
+            return '/api/metrics', None, None
+        return '/api/health', None, None
+    
+    def pop_created(self, kind, fallback):
+        # Without a row of our own to delete, hit an id that 404s rather than real data
+        return self.created[kind].pop() if self.created[kind] else -fallback
+    
+    def remember(self, kind, body):
+        if kind and isinstance(body, dict) and 'id' in body:
+            with self.lock:
+                self.created[kind].append(body['id'])
+                if kind == 'workouts':
+                    self.workouts.append(body['id'])
+                if kind == 'templates':
+                    self.templates.append(body['id'])
+
+class TestClientTransport:
+    """In-process requests; counts SQL statements through a trace callback."""
+    
+    def __init__(self, app):
+        self.client = app.test_client()
+        self.statements = 0
+        pool = app.extensions['db_pool']
+        pool.close_all()
+        connect = pool._connect
+        
+        def traced_connect():
+            conn = connect()
+            conn.set_trace_callback(self.count_statement)
+            return conn
+        pool._connect = traced_connect
+    
+    def count_statement(self, statement):
+        self.statements += 1
+    
+    def request(self, method, path, body):
+        self.statements = 0
+        if isinstance(body, str):
+            response = self.client.open(path, method=method, data=body)
+        else:
+            response = self.client.open(path, method=method, json=body)
+        data = response.get_data()
+        return response.status_code, data, self.statements
+
+class HttpTransport:
+    """Requests over HTTP to a running server; statement counts are not visible."""
+    
+    def __init__(self, base_url):
+        self.base_url = base_url
+    
+    def request(self, method, path, body):
+        headers = {}
+        if isinstance(body, str):
+            data = body.encode()
+        elif body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        else:
+            data = None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(req) as response:
+                return response.status, response.read(), None
+        except urllib.error.HTTPError as error:
+            return error.code, error.read(), None
+
+def start_server(directory, port):
+    config = {'DATABASE': os.path.join(directory, 'fitness_tracker.db')}
+    code = (f'import sys; sys.path.insert(0, {BACKEND_DIR!r}); import app; '
+            f'app.create_app({config!r}).run(port={port}, threaded=True)')
+    server = subprocess.Popen([sys.executable, '-c', code], cwd=directory,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(base_url + '/api/health').read()
+            return server, base_url
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError('Server did not start')
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+def drive(transport, workload, requests, concurrency):
+    samples = defaultdict(list)
+    errors = defaultdict(int)
+    statements = defaultdict(list)
+    sizes = defaultdict(int)
+    remaining = [requests]
+    lock = threading.Lock()
+    
+    def worker():
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            endpoint, method, path, body, kind = workload.next_request()
+            started = time.perf_counter()
+            status, data, count = transport.request(method, path, body)
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                samples[endpoint].append(elapsed)
+                sizes[endpoint] += len(data)
+                if count is not None:
+                    statements[endpoint].append(count)
+                if status >= 500:
+                    errors[endpoint] += 1
+            if status in (200, 201) and kind:
+                workload.remember(kind, json.loads(data))
+    
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - started
+    
+    endpoints = {}
+    for endpoint, values in sorted(samples.items()):
+        values.sort()
+        endpoints[endpoint] = {
+            'count': len(values),
+            'errors': errors[endpoint],
+            'mean_ms': round(sum(values) / len(values), 3),
+            'p50_ms': round(percentile(values, 0.50), 3),
+            'p95_ms': round(percentile(values, 0.95), 3),
+            'p99_ms': round(percentile(values, 0.99), 3),
+            'bytes_per_request': round(sizes[endpoint] / len(values)),
+            'statements_per_request': (round(sum(statements[endpoint]) / len(statements[endpoint]), 2)
+                                       if statements[endpoint] else None)
+        }
+    return {
+        'duration_s': round(duration, 3),
+        'throughput_rps': round(requests / duration, 1),
+        'endpoints': endpoints
+    }
+
+def compare(report, baseline):
+    print(f'{"endpoint":<42} {"p50 ms":>9} {"base":>9} {"p95 ms":>9} {"base":>9} {"change":>8}')
+    for endpoint, stats in report['endpoints'].items():
+        base = baseline['endpoints'].get(endpoint)
+        if base is None:
+            print(f'{endpoint:<42} {stats["p50_ms"]:>9.2f} {"-":>9} {stats["p95_ms"]:>9.2f} {"-":>9} {"new":>8}')
+            continue
+        change = (stats['p50_ms'] - base['p50_ms']) / base['p50_ms'] * 100 if base['p50_ms'] else 0
+        print(f'{endpoint:<42} {stats["p50_ms"]:>9.2f} {base["p50_ms"]:>9.2f} '
+              f'{stats["p95_ms"]:>9.2f} {base["p95_ms"]:>9.2f} {change:>+7.1f}%')
+    print(f'throughput: {report["throughput_rps"]} req/s (baseline {baseline["throughput_rps"]} req/s)')
+
+def print_report(report):
+    print(f'{"endpoint":<42} {"n":>6} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"stmts":>7}')
+    for endpoint, stats in report['endpoints'].items():
+        statements = stats['statements_per_request']
+        print(f'{endpoint:<42} {stats["count"]:>6} {stats["p50_ms"]:>9.2f} {stats["p95_ms"]:>9.2f} '
+              f'{stats["p99_ms"]:>9.2f} {statements if statements is not None else "-":>7}')
+    print(f'throughput: {report["throughput_rps"]} req/s over {report["duration_s"]}s')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--directory', help='database directory (default: a fresh temporary one)')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--workouts', type=int, default=150, help='workouts per user')
+    parser.add_argument('--years', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='mixed')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--server', action='store_true', help='drive a local HTTP server instead of the test client')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--baseline', nargs='?', const=BASELINE, help='compare against a saved report')
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+    
+    directory = args.directory or tempfile.mkdtemp(prefix='gym-tracker-bench-')
+    dataset = None
+    if not os.path.exists(os.path.join(directory, 'fitness_tracker.db')):
+        dataset = generate(directory, args.users, args.workouts, args.years, seed=args.seed)
+    backend, app = load_app(directory)
+    
+    with app.app_context():
+        conn = backend.get_db_connection()
+        workload = Workload(conn, args.scenario, args.seed)
+        conn.close()
+    
+    server = None
+    if args.server:
+        server, base_url = start_server(directory, args.port)
+        transport = HttpTransport(base_url)
+    else:
+        transport = TestClientTransport(app)
+    try:
+        report = drive(transport, workload, args.requests, args.concurrency)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    
+    report = dict({
+        'scenario': args.scenario,
+        'transport': 'http' if args.server else 'test_client',
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'seed': args.seed,
+        'dataset': dataset or {'directory': directory}
+    }, **report)
+    print_report(report)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if baseline:
+        with open(baseline) as f:
+            print()
+            compare(report, json.load(f))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""EXPLAIN QUERY PLAN check of the SQL every API route runs.
+
+Drives every route through the test client on scratch databases, unsharded
+and then with two shards, records each statement the pooled connections run
+(ConnectionPool.trace) and checks its EXPLAIN QUERY PLAN. Anything but an index
+search fails unless listed, with its reason, in QUERY_PLAN_ALLOWED. The
+check-query-plans command and tests/test_query_plans.py run it.
+
+Usage: python -m benchmarks.query_plans   (run from backend/)
+"""
+import os
+import re
+import sys
+import tempfile
+from datetime import date
+
+from benchmarks.generate import BACKEND_DIR
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+import app as backend
+
+# Plan details that are never a problem: table-valued functions and virtual
+# tables (json_each, FTS5), reads of a subquery's own rows, and the
+# bookkeeping tables that hold a row or a few
+QUERY_PLAN_BENIGN = re.compile(
+    r'VIRTUAL TABLE|CONSTANT ROW|^SCAN \(subquery|^SCAN json_each\b'
+    r'|^SCAN (sync_sequence|shard_settings|sqlite_sequence|main\.exercises_fts_config)$'
+)
+# (statement pattern, plan detail pattern, why it is fine)
+QUERY_PLAN_ALLOWED = [
+    (r'^SELECT \* FROM users$', r'^SCAN users', 'unfiltered list'),
+    (r'^SELECT \* FROM workouts ORDER BY date DESC, id DESC( LIMIT \d+)?$', r'^SCAN workouts USING INDEX idx_workouts_date$',
+     'unfiltered list, read in index order'),
+    (r'^SELECT \* FROM workout_templates ORDER BY id$', r'^SCAN workout_templates$', 'unfiltered list'),
+    (r'^SELECT .* FROM exercises ORDER BY name$', r'^SCAN exercises USING (COVERING )?INDEX idx_exercises_name',
+     'unfiltered list'),
+    (r'^SELECT user_id, year, last_date FROM workout_archive( WHERE (first_date <= \S+( AND )?)*)?$',
+     r'^SCAN workout_archive', 'unfiltered workout list: one row per user and archived year'),
+    (r'ORDER BY bm25\(', r'^USE TEMP B-TREE FOR ORDER BY', 'relevance ranking sorts the text matches'),
+    (r'JOIN exercise_muscles m0 .* ORDER BY e\.name', r'^USE TEMP B-TREE FOR ORDER BY',
+     'muscle filters sort the exercises that work the muscle'),
+]
+QUERY_PLAN_STATEMENT = re.compile(r'^(SELECT|INSERT|UPDATE|DELETE|WITH)\b', re.IGNORECASE)
+QUERY_PLAN_LITERAL = re.compile(r"'(?:[^']|'')*'|X'[0-9A-Fa-f]*'|\b\d+(\.\d+)?\b")
+
+def query_plan_requests(app, client, tracing):
+    # Calls every route at least once, for the users that live on each shard.
+    # tracing['on'] is cleared around the setup that is not a request.
+    with app.app_context():
+        shard_count = len(app.extensions['shards']['pools'])
+    users = [client.post('/api/users', json={'name': f'Plan {index}', 'email': f'plan{index}@example.com'}).get_json()['id']
+             for index in range(shard_count)]
+    if shard_count == 1:
+        users.append(1)
+    for user_id in users:
+        client.get('/api/users')
+        client.get(f'/api/users/{user_id}')
+        client.get(f'/api/users/{user_id}?fields=name')
+        client.patch(f'/api/users/{user_id}', json={'goal': 'Strength'})
+        workout_ids = []
+        for day in ('2020-03-02', '2020-03-09', date.today().isoformat()):
+            workout_ids.append(client.post('/api/workouts', json={
+                'user_id': user_id, 'name': 'Plan', 'date': day, 'completed': True, 'duration': 40,
+                'exercises': [{'exercise_id': 4, 'sets': 3, 'reps': 5, 'weight': 100},
+                              {'exercise_id': 2, 'sets': 3, 'reps': 8, 'weight': 80}]
+            }).get_json()['id'])
+        tracing['on'] = False
+        with app.app_context():
+            conn = backend.get_db_connection(backend.user_shard(user_id))
+            backend.archive_user_workouts(conn, user_id, '2020-03-10')
+            conn.close()
+        tracing['on'] = True
+        archived_id, workout_id = workout_ids[0], workout_ids[-1]
+        
+        for query in ('', '&limit=1', '&limit=10', '&from=2020-01-01&to=2020-12-31',
+                      '&fields=name,exercises', f'&limit=1&cursor={date.today().isoformat()}|{workout_id}'):
+            client.get(f'/api/workouts?user_id={user_id}{query}')
+            client.get(f'/api/workouts?user_id={user_id}{query}&stream=0')
+        client.get('/api/workouts')
+        client.get('/api/workouts?limit=5')
+        client.get('/api/workouts?from=2020-01-01')
+        for target in (workout_id, archived_id):
+            client.get(f'/api/workouts/{target}')
+            client.get(f'/api/workouts/{target}?fields=name')
+            client.get(f'/api/workout-exercises/{target}')
+            client.get(f'/api/workout-exercises/{target}?fields=sets')
+        clone_id = client.post(f'/api/workouts/{workout_id}/clone').get_json()['id']
+        client.post(f'/api/workouts/{archived_id}/clone')
+        client.patch(f'/api/workouts/{clone_id}', json={'name': 'Plan 2'})
+        client.patch(f'/api/workouts/{clone_id}', json={'completed': True, 'duration': 30})
+        
+        exercise_id = client.post('/api/workout-exercises', json={
+            'workout_id': clone_id, 'exercise_id': 1, 'sets': 2, 'reps': 10
+        }).get_json()['id']
+        client.patch(f'/api/workout-exercises/{exercise_id}', json={'reps': 12})
+        client.patch(f'/api/workout-exercises/{exercise_id}', json={'notes': 'Plan'})
+        client.delete(f'/api/workout-exercises/{exercise_id}')
+        
+        template_id = client.post('/api/workout-templates', json={'workout_id': workout_id}).get_json()['id']
+        client.post('/api/workout-templates', json={'workout_id': archived_id})
+        client.post('/api/workout-templates', json={
+            'user_id': user_id, 'name': 'Plan', 'exercises': [{'exercise_id': 3, 'sets': 3, 'reps': 6}]
+        })
+        client.get(f'/api/workout-templates?user_id={user_id}')
+        client.get('/api/workout-templates')
+        client.get(f'/api/workout-templates/{template_id}')
+        client.patch(f'/api/workout-templates/{template_id}', json={'notes': 'Plan'})
+        client.post(f'/api/workout-templates/{template_id}/workouts', json={'date': date.today().isoformat()})
+        client.delete(f'/api/workout-templates/{template_id}')
+        
+        for query in ('', '?period=week', '?period=year&bucket=day'):
+            client.get(f'/api/users/{user_id}/stats{query}')
+        client.get(f'/api/users/{user_id}/records')
+        client.get(f'/api/users/{user_id}/calendar')
+        client.get(f'/api/users/{user_id}/exercises/4/trend')
+        export = client.get(f'/api/users/{user_id}/export').data
+        client.post(f'/api/users/{user_id}/import', data=export)
+        
+        sync = client.get(f'/api/sync?user_id={user_id}').get_json()
+        client.delete(f'/api/workouts/{clone_id}')
+        client.get(f'/api/sync?user_id={user_id}&since={sync["cursor"]}')
+        client.get('/api/sync')
+        client.get('/api/sync?since=1')
+        # Writes move archived workouts back into the hot tables
+        archived_exercise = client.get(f'/api/workout-exercises/{workout_ids[1]}').get_json()[0]['id']
+        client.patch(f'/api/workout-exercises/{archived_exercise}', json={'reps': 6})
+        client.delete(f'/api/workouts/{archived_id}')
+        client.post('/api/batch', json={'operations': [
+            {'path': '/api/workouts', 'body': {'user_id': user_id, 'name': 'Plan', 'date': '2026-01-05'}},
+            {'path': '/api/workout-exercises', 'body': {'workout_id': '$0', 'exercise_id': 1, 'sets': 1, 'reps': 1}},
+            {'method': 'PATCH', 'path': '/api/workouts/$0', 'body': {'completed': True}},
+            {'method': 'DELETE', 'path': '/api/workouts/$0'}
+        ]})
+    
+    client.get('/api/exercises')
+    client.get('/api/exercises', headers={'If-None-Match': client.get('/api/exercises').headers.get('ETag', '')})
+    client.get('/api/exercises?fields=name')
+    for query in ('q=press', 'q=press&muscle=Chest', 'muscle=Chest', 'muscle=Chest&muscle=Triceps',
+                  'category=Chest', 'equipment=Barbell', 'q=press&category=Chest&fields=name', 'q=squat&page=2'):
+        client.get(f'/api/exercises/search?{query}')
+    client.get('/api/exercises/1')
+    client.get('/api/exercises/1?fields=name')
+    exercise_id = client.post('/api/exercises', json={
+        'name': 'Plan Lift', 'category': 'Chest', 'muscle_groups': '["Chest"]'
+    }).get_json()['id']
+    client.patch(f'/api/exercises/{exercise_id}', json={'muscle_groups': '["Back"]'})
+    client.delete(f'/api/exercises/{exercise_id}')
+    client.delete('/api/exercises/4')
+    client.post('/api/batch', json={'operations': [
+        {'path': '/api/users', 'body': {'name': 'Plan batch', 'email': 'plan-batch@example.com'}}
+    ]})
+    client.get('/api/health')
+    client.get('/api/metrics')
+
+def query_plan_problems(directory, shard_count):
+    # Runs query_plan_requests on fresh databases in directory; returns the
+    # number of distinct statements checked and the plans that failed
+    app = backend.create_app({
+        'DATABASE': os.path.join(directory, f'plans-{shard_count}.db'),
+        'SHARD_DATABASES': [os.path.join(directory, f'plans-{shard_count}-{shard}.db')
+                            for shard in range(1, shard_count)]
+    })
+    pools = app.extensions['shards']['pools']
+    with app.app_context():
+        conn = backend.get_db_connection()
+        backend.seed_sample_data(conn)
+        conn.close()
+    statements = set()
+    tracing = {'on': True}
+    for shard, pool in enumerate(pools):
+        pool.close_all()
+        pool.trace = lambda sql, shard=shard: tracing['on'] and statements.add((shard, sql))
+    query_plan_requests(app, app.test_client(), tracing)
+    for pool in pools:
+        pool.trace = None
+    
+    problems = []
+    checked = set()
+    for shard, sql in sorted(statements):
+        sql = ' '.join(sql.split())
+        # The traced statements carry their values; one of each shape is enough
+        shape = (shard, QUERY_PLAN_LITERAL.sub('?', sql))
+        if not QUERY_PLAN_STATEMENT.match(sql) or shape in checked:
+            continue
+        checked.add(shape)
+        conn = pools[shard].acquire()
+        try:
+            plan = [row['detail'] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()]
+        finally:
+            pools[shard].release(conn)
+        for detail in plan:
+            if not (detail.startswith('SCAN') or 'TEMP B-TREE' in detail) or QUERY_PLAN_BENIGN.search(detail):
+                continue
+            if any(re.search(pattern, sql) and re.search(allowed, detail)
+                   for pattern, allowed, _ in QUERY_PLAN_ALLOWED):
+                continue
+            problems.append(f'{detail}\n    {sql[:300]}' + (f'\n    (shard {shard})' if shard else ''))
+    for pool in pools:
+        pool.close_all()
+    return len(checked), problems
+
+def check_query_plans():
+    # Runs the check unsharded and with two shards; returns the number of
+    # distinct statements checked and the plans that failed
+    checked = 0
+    problems = []
+    with tempfile.TemporaryDirectory() as directory:
+        for shard_count in (1, 2):
+            count, failed = query_plan_problems(directory, shard_count)
+            checked += count
+            problems.extend(failed)
+    return checked, list(dict.fromkeys(problems))
+
+def main():
+    checked, problems = check_query_plans()
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    if problems:
+        sys.exit(1)
+    print(f'{checked} statements OK')
+
+if __name__ == '__main__':
+    main()
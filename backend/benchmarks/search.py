@@ -0,0 +1,82 @@
+"""Exercise search latency on a large synthetic catalog.
+
+Compares GET /api/exercises/search against the only option the API had before:
+loading the whole catalog and filtering parsed muscle_groups in Python.
+
+Usage: python -m benchmarks.search [EXERCISES]   (run from backend/, default 50000)
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MUSCLES = ['Chest', 'Triceps', 'Shoulders', 'Quadriceps', 'Glutes', 'Hamstrings',
+           'Back', 'Biceps', 'Abs', 'Obliques', 'Calves', 'Forearms']
+EQUIPMENT = ['Barbell', 'Dumbbells', 'Bodyweight', 'Kettlebell', 'Cable', 'Machine', 'Pull-up bar']
+CATEGORIES = ['Chest', 'Legs', 'Back', 'Shoulders', 'Core', 'Arms']
+MOVES = ['Press', 'Row', 'Squat', 'Deadlift', 'Curl', 'Extension', 'Raise', 'Lunge', 'Fly', 'Pulldown']
+VARIANTS = ['Incline', 'Decline', 'Paused', 'Tempo', 'Single-arm', 'Seated', 'Standing', 'Wide-grip']
+QUERIES = [
+    ('text', '/api/exercises/search?q=incline+press'),
+    ('prefix', '/api/exercises/search?q=dead'),
+    ('muscle', '/api/exercises/search?muscle=Hamstrings'),
+    ('muscle+equipment', '/api/exercises/search?muscle=Hamstrings&equipment=Barbell'),
+    ('text+muscle+category', '/api/exercises/search?q=row&muscle=Back&category=Back'),
+]
+REPEAT = 20
+
+def generate_exercises(count, seed=42):
+    rng = random.Random(seed)
+    for i in range(count):
+        move = rng.choice(MOVES)
+        yield (
+            f'{rng.choice(VARIANTS)} {rng.choice(EQUIPMENT)} {move} {i}',
+            rng.choice(CATEGORIES),
+            json.dumps(rng.sample(MUSCLES, rng.randint(1, 4))),
+            rng.choice(EQUIPMENT),
+            f'Set up for the {move.lower()}, brace, move through the full range and control the return'
+        )
+
+def naive_search(conn, muscle, equipment):
+    rows = conn.execute('SELECT * FROM exercises ORDER BY name').fetchall()
+    return [
+        dict(row) for row in rows
+        if muscle in json.loads(row['muscle_groups'] or '[]') and row['equipment'] == equipment
+    ][:20]
+
+def timed(callable_, repeat=REPEAT):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        callable_()
+    return (time.perf_counter() - started) * 1000 / repeat
+
+def run(count):
+    with tempfile.TemporaryDirectory() as directory:
+        sys.path.insert(0, BACKEND_DIR)
+        import app as backend
+        app = backend.create_app({'DATABASE': os.path.join(directory, 'fitness_tracker.db')})
+        context = app.app_context()
+        context.push()
+        conn = backend.get_db_connection()
+        started = time.perf_counter()
+        conn.executemany(
+            'INSERT INTO exercises (name, category, muscle_groups, equipment, instructions) VALUES (?, ?, ?, ?, ?)',
+            generate_exercises(count)
+        )
+        conn.commit()
+        print(f'Loaded {count} exercises (with search triggers) in {time.perf_counter() - started:.1f}s')
+        
+        client = app.test_client()
+        for label, url in QUERIES:
+            print(f'{label:>22}: {timed(lambda: client.get(url)):8.2f} ms')
+        naive = timed(lambda: naive_search(conn, 'Hamstrings', 'Barbell'), repeat=3)
+        print(f'{"naive muscle+equipment":>22}: {naive:8.2f} ms')
+        conn.close()
+        context.pop()
+        app.extensions['db_pool'].close_all()
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000)
@@ -0,0 +1,119 @@
+"""Write throughput with the workout history split across shard databases.
+
+For each shard count, creates users spread over the shards, then starts
+PROCESSES worker processes, each with its own app (pools and writer threads,
+as under a multi-worker server) and THREADS client threads, that create
+workouts through POST /api/workouts for DURATION seconds. Reports committed
+writes per second and the speedup over a single database.
+
+Usage: python -m benchmarks.sharding [PROCESSES] [--shards 1 2 4] [--threads T]
+           [--duration S] [--synchronous NORMAL|FULL]   (run from backend/)
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.generate import BACKEND_DIR
+
+USERS_PER_SHARD = 16
+
+def shard_config(directory, shards, synchronous):
+    sys.path.insert(0, BACKEND_DIR)
+    import app as backend
+    pragmas = dict(backend.DEFAULT_CONFIG['DB_PRAGMAS'], synchronous=synchronous)
+    return backend, {
+        'DATABASE': os.path.join(directory, 'main.db'),
+        'SHARD_DATABASES': [os.path.join(directory, f'shard{index}.db') for index in range(1, shards)],
+        'DB_PRAGMAS': pragmas,
+        'METRICS_ENABLED': False
+    }
+
+def setup(directory, shards, synchronous):
+    backend, config = shard_config(directory, shards, synchronous)
+    app = backend.create_app(config)
+    client = app.test_client()
+    with app.app_context():
+        conn = backend.get_db_connection()
+        backend.seed_sample_data(conn)
+        conn.close()
+    # User ids map to shards by modulo, so consecutive ids fill every shard evenly
+    user_ids = [
+        client.post('/api/users', json={'name': f'Bench {index}', 'email': f'bench{index}@example.com'}).get_json()['id']
+        for index in range(USERS_PER_SHARD * shards)
+    ]
+    for pool in app.extensions['shards']['pools']:
+        pool.close_all()
+    return user_ids
+
+def worker(directory, shards, synchronous, user_ids, threads, start, duration, results):
+    backend, config = shard_config(directory, shards, synchronous)
+    app = backend.create_app(config)
+    counts = [0] * threads
+
+    def run(thread):
+        client = app.test_client()
+        index = thread
+        while time.time() < start:
+            time.sleep(0.001)
+        deadline = start + duration
+        while time.time() < deadline:
+            user_id = user_ids[index % len(user_ids)]
+            index += threads
+            response = client.post('/api/workouts', json={
+                'user_id': user_id, 'name': 'Bench', 'date': '2026-01-05', 'completed': True, 'duration': 45,
+                'exercises': [{'exercise_id': exercise_id, 'sets': 3, 'reps': 8, 'weight': 60}
+                              for exercise_id in (1, 2, 4)]
+            })
+            if response.status_code == 201:
+                counts[thread] += 1
+
+    pool = [threading.Thread(target=run, args=(thread,)) for thread in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    results.put(sum(counts))
+
+def measure(shards, processes, threads, duration, synchronous):
+    with tempfile.TemporaryDirectory() as directory:
+        user_ids = setup(directory, shards, synchronous)
+        results = multiprocessing.Queue()
+        # Each process takes every processes-th user, so all of them write to every shard
+        start = time.time() + 1
+        workers = [
+            multiprocessing.Process(target=worker, args=(
+                directory, shards, synchronous, user_ids[offset::processes], threads, start, duration, results
+            ))
+            for offset in range(processes)
+        ]
+        for process in workers:
+            process.start()
+        writes = sum(results.get() for _ in workers)
+        for process in workers:
+            process.join()
+        return writes / duration
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('processes', type=int, nargs='?', default=4)
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, default=4, help='client threads per process')
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--synchronous', default='NORMAL')
+    args = parser.parse_args()
+
+    print(f'{args.processes} processes x {args.threads} threads, synchronous={args.synchronous}')
+    print(f'{"shards":>6} {"writes/s":>10} {"speedup":>8}')
+    baseline = None
+    for shards in args.shards:
+        rate = measure(shards, args.processes, args.threads, args.duration, args.synchronous)
+        baseline = baseline or rate
+        print(f'{shards:>6} {rate:>10.0f} {rate / baseline:>7.2f}x')
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.getcwd())
+    main()
@@ -0,0 +1,84 @@
+"""Time-to-first-byte and peak RSS of streamed list responses vs the original buffered path.
+
+The buffered baseline is the pre-streaming handler: fetchall() then jsonify() of a list of dicts.
+
+Usage: python -m benchmarks.streaming [ROWS ...]   (run from backend/)
+"""
+import multiprocessing
+import os
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def create_app(directory):
+    sys.path.insert(0, BACKEND_DIR)
+    import app
+    return app.create_app({'DATABASE': os.path.join(directory, 'fitness_tracker.db')})
+
+def add_buffered_route(flask_app):
+    import app
+    from flask import jsonify
+    
+    def get_users_buffered():
+        conn = app.get_db_connection()
+        users = conn.execute('SELECT * FROM users').fetchall()
+        conn.close()
+        return jsonify([dict(user) for user in users])
+    
+    flask_app.add_url_rule('/benchmarks/users-buffered', 'get_users_buffered', get_users_buffered)
+
+def build_database(directory, rows):
+    # Create the app once so the migrations build the real schema, then bulk-fill users
+    create_app(directory)
+    conn = sqlite3.connect(os.path.join(directory, 'fitness_tracker.db'))
+    conn.executemany(
+        'INSERT INTO users (name, email, age, weight, height, goal) VALUES (?, ?, ?, ?, ?, ?)',
+        ((f'User {i:07d}', f'user{i}@example.com', 20 + i % 40, 60 + i % 50, 160 + i % 40,
+          'Build Muscle') for i in range(rows))
+    )
+    conn.commit()
+    conn.close()
+
+def measure(directory, path, results):
+    flask_app = create_app(directory)
+    add_buffered_route(flask_app)
+    client = flask_app.test_client()
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    response = client.get(path, buffered=False)
+    chunks = iter(response.response)
+    size = len(next(chunks))
+    first_byte = time.perf_counter() - started
+    for chunk in chunks:
+        size += len(chunk)
+    response.close()
+    total = time.perf_counter() - started
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss
+    results.put({'ttfb_ms': first_byte * 1000, 'total_ms': total * 1000,
+                 'peak_rss_mb': peak_rss / 1024, 'bytes': size})
+
+def run(sizes):
+    context = multiprocessing.get_context('spawn')
+    print(f'{"rows":>10} {"mode":>9} {"ttfb ms":>10} {"total ms":>10} {"peak rss MB":>12} {"bytes":>12}')
+    for rows in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            builder = context.Process(target=build_database, args=(directory, rows))
+            builder.start()
+            builder.join()
+            for label, path in (('buffered', '/benchmarks/users-buffered'), ('streamed', '/api/users?stream=1')):
+                # Each measurement runs in a fresh process so peak RSS is not shared
+                results = context.Queue()
+                worker = context.Process(target=measure, args=(directory, path, results))
+                worker.start()
+                result = results.get()
+                worker.join()
+                print(f'{rows:>10} {label:>9} {result["ttfb_ms"]:>10.1f} {result["total_ms"]:>10.1f} '
+                      f'{result["peak_rss_mb"]:>12.1f} {result["bytes"]:>12}')
+
+if __name__ == '__main__':
+    run([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
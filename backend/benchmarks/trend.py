@@ -0,0 +1,90 @@
+"""Latency of the exercise trend endpoint over long histories.
+
+Generates one user with a small exercise catalog, so the most logged exercise
+appears in most workouts, then times
+GET /api/users/<id>/exercises/<exercise_id>/trend with a cold cache and a warm
+one, and the NumPy computation against a per-row Python loop over the same
+query.
+
+Usage: python -m benchmarks.trend [WORKOUTS]   (run from backend/, default 5000)
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import date
+
+from benchmarks.generate import generate, load_app
+
+REPEAT = 10
+
+def best_ms(function, repeat=REPEAT):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def python_trend(backend, conn, user_id, exercise_id):
+    # The same weekly aggregates as a loop over sqlite3.Row objects
+    weeks = {}
+    for row in conn.execute(backend.TREND_SQL, (user_id, exercise_id)):
+        if row['day'] is None:
+            continue
+        week = weeks.setdefault(row['day'] // 7, [0, 0])
+        week[0] += row['sets'] * row['reps'] * row['weight']
+        week[1] = max(week[1], row['estimated_1rm'] or 0)
+    keys = sorted(weeks)
+    result = []
+    for index, key in enumerate(keys):
+        window = [weeks[k] for k in keys[max(0, index - backend.TREND_WINDOW + 1):index + 1]]
+        result.append({
+            'week_start': date.fromordinal(key * 7).isoformat(),
+            'volume': weeks[key][0],
+            'best_1rm': weeks[key][1],
+            'volume_avg': sum(week[0] for week in window) / len(window),
+            'best_1rm_avg': sum(week[1] for week in window) / len(window)
+        })
+    count = len(keys)
+    slope = None
+    if count > 1:
+        mean_x = sum(keys) / count
+        mean_y = sum(weeks[key][1] for key in keys) / count
+        spread = sum((key - mean_x) ** 2 for key in keys)
+        slope = sum((key - mean_x) * (weeks[key][1] - mean_y) for key in keys) / spread
+    return result, slope
+
+def run(workouts):
+    with tempfile.TemporaryDirectory() as directory:
+        # Workouts hold 3-8 exercises, so with 8 in the catalog each shows up often
+        generate(directory, users=1, workouts=workouts, years=workouts // 365 + 1, exercises=8)
+        backend, app = load_app(directory)
+        client = app.test_client()
+        with app.app_context():
+            conn = backend.get_db_connection()
+            user_id = conn.execute('SELECT id FROM users ORDER BY id DESC').fetchone()['id']
+            exercise_id, rows = conn.execute(
+                'SELECT exercise_id, COUNT(*) FROM workout_exercises GROUP BY exercise_id ORDER BY 2 DESC'
+            ).fetchone()
+            numpy_ms = best_ms(lambda: backend.exercise_trend(conn, user_id, exercise_id))
+            python_ms = best_ms(lambda: python_trend(backend, conn, user_id, exercise_id))
+            conn.close()
+        
+        url = f'/api/users/{user_id}/exercises/{exercise_id}/trend'
+        cache = app.extensions['trend_cache']
+        def cold():
+            cache.entries.clear()
+            client.get(url)
+        cold_ms = best_ms(cold)
+        warm_ms = best_ms(lambda: client.get(url))
+        
+        print(f'{rows} rows for one exercise')
+        print(f'computation: per-row Python {python_ms:.1f} ms, NumPy {numpy_ms:.1f} ms '
+              f'({python_ms / numpy_ms:.1f}x)')
+        print(f'endpoint: cold cache {cold_ms:.1f} ms, warm cache {warm_ms:.2f} ms')
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.getcwd())
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as backend
+
+@pytest.fixture
+def app(tmp_path):
+    app = backend.create_app({'DATABASE': str(tmp_path / 'fitness_tracker.db'), 'METRICS_ENABLED': False})
+    with app.app_context():
+        conn = backend.get_db_connection()
+        backend.seed_sample_data(conn)
+        conn.close()
+    yield app
+    for pool in app.extensions['shards']['pools']:
+        pool.close_all()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,79 @@
+import pytest
+
+import app as backend
+
+@pytest.fixture
+def archived(app, client):
+    # Three completed 2020 workouts for user 1, archived; returns their ids
+    ids = []
+    for day, weight in (('2020-03-02', 100), ('2020-03-09', 120), ('2020-03-16', 110)):
+        ids.append(client.post('/api/workouts', json={
+            'user_id': 1, 'name': 'Bench', 'date': day, 'completed': True, 'duration': 45,
+            'exercises': [{'exercise_id': 4, 'sets': 3, 'reps': 5, 'weight': weight},
+                          {'exercise_id': 1, 'sets': 3, 'reps': 20}]
+        }).get_json()['id'])
+    with app.app_context():
+        conn = backend.get_db_connection()
+        assert backend.archive_user_workouts(conn, 1, '2021-01-01') == (3, 6)
+        conn.close()
+    return ids
+
+def derived_state(client):
+    return (client.get('/api/users/1/stats?period=year').get_json(),
+            client.get('/api/users/1/records').get_json(),
+            client.get('/api/users/1/calendar?year=2020').get_json())
+
+def assert_rebuild_agrees(app, client):
+    state = derived_state(client)
+    with app.app_context():
+        conn = backend.get_db_connection()
+        backend.rebuild_rollups(conn)
+        conn.close()
+    assert derived_state(client) == state
+
+def bench_record(client):
+    return next(record for record in client.get('/api/users/1/records').get_json() if record['exercise_id'] == 4)
+
+def test_archived_workout_exercises_are_served(client, archived):
+    exercises = client.get(f'/api/workout-exercises/{archived[0]}').get_json()
+    assert [exercise['name'] for exercise in exercises] == ['Bench Press', 'Push-ups']
+    assert exercises[0]['weight'] == 100
+    assert client.get(f'/api/workout-exercises/{archived[0]}?fields=sets').get_json()[0] == {
+        'id': exercises[0]['id'], 'sets': 3
+    }
+
+def test_update_archived_workout(app, client, archived):
+    response = client.patch(f'/api/workouts/{archived[1]}', json={'name': 'Heavy bench', 'date': '2020-04-01'})
+    assert response.status_code == 200
+    workout = client.get(f'/api/workouts/{archived[1]}').get_json()
+    assert (workout['name'], workout['date'], len(workout['exercises'])) == ('Heavy bench', '2020-04-01', 2)
+    assert client.get(f'/api/workouts/{archived[0]}').get_json()['name'] == 'Bench'
+    assert '2020-04-01' in client.get('/api/users/1/calendar?year=2020').get_json()['days']
+    assert_rebuild_agrees(app, client)
+    with app.app_context():
+        conn = backend.get_db_connection()
+        assert backend.archive_user_workouts(conn, 1, '2021-01-01') == (1, 2)
+        conn.close()
+    assert client.get(f'/api/workouts/{archived[1]}').get_json()['name'] == 'Heavy bench'
+    assert_rebuild_agrees(app, client)
+
+def test_delete_archived_workout(app, client, archived):
+    assert bench_record(client)['max_weight'] == 120
+    assert client.delete(f'/api/workouts/{archived[1]}').status_code == 200
+    assert client.get(f'/api/workouts/{archived[1]}').status_code == 404
+    assert client.get(f'/api/workout-exercises/{archived[1]}').get_json() == []
+    assert bench_record(client)['max_weight'] == 110
+    assert client.get('/api/users/1/calendar?year=2020').get_json()['active_days'] == 2
+    assert_rebuild_agrees(app, client)
+
+def test_write_archived_workout_exercise(app, client, archived):
+    exercise_id = client.get(f'/api/workout-exercises/{archived[1]}').get_json()[0]['id']
+    assert client.patch(f'/api/workout-exercises/{exercise_id}', json={'weight': 90}).status_code == 200
+    assert bench_record(client)['max_weight'] == 110
+    assert client.delete(f'/api/workout-exercises/{exercise_id}').status_code == 200
+    assert len(client.get(f'/api/workout-exercises/{archived[1]}').get_json()) == 1
+    assert client.post('/api/workout-exercises', json={
+        'workout_id': archived[2], 'exercise_id': 2, 'sets': 3, 'reps': 10
+    }).status_code == 201
+    assert len(client.get(f'/api/workouts/{archived[2]}').get_json()['exercises']) == 3
+    assert_rebuild_agrees(app, client)
@@ -0,0 +1,26 @@
+import pytest
+
+@pytest.mark.parametrize('operations', [[1], ['x'], [None], [[]], [{'path': '/api/users', 'body': [1]}]])
+def test_batch_rejects_malformed_operations(client, operations):
+    response = client.post('/api/batch', json={'operations': operations})
+    assert response.status_code == 400
+
+def test_batch_rejects_non_object_payload(client):
+    assert client.post('/api/batch', json=[1]).status_code == 400
+
+def test_batch_shard_rejects_malformed_operations(tmp_path):
+    from app import ApiError, batch_shard, create_app
+    app = create_app({
+        'DATABASE': str(tmp_path / 'main.db'),
+        'SHARD_DATABASES': [str(tmp_path / 'shard-1.db')],
+        'METRICS_ENABLED': False
+    })
+    try:
+        with app.test_request_context():
+            with pytest.raises(ApiError):
+                batch_shard(app.url_map.bind(''), [{'path': '/api/users'}, 1])
+        response = app.test_client().post('/api/batch', json={'operations': [{'path': '/api/users'}, 1]})
+        assert response.status_code == 400
+    finally:
+        for pool in app.extensions['shards']['pools']:
+            pool.close_all()
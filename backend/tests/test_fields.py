@@ -0,0 +1,14 @@
+from app import compile_row_encoder
+
+def test_field_orderings_share_one_encoder(client):
+    client.post('/api/workouts', json={'user_id': 1, 'name': 'Push', 'date': '2026-10-01'})
+    first = client.get('/api/workouts?user_id=1&fields=name,date,duration&stream=0')
+    compiled = compile_row_encoder.cache_info().currsize
+    for fields in ('date,duration,name', 'duration,name,date', 'name,date,duration,name'):
+        response = client.get(f'/api/workouts?user_id=1&fields={fields}&stream=0')
+        assert response.data == first.data
+    assert compile_row_encoder.cache_info().currsize == compiled
+    assert list(first.get_json()[0]) == ['id', 'name', 'date', 'duration']
+
+def test_encoder_cache_is_bounded():
+    assert compile_row_encoder.cache_info().maxsize is not None
@@ -0,0 +1,23 @@
+import json
+
+import pytest
+
+WORKOUT = json.dumps({'type': 'workout', 'data': {'id': 7, 'name': 'Push', 'date': '2026-10-01'}})
+
+@pytest.mark.parametrize('line, error', [
+    ('[1]', 'Line 2 is not a JSON object'),
+    ('3', 'Line 2 is not a JSON object'),
+    ('"x"', 'Line 2 is not a JSON object'),
+    ('{"type": "workout", "data": [1]}', 'Record data on line 2 is not a JSON object'),
+    ('{"type": "workout"}', 'Record data on line 2 is not a JSON object'),
+])
+def test_import_rejects_non_object_lines(client, line, error):
+    response = client.post('/api/users/1/import', data=WORKOUT + '\n' + line + '\n')
+    assert response.status_code == 400
+    assert response.get_json()['error'] == error
+    assert client.get('/api/workouts?user_id=1').get_json() == []
+
+def test_import_round_trip(client):
+    response = client.post('/api/users/1/import', data=WORKOUT + '\n')
+    assert response.status_code == 201
+    assert response.get_json()['workouts'] == 1
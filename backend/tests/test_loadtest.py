@@ -0,0 +1,20 @@
+import json
+import re
+
+from benchmarks.loadtest import BASELINE, OPERATIONS
+
+def route_key(method, path):
+    return method, re.sub(r'<[^>]*>', '<>', path)
+
+def test_loadtest_covers_every_route(app):
+    covered = {route_key(*endpoint.split(' (')[0].split(' ', 1)) for endpoint, _, _, _ in OPERATIONS}
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint == 'static':
+            continue
+        methods = rule.methods - {'HEAD', 'OPTIONS'}
+        assert any(route_key(method, rule.rule) in covered for method in methods), rule.rule
+
+def test_baseline_has_every_operation():
+    with open(BASELINE) as f:
+        recorded = json.load(f)['endpoints']
+    assert {endpoint for endpoint, _, _, _ in OPERATIONS} <= set(recorded)
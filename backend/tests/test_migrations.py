@@ -0,0 +1,16 @@
+from app import MIGRATIONS, create_app, get_db_connection
+
+def test_create_app_leaves_pools_empty(tmp_path):
+    app = create_app({
+        'DATABASE': str(tmp_path / 'main.db'),
+        'SHARD_DATABASES': [str(tmp_path / 'shard-1.db')],
+        'METRICS_ENABLED': False
+    })
+    for pool in app.extensions['shards']['pools']:
+        assert pool.stats()['open'] == 0
+    with app.app_context():
+        conn = get_db_connection()
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == len(MIGRATIONS)
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    for pool in app.extensions['shards']['pools']:
+        pool.close_all()
@@ -0,0 +1,6 @@
+from benchmarks.query_plans import check_query_plans
+
+def test_route_statements_use_indexes():
+    checked, problems = check_query_plans()
+    assert checked
+    assert problems == []
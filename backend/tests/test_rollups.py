@@ -0,0 +1,38 @@
+import pytest
+
+@pytest.mark.parametrize('value', ['garbage', '2026-13-01', 20260105, None])
+def test_create_workout_rejects_invalid_date(client, value):
+    response = client.post('/api/workouts', json={'user_id': 1, 'name': 'Push', 'date': value})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Invalid date'
+
+def test_update_workout_rejects_invalid_date(client):
+    workout_id = client.post('/api/workouts', json={'user_id': 1, 'name': 'Push', 'date': '2026-10-01'}).get_json()['id']
+    assert client.patch(f'/api/workouts/{workout_id}', json={'date': 'garbage'}).status_code == 400
+    assert client.get(f'/api/workouts/{workout_id}').get_json()['date'] == '2026-10-01'
+
+def test_batch_rejects_invalid_date(client):
+    response = client.post('/api/batch', json={'operations': [
+        {'path': '/api/workouts', 'body': {'user_id': 1, 'name': 'Push', 'date': '2026-10-01'}},
+        {'path': '/api/workouts', 'body': {'user_id': 1, 'name': 'Pull', 'date': 'garbage'}},
+    ]})
+    assert response.status_code == 400
+
+def test_workout_with_time_counts_on_its_day(client):
+    client.post('/api/workouts', json={'user_id': 1, 'name': 'Push', 'date': '2026-10-01T07:30:00',
+                                       'completed': True, 'duration': 40})
+    calendar = client.get('/api/users/1/calendar?year=2026').get_json()
+    assert calendar['active_days'] == 1
+
+def test_legacy_invalid_date_is_left_out_of_rollups(app, client):
+    import app as backend
+    with app.app_context():
+        conn = backend.get_db_connection()
+        conn.execute("INSERT INTO workouts (user_id, name, date, completed) VALUES (1, 'Old', 'garbage', 1)")
+        conn.commit()
+        workout_id = conn.execute("SELECT id FROM workouts WHERE name = 'Old'").fetchone()['id']
+        conn.close()
+    assert client.patch(f'/api/workouts/{workout_id}', json={'completed': False}).status_code == 200
+    assert client.delete(f'/api/workouts/{workout_id}').status_code == 200
+    result = app.test_cli_runner().invoke(args=['rebuild-rollups'])
+    assert result.exit_code == 0, result.output
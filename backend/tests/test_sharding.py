@@ -0,0 +1,61 @@
+import sqlite3
+
+import pytest
+
+from app import create_app
+
+def start(tmp_path, shards):
+    app = create_app({
+        'DATABASE': str(tmp_path / 'main.db'),
+        'SHARD_DATABASES': [str(tmp_path / f'shard-{shard}.db') for shard in range(1, shards)],
+        'METRICS_ENABLED': False
+    })
+    for pool in app.extensions['shards']['pools']:
+        pool.close_all()
+    return app
+
+def settings(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'main.db')
+    row = conn.execute('SELECT shards, max_shard FROM shard_settings').fetchone()
+    conn.close()
+    return row
+
+def test_placements_raise_max_shard(tmp_path):
+    app = start(tmp_path, 3)
+    client = app.test_client()
+    for index in range(3):
+        client.post('/api/users', json={'name': f'User {index}', 'email': f'user{index}@example.com'})
+    for pool in app.extensions['shards']['pools']:
+        pool.close_all()
+    assert settings(tmp_path) == (3, 2)
+    with pytest.raises(RuntimeError):
+        start(tmp_path, 2)
+
+def test_shrinking_recounts_stale_max_shard(tmp_path):
+    app = start(tmp_path, 3)
+    client = app.test_client()
+    for index in range(3):
+        client.post('/api/users', json={'name': f'User {index}', 'email': f'user{index}@example.com'})
+    for pool in app.extensions['shards']['pools']:
+        pool.close_all()
+    # As if the user on shard 2 had been deleted: max_shard stays at 2
+    conn = sqlite3.connect(tmp_path / 'main.db')
+    conn.execute('DELETE FROM users WHERE id IN (SELECT user_id FROM user_shards WHERE shard = 2)')
+    conn.execute('DELETE FROM user_shards WHERE shard = 2')
+    conn.commit()
+    conn.close()
+    start(tmp_path, 2)
+    assert settings(tmp_path) == (2, 1)
+
+def test_metrics_report_every_shard_pool(tmp_path):
+    app = start(tmp_path, 3)
+    client = app.test_client()
+    for index in range(3):
+        client.post('/api/users', json={'name': f'User {index}', 'email': f'user{index}@example.com'})
+    text = client.get('/api/metrics').get_data(as_text=True)
+    for pool in app.extensions['shards']['pools']:
+        pool.close_all()
+    assert text.count('# TYPE db_pool_size gauge') == 1
+    for shard in range(3):
+        assert f'db_pool_size{{shard="{shard}"}} ' in text
+        assert f'db_pool_open{{shard="{shard}"}} ' in text
@@ -0,0 +1,42 @@
+from datetime import date
+
+import pytest
+
+@pytest.fixture
+def workout_id(client):
+    return client.post('/api/workouts', json={
+        'user_id': 1, 'name': 'Push', 'date': '2026-10-01',
+        'exercises': [{'exercise_id': 1, 'sets': 3, 'reps': 10}]
+    }).get_json()['id']
+
+@pytest.fixture
+def template_id(client, workout_id):
+    return client.post('/api/workout-templates', json={'workout_id': workout_id}).get_json()['id']
+
+@pytest.mark.parametrize('body', [{'date': None}, {}])
+def test_clone_defaults_to_today(client, workout_id, body):
+    response = client.post(f'/api/workouts/{workout_id}/clone', json=body)
+    assert response.status_code == 201
+    clone = client.get(f'/api/workouts/{response.get_json()["id"]}').get_json()
+    assert clone['date'] == date.today().isoformat()
+
+@pytest.mark.parametrize('value', [20261001, 'garbage', ['2026-10-01']])
+def test_clone_rejects_invalid_date(client, workout_id, value):
+    response = client.post(f'/api/workouts/{workout_id}/clone', json={'date': value})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Invalid date'
+
+def test_start_template_defaults_to_today(client, template_id):
+    assert client.post(f'/api/workout-templates/{template_id}/workouts', json={'date': None}).status_code == 201
+
+@pytest.mark.parametrize('value', [20261001, 'garbage'])
+def test_start_template_rejects_invalid_date(client, template_id, value):
+    response = client.post(f'/api/workout-templates/{template_id}/workouts', json={'date': value})
+    assert response.status_code == 400
+
+@pytest.mark.parametrize('body', [[1], 3, 'x', True])
+def test_clone_and_start_reject_non_object_body(client, workout_id, template_id, body):
+    for path in (f'/api/workouts/{workout_id}/clone', f'/api/workout-templates/{template_id}/workouts'):
+        response = client.post(path, json=body)
+        assert response.status_code == 400
+        assert response.get_json()['error'] == 'Request body must be a JSON object'
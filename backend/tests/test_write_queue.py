@@ -0,0 +1,47 @@
+import sqlite3
+import time
+
+import pytest
+
+from app import WriteQueue
+
+class BrokenConnection:
+    # Fails to commit and then to roll back, like a database gone read-only
+    isolation_level = None
+    in_transaction = True
+    
+    def execute(self, sql, parameters=()):
+        if sql in ('COMMIT', 'ROLLBACK'):
+            raise sqlite3.OperationalError('disk I/O error')
+    
+    def close(self):
+        pass
+
+class Pool:
+    def __init__(self, *connections):
+        self.connections = list(connections)
+    
+    def _connect(self):
+        return self.connections.pop(0)
+
+def test_writer_survives_failed_rollback():
+    write_queue = WriteQueue(Pool(BrokenConnection(), sqlite3.connect(':memory:', check_same_thread=False)), 0, 64, 5)
+    with pytest.raises(sqlite3.OperationalError):
+        write_queue.submit(lambda conn: 1)
+    assert write_queue.submit(lambda conn: 2) == 2
+    assert write_queue.stats()['failed_batches'] == 1
+
+def test_writer_survives_base_exception():
+    def write(conn):
+        raise SystemExit
+    write_queue = WriteQueue(Pool(sqlite3.connect(':memory:', check_same_thread=False)), 0, 64, 5)
+    with pytest.raises(SystemExit):
+        write_queue.submit(write)
+    assert write_queue.submit(lambda conn: 3) == 3
+
+def test_submit_times_out():
+    write_queue = WriteQueue(Pool(sqlite3.connect(':memory:', check_same_thread=False)), 0, 64, 0.05)
+    with pytest.raises(sqlite3.OperationalError):
+        write_queue.submit(lambda conn: time.sleep(0.2))
+    time.sleep(0.3)
+    assert write_queue.submit(lambda conn: 4) == 4